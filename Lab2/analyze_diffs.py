@@ -1,85 +1,583 @@
 import pandas as pd
-from pydriller import Repository
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 import torch
+import argparse
+import time
+import sys
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.batching import length_buckets
+from common.model_cache import ModelCache, DEFAULT_CACHE_PATH
+from common.dataset_store import DatasetStore, blob_key
+from common.git_repo import GitRepository
+from common import inference, instrumentation
+from common.pipeline import Pipeline, PerThread, Stage, QUEUE_SIZE
+from common.streaming import CsvAppender, chunked, CHUNK_SIZE
+from near_duplicates import NearDuplicateIndex, cluster_diffs
+from diff_compaction import DiffCompactor, output_length, TOKEN_BUDGET
+
 # --- Configuration ---
 REPO_PATH = "apprise"
 INPUT_CSV = "bug_fixing_commits.csv"
 OUTPUT_CSV = "diff_analysis.csv"
 MODEL_NAME = "mamiksik/CommitPredictorT5" # The model specified in your assignment
-LIMIT = 20  # Limit to 20 commits to save time on the VM
+LIMIT = None        # Set to a number (e.g. 20) to only process the first N commits
+BATCH_SIZE = 16     # Number of diffs sent to model.generate at once
+THREADS = None      # torch intra-op threads (None = torch's default)
+INTEROP_THREADS = None  # torch inter-op threads (None = torch's default)
+TOKENIZER_THREADS = 2  # Threads tokenizing diffs in --pipeline mode
+BUCKET_BATCHES = 4  # Batches sorted by length together in --pipeline mode
+NEAR_DUPLICATE_THRESHOLD = 0.9  # Diffs at least this similar share one generated message
+MAX_INPUT_LENGTH = 512
+MAX_OUTPUT_LENGTH = 50
+COMPACTION_SAMPLE = 16  # With --compact, diffs re-run uncompacted to measure the speedup (0 = skip)
+# Everything that changes the generated text is part of the cache key
+GENERATION_PARAMS = {"max_input_length": MAX_INPUT_LENGTH, "max_length": MAX_OUTPUT_LENGTH}
+
+def generation_params(compactor=None):
+    """Cache key parameters of the messages, with or without diff compaction."""
+    if compactor is None:
+        return GENERATION_PARAMS
+    return {**GENERATION_PARAMS, "max_length": "by-input", "compaction": compactor.params}
+
+def encode_diffs(diffs, tokenizer, compactor=None):
+    """
+    Tokenizes diffs once, without padding, truncated to the model's input
+    length. With a compactor, the diffs are compacted first, and truncated
+    to its token budget; the raw diffs' token counts are recorded with
+    the compactor.
+    """
+    if compactor is None:
+        with instrumentation.timer("tokenize"):
+            return tokenizer(list(diffs), max_length=MAX_INPUT_LENGTH, truncation=True)["input_ids"]
+
+    diffs = list(diffs)
+    with instrumentation.timer("compact"):
+        compacted = [compactor.compact(diff, tokenizer) for diff in diffs]
+    with instrumentation.timer("tokenize"):
+        raw_lengths = [len(ids) for ids in tokenizer(diffs, verbose=False)["input_ids"]]
+        input_ids = tokenizer(compacted, max_length=compactor.budget, truncation=True)["input_ids"]
+    compactor.encoded(diffs, raw_lengths, input_ids)
+    return input_ids
+
+def generate_from_ids(input_ids, tokenizer, model, batch_size=BATCH_SIZE, by_input=False):
+    """
+    Runs model.generate on padded, length-bucketed batches of token ids.
+    Returns the messages in input order. With by_input, generate's
+    max_length follows the input length (see output_length), so short
+    inputs stop early; a batch is split where that length changes.
+    """
+    messages = [""] * len(input_ids)
+    for bucket in length_buckets([len(ids) for ids in input_ids], batch_size):
+        if by_input:
+            lengths = {}
+            for j in bucket:
+                lengths.setdefault(output_length(len(input_ids[j]), MAX_OUTPUT_LENGTH), []).append(j)
+        else:
+            lengths = {MAX_OUTPUT_LENGTH: bucket}
+
+        for max_length, batch in lengths.items():
+            features = [{"input_ids": input_ids[j]} for j in batch]
+            inputs = tokenizer.pad(features, return_tensors="pt")
+
+            with torch.inference_mode(), instrumentation.timer("generate"):
+                outputs = model.generate(**inputs, max_length=max_length)
+
+            # Map each output back to the row it came from
+            for j, text in zip(batch, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+                messages[j] = text
+
+    instrumentation.count("generated", len(input_ids))
+    return messages
+
+def generate_messages(diffs, tokenizer, model, batch_size=BATCH_SIZE, compactor=None):
+    """
+    Generates a commit message for every diff, running model.generate on
+    padded, length-bucketed batches. Returns the messages in input order;
+    empty diffs get an empty message. With a compactor, the model sees
+    the compacted diffs and generate's max_length follows their length.
+    """
+    messages = [""] * len(diffs)
+    todo = [i for i, diff in enumerate(diffs) if diff]
+    if not todo:
+        return messages
+
+    input_ids = encode_diffs([diffs[i] for i in todo], tokenizer, compactor)
+    for i, text in zip(todo, generate_from_ids(input_ids, tokenizer, model, batch_size, compactor is not None)):
+        messages[i] = text
+
+    return messages
+
+def generate_messages_cached(diffs, tokenizer, model, cache, batch_size=BATCH_SIZE, model_name=MODEL_NAME,
+                             compactor=None):
+    """
+    Like generate_messages, but looks every diff up in the cache first and
+    only sends the misses to the model. `model_name` keys the cache.
+    """
+    if cache is None:
+        return generate_messages(diffs, tokenizer, model, batch_size, compactor)
+
+    params = generation_params(compactor)
+    messages = [""] * len(diffs)
+    missing = {}  # diff text -> rows waiting for it
+    for i, diff in enumerate(diffs):
+        if not diff:
+            continue
+        cached = cache.get_text(model_name, params, diff)
+        if cached is None:
+            missing.setdefault(diff, []).append(i)
+        else:
+            messages[i] = cached
+
+    texts = list(missing)
+    generated = generate_messages(texts, tokenizer, model, batch_size, compactor)
+    for diff, message in zip(texts, generated):
+        cache.put_text(model_name, params, diff, message)
+        for i in missing[diff]:
+            messages[i] = message
+
+    return messages
+
+def mine_rows(repo_path, target_hashes):
+    """
+    Yields one row per changed Python file of the target commits, in
+    history order, read through long-lived git processes. The message is
+    filled in later.
+    """
+    repo = GitRepository(repo_path)
+    try:
+        for commit in repo.traverse_commits(only=target_hashes):
+
+            print(f"Analyzing commit: {commit.hash[:7]}")
+
+            for mod_file in repo.modified_files(commit, patch=True):
+                # We mostly care about code files (e.g., Python), skip images/binaries
+                if mod_file.filename.endswith('.py'):
+                    yield {
+                        "Hash": commit.hash,
+                        "Original_Message": commit.msg,
+                        "Filename": mod_file.filename,
+                        "Source_Code_Before": mod_file.source_code_before,
+                        "Source_Code_Current": mod_file.source_code,
+                        "Diff": mod_file.diff,
+                        "LLM_Rectified_Message": ""
+                    }
+    finally:
+        repo.close()
+
+class MessagePlan:
+    """
+    Decides, row by row as rows stream in, which diff each row takes its
+    message from (its own, or its near-duplicate cluster representative's)
+    and which of those diffs still need the model. Gives the same clusters
+    as cluster_diffs, since both see the diffs in the same order.
+
+    Diffs are remembered by content hash only, so what the plan holds grows
+    with the number of distinct diffs but not with their size. The first
+    `sample_size` distinct diffs are kept whole, for the drift check. With
+    a compactor, the diffs sent to the model are compacted first.
+    """
+
+    def __init__(self, cache, model_name, near_duplicate_threshold=None, sample_size=0, compactor=None):
+        self.cache = cache
+        self.model_name = model_name
+        self.compactor = compactor
+        self.params = generation_params(compactor)
+        self.index = None if near_duplicate_threshold is None else NearDuplicateIndex(near_duplicate_threshold)
+        self.clusters = {}         # diff hash -> cluster id
+        self.representatives = []  # Hash of each cluster's representative diff
+        self.messages = {}         # diff hash -> message (None while the model is on it)
+        self.sample_size = sample_size
+        self.sample = []           # First distinct diffs taken from the cache or sent to the model
+
+    def plan(self, rows):
+        """
+        Turns rows into pipeline entries: {"row", "key" (hash of the diff to
+        take the message from), "request" (the row's diff must go to the
+        model), "ids"}.
+        """
+        entries = []
+        for row in rows:
+            diff = row["Diff"]
+            key = blob_key(diff) if diff else None
+            if self.index is not None:
+                cluster = ""
+                if key:
+                    cluster = self.clusters.get(key)
+                    if cluster is None:
+                        cluster, is_new = self.index.add(diff)
+                        if is_new:
+                            self.representatives.append(key)
+                        self.clusters[key] = cluster
+                    key = self.representatives[cluster]
+                row["Cluster_Id"] = cluster
+
+            # A diff seen for the first time is always its own representative
+            request = False
+            if key and key not in self.messages:
+                if len(self.sample) < self.sample_size:
+                    self.sample.append(diff)
+                cached = self.cache.get_text(self.model_name, self.params, diff) if self.cache else None
+                self.messages[key] = cached
+                request = cached is None
+            entries.append({"row": row, "key": key, "request": request, "ids": None})
+        return entries
+
+    def record(self, entry, message):
+        """Stores the message generated for an entry's diff (and caches it)."""
+        self.messages[entry["key"]] = message
+        if self.cache is not None:
+            self.cache.put_text(self.model_name, self.params, entry["row"]["Diff"], message)
+
+    def finish(self, entry):
+        """The entry's row, with its message filled in."""
+        row = entry["row"]
+        row["LLM_Rectified_Message"] = self.messages[entry["key"]] if entry["key"] else ""
+        return row
+
+    def message(self, diff):
+        return self.messages[blob_key(diff)] if diff else ""
+
+def streamed_messages(repo_path, target_hashes, tokenizer, model, plan, args):
+    """
+    Mines the commits and generates messages one chunk of --chunk-size
+    rows at a time. Yields the rows, with their messages, in history order.
+    """
+    for rows in chunked(mine_rows(repo_path, target_hashes), args.chunk_size):
+        entries = plan.plan(rows)
+        todo = [entry for entry in entries if entry["request"]]
+        if todo:
+            input_ids = encode_diffs([entry["row"]["Diff"] for entry in todo], tokenizer, plan.compactor)
+            messages = generate_from_ids(input_ids, tokenizer, model, args.batch_size, plan.compactor is not None)
+            for entry, message in zip(todo, messages):
+                plan.record(entry, message)
+        for entry in entries:
+            yield plan.finish(entry)
+
+def pipelined_messages(repo_path, target_hashes, tokenizer, model, plan, args):
+    """
+    Mines the commits, tokenizes the diffs on a thread pool and generates
+    messages in batches, all at the same time, with bounded queues in
+    between. Returns (generator of the rows with their messages, the
+    Pipeline for its report).
+    """
+    tokenizers = PerThread(tokenizer)
+
+    def tokenize(entries):
+        todo = [entry for entry in entries if entry["request"]]
+        if todo:
+            input_ids = encode_diffs([entry["row"]["Diff"] for entry in todo], tokenizers.get(), plan.compactor)
+            for entry, ids in zip(todo, input_ids):
+                entry["ids"] = ids
+        return entries
+
+    def generate(entries):
+        todo = [entry for entry in entries if entry["request"]]
+        if todo:
+            texts = generate_from_ids([entry["ids"] for entry in todo], tokenizer, model, args.batch_size,
+                                      plan.compactor is not None)
+            for entry, message in zip(todo, texts):
+                plan.record(entry, message)
+        return entries
+
+    pipeline = Pipeline([
+        Stage("plan", plan.plan),
+        Stage("tokenize", tokenize, batch_size=args.batch_size, workers=args.tokenizer_threads),
+        # A few batches at a time, so length bucketing still has inputs to sort
+        Stage("generate", generate, batch_size=args.batch_size * BUCKET_BATCHES),
+    ], queue_size=args.queue_size, source_name="mine")
+
+    rows = (plan.finish(entry) for entry in pipeline.run(mine_rows(repo_path, target_hashes)))
+    return rows, pipeline
+
+class Generation:
+    """
+    What a generation mode hands to analyze(): the rows (a list, or a
+    generator that mines and generates them as it is read) and the time
+    generation took, when it was measured apart from writing. After the
+    rows are written, `inputs` and `outputs` are the diffs sent to the model
+    and their messages (for the drift and compaction checks), and
+    `distinct`/`clusters` the near-duplicate counts.
+    """
+
+    def __init__(self, rows, elapsed=None, plan=None, pipeline=None):
+        self.rows = rows
+        self.elapsed = elapsed
+        self.plan = plan
+        self.pipeline = pipeline
+        self.inputs = self.outputs = []
+        self.distinct = self.clusters = 0
+
+    def collect(self):
+        """Reads the sample and the cluster counts off the plan, once its rows are consumed."""
+        if self.plan is not None:
+            self.inputs = self.plan.sample
+            self.outputs = [self.plan.message(diff) for diff in self.inputs]
+            self.distinct = len(self.plan.clusters)
+            self.clusters = len(self.plan.representatives)
+
+def mine_all(args, target_hashes):
+    """Mines every commit up front, for the modes that generate from the whole table."""
+    with instrumentation.stage("mine", "rows") as stage:
+        rows = list(mine_rows(args.repo, target_hashes))
+        stage.items = len(rows)
+    print(f"Generating messages for {len(rows)} diffs (batch size {args.batch_size})...")
+    return rows
+
+def batched_mode(args, target_hashes, tokenizer, model, plan):
+    """Mines every commit, then generates the messages of all diffs in length-sorted batches."""
+    rows = mine_all(args, target_hashes)
+    start = time.perf_counter()
+    with instrumentation.stage("generate", "diffs") as stage:
+        diffs = [row["Diff"] for row in rows]
+        messages = generate_messages_cached(diffs, tokenizer, model, plan.cache, args.batch_size, plan.model_name,
+                                            plan.compactor)
+        for row, message in zip(rows, messages):
+            row["LLM_Rectified_Message"] = message
+        stage.items = len(rows)
+    generation = Generation(rows, time.perf_counter() - start)
+    generation.inputs, generation.outputs = diffs, messages
+    return generation
+
+def clustered_mode(args, target_hashes, tokenizer, model, plan):
+    """
+    Mines every commit, clusters the near-identical diffs and only sends
+    each cluster's representative to the model; the rest reuse its message.
+    """
+    rows = mine_all(args, target_hashes)
+    start = time.perf_counter()
+    with instrumentation.stage("generate", "diffs") as stage:
+        diffs = [row["Diff"] for row in rows]
+        labels, representatives = cluster_diffs(diffs, args.near_duplicate_threshold)
+        inputs = [diffs[i] for i in representatives]
+        outputs = generate_messages_cached(inputs, tokenizer, model, plan.cache, args.batch_size, plan.model_name,
+                                           plan.compactor)
+        for row, cluster in zip(rows, labels):
+            row["LLM_Rectified_Message"] = "" if cluster is None else outputs[cluster]
+            row["Cluster_Id"] = "" if cluster is None else cluster
+        stage.items = len(rows)
+    generation = Generation(rows, time.perf_counter() - start)
+    generation.inputs, generation.outputs = inputs, outputs
+    generation.distinct = len(set(diff for diff in diffs if diff))
+    generation.clusters = len(representatives)
+    return generation
+
+def streamed_mode(args, target_hashes, tokenizer, model, plan):
+    """Mines and generates --chunk-size rows at a time (see streamed_messages)."""
+    print(f"Mining and generating messages {args.chunk_size} rows at a time (batch size {args.batch_size})...")
+    return Generation(streamed_messages(args.repo, target_hashes, tokenizer, model, plan, args), plan=plan)
+
+def pipelined_mode(args, target_hashes, tokenizer, model, plan):
+    """Mines, tokenizes and generates at the same time (see pipelined_messages)."""
+    print(f"Mining and generating messages in a pipeline (batch size {args.batch_size}, "
+          f"{args.tokenizer_threads} tokenizer threads)...")
+    rows, pipeline = pipelined_messages(args.repo, target_hashes, tokenizer, model, plan, args)
+    return Generation(rows, plan=plan, pipeline=pipeline)
+
+def report_compaction(diffs, tokenizer, model, compactor):
+    """
+    Generates the message of each diff on its own, from the raw diff and
+    from the compacted one, and prints the input tokens and time of both.
+    """
+    compactor = DiffCompactor(compactor.budget, compactor.context, compactor.input_length)  # Keeps its counts apart
+    print(f"Compaction speedup, measured on a sample of the first {len(diffs)} distinct diffs (raw -> compacted):")
+    totals = [0.0, 0.0]
+    for number, diff in enumerate(diffs, 1):
+        measured = []
+        for diff_compactor in (None, compactor):
+            start = time.perf_counter()
+            input_ids = encode_diffs([diff], tokenizer, diff_compactor)
+            generate_from_ids(input_ids, tokenizer, model, 1, diff_compactor is not None)
+            measured.append((len(input_ids[0]), time.perf_counter() - start))
+        (raw_tokens, raw_seconds), (tokens, seconds) = measured
+        totals[0] += raw_seconds
+        totals[1] += seconds
+        print(f"   diff {number}: {raw_tokens} -> {tokens} tokens, {raw_seconds:.3f}s -> {seconds:.3f}s "
+              f"({raw_seconds / max(seconds, 1e-9):.2f}x)")
+    print(f"   Overall, on this sample only: {totals[0]:.2f}s -> {totals[1]:.2f}s "
+          f"({totals[0] / max(totals[1], 1e-9):.2f}x faster).")
+
+def token_columns(rows, compactor):
+    """
+    Adds the input tokens each row's diff took without and with compaction
+    (left empty for diffs that did not go to the model: cached, or only
+    near-duplicates of another diff).
+    """
+    for row in rows:
+        tokens = compactor.tokens(row["Diff"]) if row["Diff"] else None
+        row["Input_Tokens_Raw"], row["Input_Tokens_Compacted"] = tokens or ("", "")
+        yield row
+
+def write_rows(rows, path, chunk_size):
+    """Writes rows to a CSV file chunk by chunk. Returns the number of rows."""
+    with CsvAppender(path) as writer:
+        for chunk in chunked(rows, chunk_size):
+            writer.append(pd.DataFrame(chunk))
+    return writer.rows
+
+def save_rows(rows, args):
+    """
+    Writes the rows to --output (--chunk-size rows at a time with --stream)
+    and, with --store, to a dataset store. Returns the number of rows.
+    """
+    if args.stream:
+        return write_rows(rows, args.output, args.chunk_size)
+    output_df = pd.DataFrame(list(rows))
+    output_df.to_csv(args.output, index=False)
+    if args.store:
+        DatasetStore.create(args.store, output_df)
+    return len(output_df)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate commit messages for bug-fix diffs.")
+    parser.add_argument("--repo", default=REPO_PATH, help="Path to the git repository")
+    parser.add_argument("--input", default=INPUT_CSV, help="CSV of bug-fixing commits")
+    parser.add_argument("--output", default=OUTPUT_CSV, help="CSV file to write")
+    parser.add_argument("--limit", type=int, default=LIMIT,
+                        help="Only process the first N commits (default: all)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Number of diffs per model.generate call")
+    parser.add_argument("--model", default=MODEL_NAME, help="Model name or local model directory")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Run the model with dynamic int8 quantization of its linear layers")
+    parser.add_argument("--threads", type=int, default=THREADS, help="torch intra-op threads")
+    parser.add_argument("--interop-threads", type=int, default=INTEROP_THREADS,
+                        help="torch inter-op threads")
+    parser.add_argument("--drift-sample", type=int, default=inference.DRIFT_SAMPLE,
+                        help="With --quantize, diffs re-run in fp32 to report the drift (0 = skip)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap git mining, tokenization and generation in a staged pipeline")
+    parser.add_argument("--tokenizer-threads", type=int, default=TOKENIZER_THREADS,
+                        help="Threads tokenizing diffs in --pipeline mode")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="Items held between two pipeline stages (caps memory)")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="Cluster near-identical diffs (MinHash/LSH over their changed lines) and "
+                             "generate one message per cluster; adds a Cluster_Id column")
+    parser.add_argument("--near-duplicate-threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD,
+                        help="Estimated Jaccard similarity at which a diff joins a cluster")
+    parser.add_argument("--compact", action="store_true",
+                        help="Compact diffs before tokenization (trimmed context, whitespace-only hunks "
+                             "collapsed, most informative hunks within --token-budget) and size generate's "
+                             "max_length by the input; adds Input_Tokens_Raw/Input_Tokens_Compacted columns")
+    parser.add_argument("--token-budget", type=int, default=TOKEN_BUDGET,
+                        help="Input tokens a compacted diff may use")
+    parser.add_argument("--compaction-sample", type=int, default=COMPACTION_SAMPLE,
+                        help="With --compact, diffs re-run alone, raw and compacted, to measure the speedup "
+                             "on a sample (0 = skip)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Model output cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Always run the model")
+    parser.add_argument("--store", help="Also write the results as a dataset store "
+                                        "(sources and diffs stored once per distinct content)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Generate and write --chunk-size rows at a time instead of holding every "
+                             "source in memory (not with --store)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows per chunk in --stream mode")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    with instrumentation.Run("analyze_diffs", args):
+        analyze(args)
+
+def analyze(args):
     # 1. Load the list of bug commits we found earlier
-    if not os.path.exists(INPUT_CSV):
-        print(f"Error: {INPUT_CSV} not found. Please run the previous step first.")
+    if not os.path.exists(args.input):
+        print(f"Error: {args.input} not found. Please run the previous step first.")
         return
 
-    df = pd.read_csv(INPUT_CSV)
+    df = pd.read_csv(args.input)
     # Get unique commit hashes
     all_hashes = df["Hash"].unique().tolist()
-    
+
     # Limit the number of commits we process
-    target_hashes = all_hashes[:LIMIT]
-    print(f"Processing {len(target_hashes)} commits (Limit set to {LIMIT})...")
+    target_hashes = all_hashes[:args.limit] if args.limit else all_hashes
+    print(f"Processing {len(target_hashes)} commits (Limit set to {args.limit})...")
 
     # 2. Load the AI Model (LLM)
-    print(f"Loading AI Model ({MODEL_NAME})... this may take a moment.")
+    print(f"Loading AI Model ({args.model})... this may take a moment.")
+    threads = inference.configure_threads(args.threads, args.interop_threads)
     try:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-        model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+        with instrumentation.stage("load_model"):
+            tokenizer = AutoTokenizer.from_pretrained(args.model)
+            model, reference = inference.load_models(AutoModelForSeq2SeqLM, args.model, args.quantize)
     except Exception as e:
         print(f"Error loading model: {e}")
         return
+    precision = "int8 (dynamic)" if args.quantize else "fp32"
+    print(f"Running in {precision} on {threads[0]} intra-op / {threads[1]} inter-op threads.")
+    model_name = inference.cache_name(args.model, args.quantize)
+
+    # 3. Mine the specific commits, then 4. generate messages from all Diffs in batches
+    if args.stream and args.store:
+        print("Error: --store needs the whole table; import the --stream CSV with common/dataset_store.py instead.")
+        return
+    cache = None if args.no_cache else ModelCache(args.cache)
+    compactor = DiffCompactor(args.token_budget, input_length=MAX_INPUT_LENGTH) if args.compact else None
+    sample_size = max(args.drift_sample if reference is not None else 0,
+                      args.compaction_sample if compactor is not None else 0)
+    plan = MessagePlan(cache, model_name, args.near_duplicate_threshold if args.near_duplicates else None,
+                       sample_size, compactor)
+    if args.pipeline:
+        mode = pipelined_mode
+    elif args.stream:
+        mode = streamed_mode
+    elif args.near_duplicates:
+        mode = clustered_mode
+    else:
+        mode = batched_mode
+    start = time.perf_counter()
+    generation = mode(args, target_hashes, tokenizer, model, plan)
+
+    # 5. Save results (rows from a plan are mined and generated as they are written)
+    rows = generation.rows if compactor is None else token_columns(generation.rows, compactor)
+    stage_name, unit = ("write", "rows") if generation.plan is None else ("mine_and_generate", "diffs")
+    with instrumentation.stage(stage_name, unit) as stage:
+        stage.items = processed = save_rows(rows, args)
+    elapsed = generation.elapsed if generation.elapsed is not None else time.perf_counter() - start
+    generation.collect()
+
+    rate = processed / max(elapsed, 1e-9)
+    if generation.plan is not None:
+        print(f"Mined and generated {processed} diffs in {elapsed:.1f}s ({rate:.1f} diffs/sec).")
+        if generation.pipeline is not None:
+            print(generation.pipeline.report())
+    elif processed:
+        print(f"Inference took {elapsed:.1f}s ({rate:.1f} diffs/sec).")
+    if args.near_duplicates:
+        print(f"Near-duplicates: {generation.distinct} distinct diffs in {generation.clusters} clusters, "
+              f"{generation.distinct - generation.clusters} model calls saved.")
+    if compactor is not None:
+        print(compactor.report())
+
+    # Quality drift: the first distinct diffs sent to the model again, through the fp32 model
+    inputs = generation.inputs
+    if reference is not None and args.drift_sample > 0:
+        sample = list(dict.fromkeys(diff for diff in inputs if diff))[:args.drift_sample]
+        quantized = dict(zip(inputs, generation.outputs))
+        with instrumentation.stage("drift", "diffs") as stage:
+            expected = generate_messages_cached(sample, tokenizer, reference, cache, args.batch_size, args.model,
+                                                compactor)
+            stage.items = len(sample)
+        drift = inference.message_drift(expected, [quantized[diff] for diff in sample])
+        print(inference.format_drift(drift))
+
+    # Speedup of the compaction: the first distinct diffs sent to the model again, alone, raw and compacted
+    if compactor is not None and args.compaction_sample > 0:
+        sample = list(dict.fromkeys(diff for diff in inputs if diff))[:args.compaction_sample]
+        with instrumentation.stage("compaction_check", "diffs") as stage:
+            report_compaction(sample, tokenizer, model, compactor)
+            stage.items = len(sample)
+    if cache is not None:
+        print(cache.report())
+        cache.close()
 
-    results = []
-
-    # 3. Mine the specific commits
-    # pydriller can filter for specific commits using 'only_commits'
-    for commit in Repository(REPO_PATH, only_commits=target_hashes).traverse_commits():
-        
-        print(f"Analyzing commit: {commit.hash[:7]}")
-        
-        for mod_file in commit.modified_files:
-            # We mostly care about code files (e.g., Python), skip images/binaries
-            if mod_file.filename.endswith('.py'):
-                
-                diff = mod_file.diff
-                source_before = mod_file.source_code_before
-                source_current = mod_file.source_code
-                
-                # 4. AI Inference: Generate message from Diff
-                if diff:
-                    # Prepare input for the AI
-                    input_text = diff
-                    inputs = tokenizer(input_text, return_tensors="pt", max_length=512, truncation=True)
-                    
-                    # Generate output
-                    with torch.no_grad():
-                        outputs = model.generate(**inputs, max_length=50)
-                    
-                    rectified_msg = tokenizer.decode(outputs[0], skip_special_tokens=True)
-                else:
-                    rectified_msg = ""
-
-                # Store data
-                results.append({
-                    "Hash": commit.hash,
-                    "Original_Message": commit.msg,
-                    "Filename": mod_file.filename,
-                    "Source_Code_Before": source_before,
-                    "Source_Code_Current": source_current,
-                    "Diff": diff,
-                    "LLM_Rectified_Message": rectified_msg
-                })
-
-    # 5. Save results
-    output_df = pd.DataFrame(results)
-    output_df.to_csv(OUTPUT_CSV, index=False)
-    print(f"Done! Processed {len(output_df)} file changes.")
-    print(f"Results saved to {OUTPUT_CSV}")
+    print(f"Done! Processed {processed} file changes.")
+    print(f"Results saved to {args.output}")
+    if args.store:
+        print(f"Dataset store written to {args.store}")
 
 if __name__ == "__main__":
     main()
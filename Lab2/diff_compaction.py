@@ -0,0 +1,173 @@
+import threading
+import hashlib
+import re
+
+# --- Configuration ---
+TOKEN_BUDGET = 256   # Input tokens a compacted diff may use (the model reads up to 512)
+CONTEXT_LINES = 1    # Unchanged lines kept on each side of a change
+MIN_OUTPUT_LENGTH = 24  # Smallest generate() max_length chosen for a short input
+OUTPUT_STEP = 8      # generate() max_length is a multiple of this, so batches share it
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@ ?(.*)$")
+WORD = re.compile(r"\w+")
+
+def split_hunks(diff):
+    """
+    [(section heading, body lines)] of a unified diff. File headers and
+    "\\ No newline" markers are dropped; a diff without any hunk header
+    gives [].
+    """
+    hunks = []
+    for line in diff.splitlines():
+        match = HUNK_HEADER.match(line)
+        if match:
+            hunks.append((match.group(1).strip(), []))
+        elif hunks and line[:1] in (" ", "+", "-", ""):
+            hunks[-1][1].append(line)
+    return hunks
+
+def is_whitespace_only(lines):
+    """True when the removed and added lines only differ in whitespace."""
+    removed = "".join("".join(line[1:].split()) for line in lines if line.startswith("-"))
+    added = "".join("".join(line[1:].split()) for line in lines if line.startswith("+"))
+    return removed == added
+
+def trim_context(lines, context=CONTEXT_LINES):
+    """Keeps the changed lines and up to `context` unchanged lines on each side of them."""
+    changed = [i for i, line in enumerate(lines) if line[:1] in ("+", "-")]
+    keep = set()
+    for i in changed:
+        keep.update(range(max(i - context, 0), min(i + context + 1, len(lines))))
+    return [line for i, line in enumerate(lines) if i in keep]
+
+def dedent(lines):
+    """Removes the indentation all lines share (after their +/-/space marker)."""
+    indents = [len(line[1:]) - len(line[1:].lstrip(" \t")) for line in lines if line[1:].strip()]
+    cut = min(indents, default=0)
+    return [line[:1] + line[1 + cut:] for line in lines]
+
+def information(lines):
+    """
+    How much a hunk says about the change: the number of distinct words
+    that appear on only one side of it (renamed identifiers, new calls,
+    changed literals...).
+    """
+    removed = set(WORD.findall(" ".join(line[1:] for line in lines if line.startswith("-"))))
+    added = set(WORD.findall(" ".join(line[1:] for line in lines if line.startswith("+"))))
+    return len(removed ^ added)
+
+def output_length(input_length, max_length):
+    """
+    generate() max_length for an input of input_length tokens, at most
+    max_length. Only inputs shorter than max_length get a lower cap (for
+    analyze_diffs.py, inputs under 50 tokens); longer ones keep max_length.
+    """
+    steps = -(-max(input_length, MIN_OUTPUT_LENGTH) // OUTPUT_STEP)
+    return min(steps * OUTPUT_STEP, max_length)
+
+def diff_key(diff):
+    return hashlib.sha1(diff.encode("utf-8", "surrogatepass")).hexdigest()
+
+class DiffCompactor:
+    """
+    Shrinks diffs before they are tokenized for the model:
+
+    1. hunk line numbers are dropped (the section heading stays);
+    2. only CONTEXT_LINES unchanged lines are kept around each change,
+       and the indentation shared by the remaining lines is removed;
+    3. hunks that only change whitespace are collapsed to their heading;
+    4. when the hunks still do not fit the token budget, the most
+       informative ones (see `information`) that fit are kept, in their
+       original order.
+
+    Diffs without hunks are left as they are. The tokens every distinct
+    diff takes with and without compaction (where the raw diff is cut at
+    `input_length`) are recorded, for tokens() and the report. compact()
+    and encoded() are safe to call from several threads.
+    """
+
+    def __init__(self, budget=TOKEN_BUDGET, context=CONTEXT_LINES, input_length=TOKEN_BUDGET):
+        self.budget = min(budget, input_length)
+        self.context = context
+        self.input_length = input_length
+        self.lock = threading.Lock()
+        self.hunks = {}   # diff key -> (whitespace-only hunks collapsed, hunks left out)
+        self.counts = {}  # diff key -> (raw tokens, compacted tokens)
+
+    @property
+    def params(self):
+        """Everything that changes a compacted diff, for cache keys."""
+        return {"budget": self.budget, "context": self.context, "version": 1}
+
+    def compact(self, diff, tokenizer):
+        """The compacted text of a diff, to be tokenized instead of the diff."""
+        hunks = split_hunks(diff)
+        if not hunks:
+            with self.lock:
+                self.hunks[diff_key(diff)] = (0, 0)
+            return diff
+
+        texts, scores = [], []
+        whitespace = 0
+        for heading, lines in hunks:
+            header = f"@@ {heading}".rstrip()
+            if is_whitespace_only(lines):
+                whitespace += 1
+                texts.append(header)
+                scores.append(0)
+            else:
+                texts.append("\n".join([header] + dedent(trim_context(lines, self.context))))
+                scores.append(information(lines))
+
+        # Token cost of every hunk, in one call
+        lengths = [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+        # Special tokens and the newline joining two hunks also count
+        special = tokenizer.num_special_tokens_to_add()
+        budget = self.budget - special - len(hunks)
+        chosen = set()
+        used = 0
+        for i in sorted(range(len(texts)), key=lambda i: (-scores[i], i)):
+            if used + lengths[i] <= budget:
+                chosen.add(i)
+                used += lengths[i]
+        if not chosen:
+            # Nothing fits whole: the most informative hunk goes in, cut at the budget when tokenized
+            chosen.add(min(range(len(texts)), key=lambda i: (-scores[i], i)))
+
+        with self.lock:
+            self.hunks[diff_key(diff)] = (whitespace, len(texts) - len(chosen))
+        return "\n".join(texts[i] for i in sorted(chosen))
+
+    def encoded(self, diffs, raw_lengths, input_ids):
+        """
+        Records the tokens of each diff: raw_lengths are the untruncated
+        token counts of the raw diffs, input_ids what their compacted
+        versions were encoded to.
+        """
+        with self.lock:
+            for diff, raw, ids in zip(diffs, raw_lengths, input_ids):
+                self.counts[diff_key(diff)] = (raw, len(ids))
+
+    def tokens(self, diff):
+        """(input tokens without compaction, with compaction) of an encoded diff, or None."""
+        counts = self.counts.get(diff_key(diff))
+        return None if counts is None else (min(counts[0], self.input_length), counts[1])
+
+    def report(self):
+        with self.lock:
+            counts = list(self.counts.values())
+            hunks = list(self.hunks.values())
+        if not counts:
+            return "Diff compaction: no diffs compacted."
+        diffs = len(counts)
+        raw = sum(count[0] for count in counts)
+        before = sum(min(count[0], self.input_length) for count in counts)
+        after = sum(count[1] for count in counts)
+        savings = sorted(min(count[0], self.input_length) - count[1] for count in counts)
+        over_budget = sum(count[0] > self.input_length for count in counts)
+        return (f"Diff compaction: {before / diffs:.0f} -> {after / diffs:.0f} input tokens per diff on average "
+                f"({(before - after) / diffs:.0f} saved, {savings[diffs // 2]} for the median diff, "
+                f"{savings[0]} to {savings[-1]}; raw diffs average {raw / diffs:.0f}, {over_budget} of {diffs} "
+                f"were cut at {self.input_length}), {sum(count[0] for count in hunks)} whitespace-only hunks "
+                f"collapsed, {sum(count[1] for count in hunks)} hunks left out for the {self.budget}-token budget.")
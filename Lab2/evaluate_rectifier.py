@@ -1,10 +1,21 @@
+from scipy import sparse
 import pandas as pd
+import numpy as np
+import argparse
+import time
+import sys
+import os
 import re
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.dataset_store import DatasetStore
+from common import instrumentation
+
 # --- Configuration ---
 INPUT_CSV = "diff_analysis.csv"
 OUTPUT_CSV = "final_evaluation.csv"
 SIMILARITY_THRESHOLD = 0.2  # If similarity is below 20%, we say the Dev message was bad.
+INPUT_COLUMNS = ["Original_Message", "LLM_Rectified_Message", "Diff"]
 
 def get_words(text):
     """Converts text to a set of lowercase words."""
@@ -25,11 +36,87 @@ def jaccard_similarity(text1, text2):
     union = len(set1.union(set2))
     return intersection / union
 
+def word_matrix(texts, vocabulary):
+    """
+    Tokenizes texts like get_words into a sparse binary matrix with one row
+    per text and one column per word of the shared vocabulary (which grows
+    as new words are seen). Each distinct text is tokenized only once.
+    """
+    distinct = {}
+    rows = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        rows[i] = distinct.setdefault(text, len(distinct))
+
+    indptr = [0]
+    indices = []
+    for text in distinct:
+        indices.extend(vocabulary.setdefault(word, len(vocabulary)) for word in get_words(text))
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                               shape=(len(distinct), max(len(vocabulary), 1)))
+    return matrix[rows]
+
+def batch_scores(dev_msgs, llm_msgs, diffs):
+    """
+    Scores all rows at once: returns the dev-vs-LLM Jaccard similarity
+    and the number of LLM words that also appear in the diff, per row.
+    Same values as jaccard_similarity and the set intersection.
+    """
+    vocabulary = {}
+    dev = word_matrix(dev_msgs, vocabulary)
+    llm = word_matrix(llm_msgs, vocabulary)
+    code = word_matrix(diffs, vocabulary)
+    # Words first seen in a later column widen the earlier matrices
+    for matrix in (dev, llm, code):
+        matrix.resize((matrix.shape[0], max(len(vocabulary), 1)))
+
+    dev_sizes = np.diff(dev.indptr)
+    llm_sizes = np.diff(llm.indptr)
+    common = np.asarray(dev.multiply(llm).sum(axis=1)).ravel()
+    overlaps = np.asarray(llm.multiply(code).sum(axis=1)).ravel()
+
+    scores = []
+    for inter, size1, size2 in zip(common.tolist(), dev_sizes.tolist(), llm_sizes.tolist()):
+        scores.append(inter / (size1 + size2 - inter) if size1 and size2 else 0.0)
+    return scores, overlaps.tolist()
+
+def rowwise_scores(dev_msgs, llm_msgs, diffs):
+    """The same scores, computed one row at a time with Python sets."""
+    scores = []
+    overlaps = []
+    for dev_msg, llm_msg, diff_code in zip(dev_msgs, llm_msgs, diffs):
+        scores.append(jaccard_similarity(dev_msg, llm_msg))
+        overlaps.append(len(get_words(llm_msg).intersection(get_words(diff_code))))
+    return scores, overlaps
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate developer vs LLM commit messages.")
+    parser.add_argument("--input", default=INPUT_CSV, help="CSV produced by analyze_diffs.py")
+    parser.add_argument("--output", default=OUTPUT_CSV, help="CSV file to write")
+    parser.add_argument("--store", help="Read from a dataset store and also add the evaluation "
+                                        "columns to it")
+    parser.add_argument("--rowwise", action="store_true",
+                        help="Score one row at a time with Python sets instead of "
+                             "sparse word matrices")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    with instrumentation.Run("evaluate_rectifier", args):
+        evaluate(args)
+
+def evaluate(args):
     try:
-        df = pd.read_csv(INPUT_CSV)
+        with instrumentation.stage("read") as stage:
+            if args.store:
+                store = DatasetStore(args.store)
+                df = store.read(INPUT_COLUMNS)
+            else:
+                df = pd.read_csv(args.input)
+            stage.items = len(df)
     except FileNotFoundError:
-        print("Error: diff_analysis.csv not found!")
+        print(f"Error: {args.store or args.input} not found!")
         return
 
     print(f"Evaluating {len(df)} changes...")
@@ -41,14 +128,20 @@ def main():
     llm_precise_count = 0
     rectified_count = 0
 
-    for index, row in df.iterrows():
-        dev_msg = str(row['Original_Message'])
-        llm_msg = str(row['LLM_Rectified_Message'])
-        diff_code = str(row['Diff'])
+    dev_msgs = [str(value) for value in df['Original_Message']]
+    llm_msgs = [str(value) for value in df['LLM_Rectified_Message']]
+    diffs = [str(value) for value in df['Diff']]
+
+    # 1. Calculate Similarity (Dev vs LLM) and the LLM/Diff word overlap for every row
+    start = time.perf_counter()
+    score_rows = rowwise_scores if args.rowwise else batch_scores
+    with instrumentation.stage("score") as stage:
+        scores, overlaps = score_rows(dev_msgs, llm_msgs, diffs)
+        stage.items = len(df)
+    print(f"Scored {len(df)} changes in {time.perf_counter() - start:.2f}s.")
+
+    for dev_msg, llm_msg, score, overlap in zip(dev_msgs, llm_msgs, scores, overlaps):
 
-        # 1. Calculate Similarity (Dev vs LLM)
-        score = jaccard_similarity(dev_msg, llm_msg)
-        
         # 2. Define "Precise" for Developer (RQ1)
         # If Dev message is similar to our 'Gold Standard' (LLM), it's precise.
         is_dev_precise = score >= SIMILARITY_THRESHOLD
@@ -58,10 +151,7 @@ def main():
         # 3. Define "Precise" for LLM (RQ2)
         # Does the LLM message actually mention words found in the code diff?
         # (e.g. function names, variable names)
-        diff_words = get_words(diff_code)
-        llm_words = get_words(llm_msg)
         # If LLM shares at least 1 meaningful word with the Diff code, we count it as relevant/precise
-        overlap = len(llm_words.intersection(diff_words))
         is_llm_precise = overlap > 0 
         if is_llm_precise:
             llm_precise_count += 1
@@ -85,7 +175,12 @@ def main():
         })
 
     # Save detailed results
-    pd.DataFrame(results).to_csv(OUTPUT_CSV, index=False)
+    with instrumentation.stage("write") as stage:
+        results_df = pd.DataFrame(results)
+        results_df.to_csv(args.output, index=False)
+        if args.store and len(results_df):
+            store.add_columns(results_df[["Similarity_Score", "Action_Taken", "Final_Message"]])
+        stage.items = len(results_df)
 
     # --- PRINT RESULTS FOR YOUR REPORT ---
     total = len(df)
@@ -112,7 +207,7 @@ def main():
     print(f"RQ3 (Rectifier Rate):      {rq3_rate:.1f}%")
     print(f"   -> The Rectifier had to fix the message in {rectified_count} cases.")
     print("="*40)
-    print(f"Detailed results saved to {OUTPUT_CSV}")
+    print(f"Detailed results saved to {args.output}")
 
 if __name__ == "__main__":
     main()
@@ -1,35 +1,117 @@
-from pydriller import Repository
+from multiprocessing import Pool
 import pandas as pd
+import argparse
+import subprocess
+import json
+import time
+import sys
+import re
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.git_repo import GitRepository
+from common import instrumentation
+
 # --- Configuration ---
 REPO_PATH = "apprise"  # The folder where you cloned flask
 KEYWORDS = ["fix", "bug", "issue", "resolve", "error", "patch"]
 OUTPUT_FILE = "bug_fixing_commits.csv"
+WORKERS = 1         # Number of processes used to scan the history
+CHUNK_SIZE = 200    # Number of commits in one range handed to a worker
+STATE_FILE = "identify_bugs_state.json"  # Last scanned HEAD per repository
+
+# One precompiled alternation instead of a Python loop of `in` checks
+KEYWORD_PATTERN = re.compile("|".join(re.escape(word) for word in KEYWORDS))
 
 def is_bug_fix(message):
     """Check if the commit message contains any bug keywords."""
-    msg_lower = message.lower()
-    for word in KEYWORDS:
-        if word in msg_lower:
-            return True
-    return False
+    return KEYWORD_PATTERN.search(message.lower()) is not None
 
-def main():
-    print(f"Scanning repository: {REPO_PATH}...")
-    
+def run_git(repo_path, *args):
+    """Runs a git command in the repository and returns its stdout."""
+    with instrumentation.timer("subprocess"):
+        result = subprocess.run(
+            ["git", *args], cwd=repo_path, capture_output=True, text=True, check=True
+        )
+    return result.stdout.strip()
+
+def list_commits(repo_path, target="HEAD", base=None):
+    """
+    Lists the commit hashes in the same order pydriller traverses them
+    (oldest first), without building any commit objects. When a base is
+    given, only the commits in base..target are listed.
+    """
+    rev = f"{base}..{target}" if base else target
+    return run_git(repo_path, "rev-list", "--reverse", rev).split()
+
+def is_ancestor(repo_path, ancestor, commit):
+    """Checks that the history up to `ancestor` was not rewritten."""
+    with instrumentation.timer("subprocess"):
+        result = subprocess.run(
+            ["git", "merge-base", "--is-ancestor", ancestor, commit],
+            cwd=repo_path, capture_output=True
+        )
+    return result.returncode == 0
+
+def load_state(state_file):
+    """Loads the checkpoints of every repository scanned so far."""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+def save_state(state_file, state):
+    """Writes the checkpoints atomically, so a crash never leaves half a file."""
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, state_file)
+
+def drop_checkpoint(output_file):
+    """Starts a full scan over: removes the output and returns an empty checkpoint."""
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    return {}
+
+def read_known_hashes(output_file):
+    """Returns the hashes already saved in the output CSV."""
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        return set()
+    return set(pd.read_csv(output_file, usecols=["Hash"])["Hash"])
+
+def append_rows(output_file, rows):
+    """Appends rows to the output CSV, writing the header for a new file."""
+    if not rows:
+        return
+    write_header = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+    pd.DataFrame(rows).to_csv(output_file, mode="a", header=write_header, index=False)
+
+def split_ranges(hashes, chunk_size):
+    """Splits the history into consecutive commit ranges."""
+    return [hashes[i:i + chunk_size] for i in range(0, len(hashes), chunk_size)]
+
+# Handle on the repository (and its git processes), opened once per worker process
+_repo = None
+
+def init_worker(repo_path):
+    """Opens the repository in a worker process."""
+    global _repo
+    _repo = GitRepository(repo_path)
+
+def scan_range(hashes):
+    """Scans one range of commits and returns the bug-fixing ones, in order."""
+    repo = _repo
     data = []
-    
-    # pydriller iterates through every commit in history
-    # only_in_branch='main' ensures we look at the main history
-    for commit in Repository(REPO_PATH).traverse_commits():
-        
+
+    for commit_hash in hashes:
+        commit = repo.commit(commit_hash)
+
         # Check our criteria
         if is_bug_fix(commit.msg):
-            
+
             # Get list of modified filenames
-            file_list = [f.filename for f in commit.modified_files]
-            
+            file_list = [f.filename for f in repo.modified_files(commit)]
+
             # Store the info required by the assignment
             commit_info = {
                 "Hash": commit.hash,
@@ -40,13 +122,133 @@ def main():
             }
             data.append(commit_info)
 
-    # Save to CSV using Pandas
-    df = pd.DataFrame(data)
-    df.to_csv(OUTPUT_FILE, index=False)
-    
-    print(f"Success! Found {len(data)} bug-fixing commits.")
-    print(f"Saved results to {OUTPUT_FILE}")
+    instrumentation.count("commits", len(hashes))
+    instrumentation.count("bug_fixes", len(data))
+    return data
+
+def scan_ranges(repo_path, ranges, workers):
+    """
+    Scans the commit ranges, spreading them over a pool of workers.
+    Yields (range, rows) pairs in history order.
+    """
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(repo_path,)) as pool:
+            # imap keeps the ranges in submission order; the workers' timers come back with the rows
+            for commit_range, result in zip(ranges, pool.imap(instrumentation.measured(scan_range), ranges)):
+                yield commit_range, instrumentation.merged(result)
+    else:
+        init_worker(repo_path)
+        try:
+            for commit_range in ranges:
+                yield commit_range, scan_range(commit_range)
+        finally:
+            _repo.close()
+
+def scan_history(repo_path, output_file, state_file, workers, chunk_size, incremental):
+    """
+    Scans the history and appends bug-fixing commits to the output CSV.
+
+    A checkpoint is saved after every range, keyed by repository:
+    "head" is the last fully scanned HEAD, while "target"/"done" describe
+    a run in progress. An incremental run resumes an unfinished run and
+    then only scans head..HEAD; when the checkpointed commits are no longer
+    ancestors of HEAD, it drops the checkpoint and scans everything again.
+    Returns (commits scanned, rows found).
+    """
+    state = load_state(state_file)
+    key = os.path.abspath(repo_path)
+    entry = state.get(key, {})
+
+    if not incremental:
+        entry = drop_checkpoint(output_file)
+
+    known = read_known_hashes(output_file)
+    scanned = 0
+    found = 0
+
+    while True:
+        head = run_git(repo_path, "rev-parse", "HEAD")
+        # The checkpoint (and the rows found so far) only hold while the
+        # scanned commits are still part of the history
+        scanned_head = entry.get("target") or entry.get("head")
+        if scanned_head and not is_ancestor(repo_path, scanned_head, head):
+            print(f"History was rewritten since {scanned_head[:7]}, dropping the checkpoint "
+                  f"and rescanning everything.")
+            entry = drop_checkpoint(output_file)
+            known = set()
+        base = entry.get("head")
+        target = entry.get("target")
+        done = entry.get("done", 0)
+
+        if target is None:
+            if base == head:
+                break
+            target = head
+        else:
+            print(f"Resuming unfinished scan of {target[:7]} after {done} commits.")
+
+        hashes = list_commits(repo_path, target, base)[done:]
+        if base:
+            print(f"Scanning {len(hashes)} new commits since {base[:7]}...")
+
+        for commit_range, rows in scan_ranges(repo_path, split_ranges(hashes, chunk_size), workers):
+            rows = [row for row in rows if row["Hash"] not in known]
+            append_rows(output_file, rows)
+            known.update(row["Hash"] for row in rows)
+
+            done += len(commit_range)
+            entry = {"head": base, "target": target, "done": done}
+            state[key] = entry
+            save_state(state_file, state)
+
+            scanned += len(commit_range)
+            found += len(rows)
+
+        entry = {"head": target}
+        state[key] = entry
+        save_state(state_file, state)
+
+        # Commits may have landed while we were scanning
+        if not incremental:
+            break
+
+    # Leave an output file behind even when nothing was found
+    open(output_file, "a").close()
+    return scanned, found
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find bug-fixing commits in a repository.")
+    parser.add_argument("--repo", default=REPO_PATH, help="Path to the git repository")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="CSV file to write")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Number of worker processes (1 = scan in this process)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="Commits per range handed to a worker")
+    parser.add_argument("--state", default=STATE_FILE, help="Checkpoint file")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only scan commits since the last checkpoint and append them")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with instrumentation.Run("identify_bugs", args):
+        identify_bugs(args)
+
+def identify_bugs(args):
+    print(f"Scanning repository: {args.repo} with {args.workers} worker(s)...")
+
+    start = time.perf_counter()
+    with instrumentation.stage("scan", "commits") as stage:
+        total, found = scan_history(args.repo, args.output, args.state, args.workers,
+                                    args.chunk_size, args.incremental)
+        stage.items = total
+    elapsed = time.perf_counter() - start
+
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"Scanned {total} commits in {elapsed:.1f}s ({rate:.1f} commits/sec).")
+    print(f"Success! Found {found} new bug-fixing commits.")
+    print(f"Saved results to {args.output}")
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,111 @@
+import zlib
+import re
+
+import numpy as np
+
+# --- Configuration ---
+THRESHOLD = 0.9     # Estimated Jaccard similarity at which a diff joins a cluster
+NUM_PERM = 128      # MinHash functions per signature
+BANDS = 16          # LSH bands (of NUM_PERM // BANDS rows): pairs above ~0.7 become candidates
+SHINGLE_SIZE = 5    # Tokens per shingle
+SEED = 1
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+def normalize_diff(diff):
+    """
+    Keeps what makes two edits the same: the added and removed lines, in
+    order, with whitespace collapsed. Hunk line numbers and the context
+    around the change are dropped (a diff without such lines, e.g. a
+    binary one, is kept whole).
+    """
+    changed = [line for line in diff.splitlines() if line[:1] in ("+", "-")]
+    return " ".join(" ".join(changed or [diff]).split())
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Stable 32-bit hashes of the distinct token k-grams of a text."""
+    tokens = TOKEN.findall(text)
+    grams = {" ".join(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))}
+    return np.fromiter((zlib.crc32(gram.encode("utf-8", "surrogatepass")) for gram in grams),
+                       dtype=np.uint64, count=len(grams))
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures with LSH banding over normalized diffs.
+
+    Every diff is compared with the cluster representatives that share at
+    least one band with it, and joins the most similar one whose estimated
+    Jaccard similarity reaches the threshold; otherwise it starts a new
+    cluster. Members are always compared with the representative, never
+    with each other, so clusters cannot drift through chains of small
+    changes.
+    """
+
+    def __init__(self, threshold=THRESHOLD, num_perm=NUM_PERM, bands=BANDS, seed=SEED):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Multiply-shift hash functions (a odd), evaluated modulo 2**64
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self.buckets = [{} for _ in range(bands)]  # band hash -> cluster ids
+        self.signatures = []  # Signature of each cluster representative
+
+    def signature(self, text):
+        hashes = shingles(normalize_diff(text))
+        signature = np.full(len(self.a), np.iinfo(np.uint64).max, dtype=np.uint64)
+        # In blocks, so a huge diff never needs a shingles x NUM_PERM matrix at once
+        for start in range(0, len(hashes), 4096):
+            block = hashes[start:start + 4096, None]
+            values = (block * self.a[None, :] + self.b[None, :]) >> np.uint64(32)
+            np.minimum(signature, values.min(axis=0), out=signature)
+        return signature
+
+    def _bands(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, text):
+        """Returns (cluster id, whether the diff started a new cluster)."""
+        signature = self.signature(text)
+        candidates = set()
+        for band, key in self._bands(signature):
+            candidates.update(self.buckets[band].get(key, ()))
+
+        best, best_similarity = None, 0.0
+        for cluster in sorted(candidates):
+            similarity = float(np.mean(self.signatures[cluster] == signature))
+            if similarity > best_similarity:
+                best, best_similarity = cluster, similarity
+        if best is not None and best_similarity >= self.threshold:
+            return best, False
+
+        cluster = len(self.signatures)
+        self.signatures.append(signature)
+        for band, key in self._bands(signature):
+            self.buckets[band].setdefault(key, []).append(cluster)
+        return cluster, True
+
+def cluster_diffs(diffs, threshold=THRESHOLD):
+    """
+    Clusters the non-empty diffs. Returns (cluster id per diff or None
+    for an empty one, index of each cluster's representative diff).
+    """
+    index = NearDuplicateIndex(threshold)
+    labels = [None] * len(diffs)
+    representatives = []
+    seen = {}  # Identical diffs are clustered once
+    for i, diff in enumerate(diffs):
+        if not diff:
+            continue
+        if diff in seen:
+            labels[i] = seen[diff]
+            continue
+        cluster, is_new = index.add(diff)
+        if is_new:
+            representatives.append(i)
+        labels[i] = seen[diff] = cluster
+    return labels, representatives
@@ -1,90 +1,290 @@
 import pandas as pd
-from radon.metrics import mi_visit, h_visit
-from radon.complexity import cc_visit
+from radon.metrics import mi_compute, h_visit_ast
+from radon.visitors import ComplexityVisitor
 from radon.raw import analyze
+from contextlib import nullcontext
+from multiprocessing import Pool
+import argparse
+import hashlib
+import time
+import ast
 import sys
+import os
+
+from incremental_metrics import IncrementalMetrics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.dataset_store import DatasetStore
+from common import instrumentation
+from common.streaming import BoundedDict, CsvAppender, read_csv_chunks, CHUNK_SIZE
 
 # --- Configuration ---
 INPUT_FILE = "lab2_dataset.csv"
 OUTPUT_FILE = "lab3_structural_metrics.csv"
+WORKERS = 1  # Number of processes computing metrics
+MEMO_SIZE = 100000  # Blobs (and statements) whose metrics are remembered across chunks in --stream mode
+INPUT_COLUMNS = ["Source_Code_Before", "Source_Code_Current", "Diff"]
+METRIC_COLUMNS = ["MI_Change", "CC_Change", "LOC_Change"]
 
 def get_metrics(code):
     """
     Calculates MI, CC, and LOC for a given code string.
     Returns tuple: (MI, CC, LOC)
+
+    The code is parsed and tokenized only once: the AST feeds both the
+    complexity and Halstead visitors, and the raw analysis feeds both MI
+    and LOC. Results are the same as calling mi_visit, cc_visit and
+    analyze separately.
     """
     if not isinstance(code, str) or not code.strip():
         return 0, 0, 0
 
     try:
-        # 1. Maintainability Index (MI)
-        mi = mi_visit(code, multi=True)
-        
-        # 2. Cyclomatic Complexity (CC)
-        # cc_visit returns a list of blocks (functions/classes). 
-        # We sum the complexity of all blocks + 1 for the file itself.
-        blocks = cc_visit(code)
-        cc = sum([block.complexity for block in blocks]) + 1
-        
+        with instrumentation.timer("radon"):
+            tree = ast.parse(code)
+            raw_metrics = analyze(code)
+
+            # 1. Cyclomatic Complexity (CC)
+            # The visitor returns a list of blocks (functions/classes).
+            # We sum the complexity of all blocks + 1 for the file itself.
+            complexity = ComplexityVisitor.from_ast(tree)
+            cc = sum([block.complexity for block in complexity.blocks]) + 1
+
+            # 2. Maintainability Index (MI), same inputs as radon's mi_visit(code, multi=True)
+            comment_lines = raw_metrics.comments + raw_metrics.multi
+            comments = comment_lines / float(raw_metrics.sloc) * 100 if raw_metrics.sloc != 0 else 0
+            volume = h_visit_ast(tree).total.volume
+            mi = mi_compute(volume, complexity.total_complexity, raw_metrics.lloc, comments)
+
         # 3. Lines of Code (LOC) - distinct from SLOC or LLOC
-        raw_metrics = analyze(code)
         loc = raw_metrics.loc
-        
+
         return round(mi, 2), cc, loc
     except Exception as e:
         # If syntax error (e.g., partial code), return 0
         return 0, 0, 0
 
-def main():
-    print("Loading dataset...")
-    try:
-        df = pd.read_csv(INPUT_FILE)
-    except FileNotFoundError:
-        print(f"Error: {INPUT_FILE} not found. Please complete Step 2.")
-        return
+def blob_hash(code):
+    """Content hash used to memoize metrics of identical sources."""
+    if not isinstance(code, str):
+        return None
+    return hashlib.sha1(code.encode("utf-8", "surrogatepass")).hexdigest()
 
-    print(f"Calculating metrics for {len(df)} rows. This may take a moment...")
+def compute_metrics(codes, workers=WORKERS, known=()):
+    """
+    Computes metrics for every unique source blob exactly once, spreading
+    the blobs over a process pool. Blobs whose hash is in `known` are
+    skipped. Returns {blob hash: (MI, CC, LOC)}.
+    """
+    unique = {}
+    for code in codes:
+        key = blob_hash(code)
+        if key is not None and key not in unique and key not in known:
+            unique[key] = code
 
+    # Largest blobs first, one per task: radon's raw analysis grows faster
+    # than linearly with file size, so big files must not queue up behind
+    # each other in one worker
+    keys = sorted(unique, key=lambda key: len(unique[key]), reverse=True)
+    blobs = [unique[key] for key in keys]
+    if workers > 1 and len(blobs) > 1:
+        with Pool(workers) as pool:
+            results = pool.map(instrumentation.measured(get_metrics), blobs, chunksize=1)
+        results = [instrumentation.merged(result) for result in results]
+    else:
+        results = [get_metrics(code) for code in blobs]
+    instrumentation.count("sources_analyzed", len(blobs))
+
+    return dict(zip(keys, results))
+
+def metric_changes(codes_before, codes_after, metrics):
+    """MI, CC and LOC changes (After - Before) of every row, from the metrics of each blob."""
     # Lists to store new columns
     mi_changes = []
     cc_changes = []
     loc_changes = []
 
-    for index, row in df.iterrows():
-        # Get Source Code
-        # Adjust these column names if they are different in your CSV
-        code_before = row.get('Source_Code_Before', '')
-        code_after = row.get('Source_Code_Current', '')
-
-        # Calculate Metrics Before
-        mi_b, cc_b, loc_b = get_metrics(code_before)
+    for code_before, code_after in zip(codes_before, codes_after):
+        # Metrics Before and After, looked up by blob hash
+        mi_b, cc_b, loc_b = metrics.get(blob_hash(code_before), (0, 0, 0))
+        mi_a, cc_a, loc_a = metrics.get(blob_hash(code_after), (0, 0, 0))
 
-        # Calculate Metrics After
-        mi_a, cc_a, loc_a = get_metrics(code_after)
-
-        # Calculate Change (After - Before) or just the After value 
-        # The assignment asks for "Change Magnitude", usually implies After - Before 
-        # OR comparing Before vs After. 
+        # Calculate Change (After - Before) or just the After value
+        # The assignment asks for "Change Magnitude", usually implies After - Before
+        # OR comparing Before vs After.
         # Let's store the 'Change' (Delta) as requested in Lab Activity (f) headers
-        
+
         mi_change = mi_a - mi_b
         cc_change = cc_a - cc_b
         loc_change = loc_a - loc_b
 
-        mi_changes.append(round(mi_change, 2))
+        # Always a float, even when no file parses, so the column type never depends on the rows
+        mi_changes.append(round(float(mi_change), 2))
         cc_changes.append(cc_change)
         loc_changes.append(loc_change)
 
-    # Add new columns to DataFrame
-    df['MI_Change'] = mi_changes
-    df['CC_Change'] = cc_changes
-    df['LOC_Change'] = loc_changes
+    return mi_changes, cc_changes, loc_changes
+
+def source_columns(df):
+    """The before, after and diff columns of a dataset (empty when missing)."""
+    # Adjust these column names if they are different in your CSV
+    empty = pd.Series([''] * len(df), index=df.index)
+    return (df['Source_Code_Before'] if 'Source_Code_Before' in df else empty,
+            df['Source_Code_Current'] if 'Source_Code_Current' in df else empty,
+            df['Diff'] if 'Diff' in df else empty)
+
+def add_incremental_columns(df, engine):
+    """Adds the diff-scoped metric columns (and Function_CC_Changes) of every row."""
+    codes_before, codes_after, diffs = source_columns(df)
+    changes = [engine.change(b, a, d) for b, a, d in zip(codes_before, codes_after, diffs)]
+    df['MI_Change'] = [float(change[0]) for change in changes]
+    df['CC_Change'] = [change[1] for change in changes]
+    df['LOC_Change'] = [change[2] for change in changes]
+    df['Function_CC_Changes'] = [change[3] for change in changes]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structural metrics (MI, CC, LOC) of each change.")
+    parser.add_argument("--input", default=INPUT_FILE, help="CSV produced by Lab 2")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="CSV file to write")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Number of worker processes")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-analyze the statements touched by each row's Diff, "
+                             "and add per-function CC changes")
+    parser.add_argument("--store", help="Dataset store to read from and add the metric columns to "
+                                        "(instead of --input/--output CSV files)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read, analyze and write --chunk-size rows at a time, so memory does not "
+                             "grow with the dataset")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows per chunk in --stream mode")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with instrumentation.Run("calculate_metrics", args):
+        if args.stream:
+            stream(args)
+        else:
+            calculate(args)
+
+def calculate(args):
+    print("Loading dataset...")
+    try:
+        with instrumentation.stage("read") as stage:
+            if args.store:
+                store = DatasetStore(args.store)
+                df = store.read([column for column in INPUT_COLUMNS if column in store.columns])
+            else:
+                df = pd.read_csv(args.input)
+            stage.items = len(df)
+    except FileNotFoundError:
+        print(f"Error: {args.store or args.input} not found. Please complete Step 2.")
+        return
+
+    print(f"Calculating metrics for {len(df)} rows. This may take a moment...")
+
+    # Get Source Code
+    codes_before, codes_after, _ = source_columns(df)
+
+    if args.incremental:
+        engine = IncrementalMetrics(fallback=get_metrics)
+        start = time.perf_counter()
+        with instrumentation.stage("metrics") as stage:
+            add_incremental_columns(df, engine)
+            stage.items = len(df)
+        elapsed = time.perf_counter() - start
+        print(f"Diff-scoped metrics in {elapsed:.1f}s: {engine.incremental} rows incremental, "
+              f"{engine.full} whole files analyzed.")
+        save(df, args, METRIC_COLUMNS + ['Function_CC_Changes'])
+        return
+
+    start = time.perf_counter()
+    with instrumentation.stage("metrics") as stage:
+        metrics = compute_metrics(list(codes_before) + list(codes_after), args.workers)
+        elapsed = time.perf_counter() - start
+
+        # Add new columns to DataFrame
+        df['MI_Change'], df['CC_Change'], df['LOC_Change'] = metric_changes(codes_before, codes_after, metrics)
+        stage.items = len(df)
+    print(f"Analyzed {len(metrics)} unique sources for {2 * len(df)} row sides in {elapsed:.1f}s.")
+
+    save(df, args, METRIC_COLUMNS)
+
+def stream(args):
+    """
+    --stream: the dataset is read, analyzed and written back one chunk of
+    rows at a time. Metrics of the blobs seen most recently are remembered
+    across chunks (the "after" of one commit is usually the "before" of a
+    later one), in memos of bounded size.
+    """
+    if not os.path.exists(args.store or args.input):
+        print(f"Error: {args.store or args.input} not found. Please complete Step 2.")
+        return
+    if args.store:
+        store = DatasetStore(args.store)
+        chunks = store.iter_chunks([column for column in INPUT_COLUMNS if column in store.columns],
+                                   args.chunk_size)
+    else:
+        chunks = read_csv_chunks(args.input, args.chunk_size)
+
+    print(f"Calculating metrics {args.chunk_size} rows at a time...")
+    new_columns = METRIC_COLUMNS + (['Function_CC_Changes'] if args.incremental else [])
+    engine = IncrementalMetrics(fallback=get_metrics, memo=lambda: BoundedDict(MEMO_SIZE))
+    memo = BoundedDict(MEMO_SIZE)  # blob hash -> (MI, CC, LOC)
+    added = {column: [] for column in new_columns}  # Only kept for a store, where they are small
+    rows = analyzed = 0
+    start = time.perf_counter()
+    with instrumentation.stage("stream") as stage, \
+            CsvAppender(args.output) if not args.store else nullcontext() as writer:
+        for df in chunks:
+            if args.incremental:
+                add_incremental_columns(df, engine)
+            else:
+                codes_before, codes_after, _ = source_columns(df)
+                codes = list(codes_before) + list(codes_after)
+                known = {key: memo[key] for key in set(map(blob_hash, codes)) if key in memo}
+                metrics = {**known, **compute_metrics(codes, args.workers, known)}
+                analyzed += len(metrics) - len(known)
+                for key, value in metrics.items():
+                    memo[key] = value
+                df['MI_Change'], df['CC_Change'], df['LOC_Change'] = metric_changes(codes_before, codes_after,
+                                                                                   metrics)
+
+            if writer is not None:
+                writer.append(df)
+            else:
+                for column in new_columns:
+                    added[column].extend(df[column].tolist())
+            rows += len(df)
+            stage.items = rows
+            print(f"   {rows} rows done ({time.perf_counter() - start:.1f}s)")
+
+    if args.incremental:
+        print(f"Diff-scoped metrics: {engine.incremental} rows incremental, {engine.full} whole files analyzed.")
+    else:
+        print(f"Analyzed {analyzed} sources for {2 * rows} row sides.")
+    if args.store:
+        # Only the new columns are written; sources and diffs stay untouched
+        store.add_columns(added)
+    print("-" * 30)
+    print("SUCCESS!")
+    print(f"Structural metrics calculated. Saved to: {args.store or args.output}")
+    print("-" * 30)
 
-    # Save to new CSV
-    df.to_csv(OUTPUT_FILE, index=False)
+def save(df, args, new_columns):
+    with instrumentation.stage("write") as stage:
+        if args.store:
+            # Only the new columns are written; sources and diffs stay untouched
+            DatasetStore(args.store).add_columns(df[new_columns])
+            destination = args.store
+        else:
+            # Save to new CSV
+            df.to_csv(args.output, index=False)
+            destination = args.output
+        stage.items = len(df)
     print("-" * 30)
     print("SUCCESS!")
-    print(f"Structural metrics calculated. Saved to: {OUTPUT_FILE}")
+    print(f"Structural metrics calculated. Saved to: {destination}")
     print("-" * 30)
 
 if __name__ == "__main__":
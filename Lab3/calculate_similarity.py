@@ -1,9 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import pandas as pd
 import torch
 from transformers import AutoTokenizer, AutoModel
 import sacrebleu
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+import argparse
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.batching import length_buckets
+from common.model_cache import ModelCache, DEFAULT_CACHE_PATH
+from common.dataset_store import DatasetStore
+from common import inference, instrumentation
+from common.pipeline import Pipeline, PerThread, Stage, QUEUE_SIZE
+from common.streaming import CsvAppender, read_csv_chunks, CHUNK_SIZE
+from chunked_embeddings import pooled_embeddings, pooled_cosines, WINDOW_PARAMS
+from embedding_index import EmbeddingIndexWriter, change_vectors
+from token_bleu import batch_token_similarity
 
 # --- Configuration ---
 INPUT_FILE = "lab3_structural_metrics.csv"
@@ -14,26 +30,129 @@ MODEL_NAME = "microsoft/codebert-base"
 SEMANTIC_THRESHOLD = 0.80
 TOKEN_THRESHOLD = 0.75
 
-def get_semantic_similarity(code1, code2, tokenizer, model):
-    """Calculates Cosine Similarity between CodeBERT embeddings."""
-    if not isinstance(code1, str) or not isinstance(code2, str):
-        return 0.0
-    if not code1.strip() or not code2.strip():
-        return 0.0
+BATCH_SIZE = 16  # Number of sources per CodeBERT forward pass
+WORKERS = 1      # Number of processes computing BLEU scores
+THREADS = None   # torch intra-op threads (None = torch's default)
+INTEROP_THREADS = None  # torch inter-op threads (None = torch's default)
+TOKENIZER_THREADS = 2  # Threads tokenizing sources in --pipeline mode
+BUCKET_BATCHES = 4  # Batches sorted by length together in --pipeline mode
+VERIFY_TOLERANCE = 1e-9  # Largest accepted difference from sacrebleu's Token_Similarity
+INPUT_COLUMNS = ["Source_Code_Before", "Source_Code_Current"]
+SIMILARITY_COLUMNS = ["Semantic_Similarity", "Token_Similarity", "Semantic_Class", "Token_Class", "Classes_Agree"]
+INDEX_COLUMNS = ["Hash", "Filename", "Original_Message"]  # Identify the rows of an --index
+
+# Everything that changes an embedding is part of the cache key
+EMBEDDING_PARAMS = {"max_length": 512, "pooling": "cls"}
+
+def is_usable(code):
+    return isinstance(code, str) and bool(code.strip())
+
+def embed_sources(sources, tokenizer, model, cache=None, batch_size=BATCH_SIZE, model_name=MODEL_NAME):
+    """
+    Embeds every unique source exactly once, in padded length-bucketed
+    batches. Returns (matrix, index) where index maps a source to its row
+    of CLS vectors in the matrix. `model_name` keys the cache.
+    """
+    unique = list(dict.fromkeys(code for code in sources if is_usable(code)))
+    index = {code: i for i, code in enumerate(unique)}
+    hidden_size = model.config.hidden_size
+    matrix = np.zeros((len(unique), hidden_size), dtype=np.float32)
+
+    missing = []
+    for i, code in enumerate(unique):
+        cached = cache.get_vector(model_name, EMBEDDING_PARAMS, code) if cache is not None else None
+        if cached is None:
+            missing.append(i)
+        else:
+            matrix[i] = cached
+
+    if missing:
+        # Tokenize once, without padding, to learn every input's length
+        with instrumentation.timer("tokenize"):
+            encoded = tokenizer([unique[i] for i in missing], truncation=True,
+                                max_length=EMBEDDING_PARAMS["max_length"])
+        input_ids = encoded["input_ids"]
+
+        for batch in length_buckets([len(ids) for ids in input_ids], batch_size):
+            inputs = tokenizer.pad([{"input_ids": input_ids[j]} for j in batch], return_tensors="pt")
+            with torch.inference_mode(), instrumentation.timer("forward"):
+                # CLS token representation (first token) of every source in the batch
+                cls = model(**inputs).last_hidden_state[:, 0, :].numpy()
+            instrumentation.count("embedded", len(batch))
+
+            for j, vector in zip(batch, cls):
+                row = missing[j]
+                matrix[row] = vector
+                if cache is not None:
+                    cache.put_vector(model_name, EMBEDDING_PARAMS, unique[row], vector)
+
+    return matrix, index
+
+def pair_cosines(codes1, codes2, matrix, index):
+    """Cosine similarity of every (code1, code2) pair from the embedding matrix (0.0 if a side is unusable)."""
+    # Normalize once so every row similarity is a plain dot product
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    unit = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+    valid = np.array([is_usable(a) and is_usable(b) for a, b in zip(codes1, codes2)], dtype=bool)
+    left = np.array([index.get(a, 0) if ok else 0 for a, ok in zip(codes1, valid)], dtype=np.int64)
+    right = np.array([index.get(b, 0) if ok else 0 for b, ok in zip(codes2, valid)], dtype=np.int64)
 
-    # Tokenize and truncate to 512 tokens (model limit)
-    inputs1 = tokenizer(code1, return_tensors="pt", truncation=True, max_length=512)
-    inputs2 = tokenizer(code2, return_tensors="pt", truncation=True, max_length=512)
+    sims = np.zeros(len(codes1), dtype=np.float64)
+    if valid.any():
+        sims[valid] = np.einsum("ij,ij->i", unit[left[valid]], unit[right[valid]])
+    return sims.tolist()
 
-    with torch.no_grad():
-        # Get embeddings (use the 'pooler_output' or mean of last hidden state)
-        # Here we use the CLS token representation (first token)
-        emb1 = model(**inputs1).last_hidden_state[:, 0, :]
-        emb2 = model(**inputs2).last_hidden_state[:, 0, :]
+def pipelined_embed_sources(sources, tokenizer, model, cache=None, batch_size=BATCH_SIZE, model_name=MODEL_NAME,
+                            tokenizer_threads=TOKENIZER_THREADS, queue_size=QUEUE_SIZE):
+    """
+    Same result as embed_sources, but cache lookups, tokenization (on a
+    thread pool) and forward passes run at the same time, with bounded
+    queues in between. Returns (matrix, index, pipeline).
+    """
+    unique = list(dict.fromkeys(code for code in sources if is_usable(code)))
+    index = {code: i for i, code in enumerate(unique)}
+    matrix = np.zeros((len(unique), model.config.hidden_size), dtype=np.float32)
+    tokenizers = PerThread(tokenizer)
 
-    # Calculate Cosine Similarity
-    similarity = cosine_similarity(emb1, emb2)[0][0]
-    return float(similarity)
+    def lookup(codes):
+        cached = [cache.get_vector(model_name, EMBEDDING_PARAMS, code) if cache is not None else None
+                  for code in codes]
+        return [{"code": code, "vector": vector, "ids": None} for code, vector in zip(codes, cached)]
+
+    def tokenize(entries):
+        todo = [entry for entry in entries if entry["vector"] is None]
+        if todo:
+            with instrumentation.timer("tokenize"):
+                encoded = tokenizers.get()([entry["code"] for entry in todo], truncation=True,
+                                           max_length=EMBEDDING_PARAMS["max_length"])
+            for entry, ids in zip(todo, encoded["input_ids"]):
+                entry["ids"] = ids
+        return entries
+
+    def embed(entries):
+        todo = [entry for entry in entries if entry["vector"] is None]
+        for batch in length_buckets([len(entry["ids"]) for entry in todo], batch_size):
+            inputs = tokenizer.pad([{"input_ids": todo[j]["ids"]} for j in batch], return_tensors="pt")
+            with torch.inference_mode(), instrumentation.timer("forward"):
+                # CLS token representation (first token) of every source in the batch
+                cls = model(**inputs).last_hidden_state[:, 0, :].numpy()
+            instrumentation.count("embedded", len(batch))
+            for j, vector in zip(batch, cls):
+                todo[j]["vector"] = vector
+                if cache is not None:
+                    cache.put_vector(model_name, EMBEDDING_PARAMS, todo[j]["code"], vector)
+        return entries
+
+    pipeline = Pipeline([
+        Stage("lookup", lookup, batch_size=batch_size),
+        Stage("tokenize", tokenize, batch_size=batch_size, workers=tokenizer_threads),
+        # A few batches at a time, so length bucketing still has inputs to sort
+        Stage("embed", embed, batch_size=batch_size * BUCKET_BATCHES),
+    ], queue_size=queue_size, source_name="sources")
+    for i, entry in enumerate(pipeline.run(unique)):
+        matrix[i] = entry["vector"]
+    return matrix, index, pipeline
 
 def get_token_similarity(code1, code2):
     """Calculates BLEU score (0 to 1 scale)."""
@@ -47,6 +166,120 @@ def get_token_similarity(code1, code2):
     score = sacrebleu.corpus_bleu([code1], [[code2]]).score
     return score / 100.0
 
+def semantic_similarities(codes1, codes2, tokenizer, model, model_name, cache, args, quiet=False):
+    """
+    Semantic similarity of every pair, truncated or in long-file mode
+    depending on the arguments. Returns (similarities, (matrix, index)),
+    the embedding of every source and its row for each source.
+    """
+    codes1, codes2 = list(codes1), list(codes2)
+    if args.long_files:
+        matrix, index, stats = pooled_embeddings(codes1 + codes2, tokenizer, model, model_name,
+                                                 cache, args.batch_size)
+        if not quiet:
+            print(f"   Long-file mode: {stats['windows']} windows, {stats['unique']} distinct embedded.")
+        return pooled_cosines(codes1, codes2, matrix, index), (matrix, index)
+    if args.pipeline:
+        matrix, index, pipeline = pipelined_embed_sources(codes1 + codes2, tokenizer, model, cache,
+                                                          args.batch_size, model_name,
+                                                          args.tokenizer_threads, args.queue_size)
+        if not quiet:
+            print("   " + pipeline.report().replace("\n", "\n   "))
+    else:
+        matrix, index = embed_sources(codes1 + codes2, tokenizer, model, cache, args.batch_size, model_name)
+    return pair_cosines(codes1, codes2, matrix, index), (matrix, index)
+
+def score_rows(codes_b, codes_a, tokenizer, model, model_name, cache, args, quiet=False):
+    """
+    (semantic, token) similarity of every (before, after) row, and the
+    embeddings of the sources (see semantic_similarities). In --pipeline
+    mode the BLEU scores are computed on their own thread while CodeBERT works.
+    """
+    # Token (BLEU): every unique source is tokenized once, rows scored across the workers
+    # BLEU compares 'hypothesis' (after) against 'reference' (before)
+    start = time.perf_counter()
+    bleu = ThreadPoolExecutor(1) if args.pipeline else None
+    if bleu is not None:
+        tok_future = bleu.submit(batch_token_similarity, codes_a, codes_b, args.workers)
+
+    # Semantic (CodeBERT): every unique source is embedded once, in batches
+    sem_sims, embeddings = semantic_similarities(codes_b, codes_a, tokenizer, model, model_name, cache, args, quiet)
+    if not quiet:
+        print(f"   Semantic similarity done for {len(codes_b)} rows.")
+
+    if bleu is not None:
+        tok_sims = tok_future.result()
+        bleu.shutdown()
+    else:
+        tok_sims = batch_token_similarity(codes_a, codes_b, args.workers)
+    if not quiet:
+        print(f"   Token similarity done for {len(codes_b)} rows in {time.perf_counter() - start:.1f}s.")
+    return sem_sims, tok_sims, embeddings
+
+def source_columns(df):
+    """The before and after sources of every row, as lists (empty when missing)."""
+    codes_b = df['Source_Code_Before'].tolist() if 'Source_Code_Before' in df else [''] * len(df)
+    codes_a = df['Source_Code_Current'].tolist() if 'Source_Code_Current' in df else [''] * len(df)
+    return codes_b, codes_a
+
+def token_similarity_errors(df, codes_a, codes_b, tok_sims):
+    """
+    Differences between the batched BLEU scores and the Token_Similarity
+    column already in the data, or per-row sacrebleu calls when there is
+    none. Returns (differences, what they were compared with).
+    """
+    if "Token_Similarity" in df:
+        expected = df["Token_Similarity"].tolist()
+        source = "existing Token_Similarity column"
+    else:
+        expected = [get_token_similarity(code_a, code_b) for code_a, code_b in zip(codes_a, codes_b)]
+        source = "per-row sacrebleu"
+    return [abs(new - old) for new, old in zip(tok_sims, expected)], source
+
+def verify_token_similarity(df, codes_a, codes_b, tok_sims):
+    """
+    Compares the batched BLEU scores with the data (see
+    token_similarity_errors). Returns True when every row is within
+    VERIFY_TOLERANCE.
+    """
+    errors, source = token_similarity_errors(df, codes_a, codes_b, tok_sims)
+    bad = sum(error > VERIFY_TOLERANCE for error in errors)
+    print(f"   Verified {len(errors)} BLEU scores against the {source}: {bad} differ "
+          f"(largest difference {max(errors, default=0.0):.2e}).")
+    return bad == 0
+
+def add_similarity_columns(df, sem_sims, tok_sims):
+    """Adds both similarities, their Minor/Major Fix classes and whether the classes agree."""
+    df['Semantic_Similarity'] = sem_sims
+    df['Token_Similarity'] = tok_sims
+
+    # Apply Thresholds
+    df['Semantic_Class'] = df['Semantic_Similarity'].apply(lambda x: classify_fix(x, SEMANTIC_THRESHOLD))
+    df['Token_Class'] = df['Token_Similarity'].apply(lambda x: classify_fix(x, TOKEN_THRESHOLD))
+
+    # Check Agreement
+    df['Classes_Agree'] = np.where(df['Semantic_Class'] == df['Token_Class'], 'YES', 'NO')
+
+def open_index(args, model, model_name):
+    """Writer of the --index directory, recording how its vectors are computed."""
+    info = {"model": args.model, "quantize": args.quantize, "cache_name": model_name,
+            "long_files": args.long_files, "params": WINDOW_PARAMS if args.long_files else EMBEDDING_PARAMS}
+    return EmbeddingIndexWriter(args.index, model.config.hidden_size, info)
+
+def index_changes(index, df, codes_b, codes_a, embeddings, first_row=0):
+    """Adds the after-minus-before embedding of every row with two usable sides to the index."""
+    rows, vectors = change_vectors(codes_b, codes_a, *embeddings)
+    columns = [df[column].tolist() if column in df else [""] * len(df) for column in INDEX_COLUMNS]
+    hashes, filenames, messages = ([values[i] for i in rows] for values in columns)
+    index.add((rows + first_row).tolist(), hashes, filenames, messages, vectors)
+
+def close_index(index, args):
+    with instrumentation.stage("index") as stage:
+        index = index.close(args.index_clusters)
+        stage.items = len(index)
+    clusters = "exact search" if index.centroids is None else f"{len(index.centroids)} clusters"
+    print(f"   Indexed {len(index)} change embeddings in {args.index} ({clusters}).")
+
 def classify_fix(similarity, threshold):
     """Classifies as Minor Fix (High Sim) or Major Fix (Low Sim)."""
     if similarity >= threshold:
@@ -54,64 +287,211 @@ def classify_fix(similarity, threshold):
     else:
         return "Major Fix"
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Semantic and token similarity of each fix.")
+    parser.add_argument("--input", default=INPUT_FILE, help="CSV with structural metrics")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="CSV file to write")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Number of sources per CodeBERT forward pass")
+    parser.add_argument("--long-files", action="store_true",
+                        help="Embed whole files as pooled overlapping windows instead of truncating to 512 tokens")
+    parser.add_argument("--store", help="Dataset store to read from and add the similarity columns to "
+                                        "(instead of --input/--output CSV files)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap cache lookups, tokenization, CodeBERT forward passes and the "
+                             "BLEU scores (truncated mode only)")
+    parser.add_argument("--tokenizer-threads", type=int, default=TOKENIZER_THREADS,
+                        help="Threads tokenizing sources in --pipeline mode")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="Items held between two pipeline stages (caps memory)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read, score and write --chunk-size rows at a time, so memory does not "
+                             "grow with the dataset")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows per chunk in --stream mode")
+    parser.add_argument("--model", default=MODEL_NAME, help="Model name or local model directory")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Run the model with dynamic int8 quantization of its linear layers")
+    parser.add_argument("--threads", type=int, default=THREADS, help="torch intra-op threads")
+    parser.add_argument("--interop-threads", type=int, default=INTEROP_THREADS,
+                        help="torch inter-op threads")
+    parser.add_argument("--drift-sample", type=int, default=inference.DRIFT_SAMPLE,
+                        help="With --quantize, rows re-run in fp32 to report the drift (0 = skip)")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Number of worker processes computing BLEU scores")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check the BLEU scores against the input's Token_Similarity column "
+                             "(or per-row sacrebleu when there is none)")
+    parser.add_argument("--index", help="Also save the after-minus-before embedding of every fix to a "
+                                        "memory-mapped index in this directory (see embedding_index.py)")
+    parser.add_argument("--index-clusters", type=int,
+                        help="Coarse clusters of the --index (default: automatic for large indexes, 0 = none)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Model output cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Always run the model")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    with instrumentation.Run("calculate_similarity", args):
+        calculate(args)
+
+def calculate(args):
     print("1. Loading dataset...")
+    columns = INPUT_COLUMNS + (["Token_Similarity"] if args.verify else []) + (INDEX_COLUMNS if args.index else [])
     try:
-        df = pd.read_csv(INPUT_FILE)
+        with instrumentation.stage("read") as stage:
+            if args.store:
+                store = DatasetStore(args.store)
+                columns = [column for column in columns if column in store.columns]
+                df = None if args.stream else store.read(columns)
+            elif args.stream:
+                if not os.path.exists(args.input):
+                    raise FileNotFoundError(args.input)
+                df = None  # Read chunk by chunk later
+            else:
+                df = pd.read_csv(args.input)
+            stage.items = None if df is None else len(df)
     except FileNotFoundError:
-        print(f"Error: {INPUT_FILE} not found. Did Step 4 finish?")
+        print(f"Error: {args.store or args.input} not found. Did Step 4 finish?")
         return
 
-    print(f"2. Loading CodeBERT model ({MODEL_NAME})...")
+    print(f"2. Loading CodeBERT model ({args.model})...")
+    threads = inference.configure_threads(args.threads, args.interop_threads)
     try:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-        model = AutoModel.from_pretrained(MODEL_NAME)
+        with instrumentation.stage("load_model"):
+            tokenizer = AutoTokenizer.from_pretrained(args.model)
+            model, reference = inference.load_models(AutoModel, args.model, args.quantize)
     except Exception as e:
         print(f"Error loading model: {e}")
         return
 
-    print(f"3. Calculating similarities for {len(df)} rows...")
-    
-    sem_sims = []
-    tok_sims = []
-    
-    # Limit rows if testing, remove slice [:5] to run full dataset
-    # processing_df = df.head(5) if you want to test first
-    
-    count = 0
-    for index, row in df.iterrows():
-        code_b = row.get('Source_Code_Before', '')
-        code_a = row.get('Source_Code_Current', '')
-
-        # Semantic (CodeBERT)
-        sem = get_semantic_similarity(code_b, code_a, tokenizer, model)
-        sem_sims.append(sem)
-
-        # Token (BLEU)
-        tok = get_token_similarity(code_a, code_b) # BLEU compares 'hypothesis' against 'reference'
-        tok_sims.append(tok)
-        
-        count += 1
-        if count % 10 == 0:
-            print(f"   Processed {count} / {len(df)} rows...")
+    precision = "int8 (dynamic)" if args.quantize else "fp32"
+    print(f"   Running in {precision} on {threads[0]} intra-op / {threads[1]} inter-op threads.")
+    model_name = inference.cache_name(args.model, args.quantize)
+    cache = None if args.no_cache else ModelCache(args.cache)
+    index = open_index(args, model, model_name) if args.index else None
 
-    df['Semantic_Similarity'] = sem_sims
-    df['Token_Similarity'] = tok_sims
+    if args.stream:
+        chunks = store.iter_chunks(columns, args.chunk_size) if args.store \
+            else read_csv_chunks(args.input, args.chunk_size)
+        added = stream(chunks, tokenizer, model, reference, model_name, cache, index, args)
+        if added is None:
+            if index is not None:
+                index.discard()
+            return
+        if args.store:
+            # Only the new columns are written; sources and diffs stay untouched
+            store.add_columns(added)
+    else:
+        print(f"3. Calculating similarities for {len(df)} rows...")
+        codes_b, codes_a = source_columns(df)
+        with instrumentation.stage("similarity") as stage:
+            sem_sims, tok_sims, embeddings = score_rows(codes_b, codes_a, tokenizer, model, model_name, cache, args)
+            stage.items = len(df)
+        if index is not None:
+            index_changes(index, df, codes_b, codes_a, embeddings)
 
-    print("4. Classifying fixes...")
-    # Apply Thresholds
-    df['Semantic_Class'] = df['Semantic_Similarity'].apply(lambda x: classify_fix(x, SEMANTIC_THRESHOLD))
-    df['Token_Class'] = df['Token_Similarity'].apply(lambda x: classify_fix(x, TOKEN_THRESHOLD))
+        # Quality drift: the first comparable rows again, through the fp32 model
+        if reference is not None and args.drift_sample > 0:
+            rows = [i for i, (code_b, code_a) in enumerate(zip(codes_b, codes_a))
+                    if is_usable(code_b) and is_usable(code_a)][:args.drift_sample]
+            with instrumentation.stage("drift") as stage:
+                report_drift([codes_b[i] for i in rows], [codes_a[i] for i in rows], [sem_sims[i] for i in rows],
+                             tokenizer, reference, cache, args)
+                stage.items = len(rows)
+        if cache is not None:
+            print(f"   {cache.report()}")
+            cache.close()
 
-    # Check Agreement
-    df['Classes_Agree'] = np.where(df['Semantic_Class'] == df['Token_Class'], 'YES', 'NO')
+        if args.verify and not verify_token_similarity(df, codes_a, codes_b, tok_sims):
+            if index is not None:
+                index.discard()
+            return
+
+        print("4. Classifying fixes...")
+        add_similarity_columns(df, sem_sims, tok_sims)
 
-    # Save Final
-    df.to_csv(OUTPUT_FILE, index=False)
+        # Save Final
+        with instrumentation.stage("write") as stage:
+            if args.store:
+                # Only the new columns are written; sources and diffs stay untouched
+                store.add_columns(df[SIMILARITY_COLUMNS])
+            else:
+                df.to_csv(args.output, index=False)
+            stage.items = len(df)
+    if index is not None:
+        close_index(index, args)
+    destination = args.store or args.output
     print("-" * 30)
     print("SUCCESS!")
-    print(f"Final dataset with Analysis saved to: {OUTPUT_FILE}")
+    print(f"Final dataset with Analysis saved to: {destination}")
     print("-" * 30)
 
+def report_drift(codes_b, codes_a, sem_sims, tokenizer, reference, cache, args):
+    """Prints how far the quantized similarities of some rows are from the fp32 model's."""
+    expected, _ = semantic_similarities(codes_b, codes_a, tokenizer, reference, args.model, cache, args, quiet=True)
+    drift = inference.similarity_drift(expected, sem_sims, SEMANTIC_THRESHOLD)
+    print(f"   {inference.format_drift(drift)}")
+
+def stream(chunks, tokenizer, model, reference, model_name, cache, index, args):
+    """
+    --stream: scores, classifies and writes one chunk of rows at a time, so
+    only --chunk-size rows (and their embeddings) are ever in memory.
+    Embeddings and BLEU tables are shared across chunks through the model
+    cache and the BLEU table cache. Returns the new columns when writing to
+    a store (they are small), {} after writing the CSV, or None if --verify
+    failed.
+    """
+    print(f"3. Calculating similarities {args.chunk_size} rows at a time...")
+    added = {column: [] for column in SIMILARITY_COLUMNS}
+    drift_rows = ([], [], [])  # before, after and quantized similarity of the first comparable rows
+    errors, source = [], "per-row sacrebleu"  # Largest BLEU difference of each chunk, with --verify
+    rows = bad = 0
+    start = time.perf_counter()
+    with instrumentation.stage("stream") as stage, \
+            CsvAppender(args.output) if not args.store else nullcontext() as writer:
+        for df in chunks:
+            codes_b, codes_a = source_columns(df)
+            sem_sims, tok_sims, embeddings = score_rows(codes_b, codes_a, tokenizer, model, model_name, cache, args,
+                                                        quiet=True)
+            if index is not None:
+                index_changes(index, df, codes_b, codes_a, embeddings, rows)
+
+            if args.verify:
+                differences, source = token_similarity_errors(df, codes_a, codes_b, tok_sims)
+                bad += sum(error > VERIFY_TOLERANCE for error in differences)
+                errors.append(max(differences, default=0.0))
+            if reference is not None:
+                for code_b, code_a, sim in zip(codes_b, codes_a, sem_sims):
+                    if len(drift_rows[0]) < args.drift_sample and is_usable(code_b) and is_usable(code_a):
+                        for values, value in zip(drift_rows, (code_b, code_a, sim)):
+                            values.append(value)
+
+            add_similarity_columns(df, sem_sims, tok_sims)
+            if writer is not None:
+                writer.append(df)
+            else:
+                for column in SIMILARITY_COLUMNS:
+                    added[column].extend(df[column].tolist())
+            rows += len(df)
+            stage.items = rows
+            print(f"   {rows} rows done ({time.perf_counter() - start:.1f}s)")
+            if bad:
+                break
+
+        if drift_rows[0]:
+            report_drift(*drift_rows, tokenizer, reference, cache, args)
+        if cache is not None:
+            print(f"   {cache.report()}")
+            cache.close()
+        if args.verify:
+            print(f"   Verified {rows} BLEU scores against the {source}: {bad} differ "
+                  f"(largest difference {max(errors, default=0.0):.2e}).")
+            if bad:
+                if writer is not None:
+                    writer.close(discard=True)
+                return None
+    return {} if writer is not None else added
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,167 @@
+import hashlib
+import sys
+import os
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.batching import length_buckets
+from common import instrumentation
+
+# --- Configuration ---
+WINDOW_TOKENS = 510     # Model limit (512) minus the CLS and SEP tokens
+OVERLAP_TOKENS = 64     # Tokens of the previous chunk repeated at the start of a window
+MIN_CHUNK_TOKENS = 128  # Never cut a chunk shorter than this
+CUT_MODULUS = 8         # On average, a content-defined cut every 8 lines
+
+WINDOW_PARAMS = {"window": WINDOW_TOKENS, "overlap": OVERLAP_TOKENS,
+                 "min_chunk": MIN_CHUNK_TOKENS, "cut": CUT_MODULUS, "pooling": "cls-window-mean"}
+
+def line_hash(line):
+    """Stable hash of one source line, used to pick chunk boundaries."""
+    return int.from_bytes(hashlib.blake2b(line.encode("utf-8", "surrogatepass"), digest_size=4).digest(), "big")
+
+class WindowSplitter:
+    """
+    Splits sources into overlapping token windows.
+
+    Chunk boundaries are chosen from the content of the lines (a cut is
+    allowed after a line whose hash is divisible by CUT_MODULUS), not from
+    token offsets. An edit therefore only changes the windows around it:
+    the chunks before and after it come out identical in both versions of
+    the file, and their embeddings can be reused.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.line_tokens = {}  # Every distinct line is tokenized once
+
+    def tokenize_line(self, line):
+        ids = self.line_tokens.get(line)
+        if ids is None:
+            with instrumentation.timer("tokenize"):
+                ids = self.tokenizer(line, add_special_tokens=False)["input_ids"]
+            self.line_tokens[line] = ids
+        return ids
+
+    def chunks(self, code):
+        """Yields the token ids of each content-defined chunk of the source."""
+        budget = WINDOW_TOKENS - OVERLAP_TOKENS
+        current = []
+        for line in code.splitlines(keepends=True):
+            ids = self.tokenize_line(line)
+
+            # A single very long line is split on its own
+            while len(ids) > budget:
+                if current:
+                    yield current
+                    current = []
+                yield ids[:budget]
+                ids = ids[budget:]
+
+            if len(current) + len(ids) > budget:
+                yield current
+                current = []
+            current.extend(ids)
+
+            if len(current) >= MIN_CHUNK_TOKENS and line_hash(line) % CUT_MODULUS == 0:
+                yield current
+                current = []
+
+        if current:
+            yield current
+
+    def windows(self, code):
+        """
+        Returns [(window_ids, weight)] for a source. Each window is a chunk
+        prefixed with the tail of the previous chunk; the weight is the
+        number of new tokens it covers.
+        """
+        result = []
+        previous = []
+        for chunk in self.chunks(code):
+            window = previous[-OVERLAP_TOKENS:] + chunk
+            result.append((tuple(window), len(chunk)))
+            previous = chunk
+        return result
+
+def window_key(window):
+    """Text used to key one window in the model cache."""
+    return "ids:" + ",".join(map(str, window))
+
+def embed_windows(windows, tokenizer, model, model_name, cache=None, batch_size=16):
+    """
+    Embeds each distinct window once, in padded length-bucketed batches.
+    Returns {window: CLS vector}.
+    """
+    vectors = {}
+    missing = []
+    for window in dict.fromkeys(windows):
+        cached = cache.get_vector(model_name, WINDOW_PARAMS, window_key(window)) if cache is not None else None
+        if cached is None:
+            missing.append(window)
+        else:
+            vectors[window] = cached
+
+    for batch in length_buckets([len(window) for window in missing], batch_size):
+        features = [{"input_ids": [tokenizer.cls_token_id, *missing[j], tokenizer.sep_token_id]}
+                    for j in batch]
+        inputs = tokenizer.pad(features, return_tensors="pt")
+        with torch.inference_mode(), instrumentation.timer("forward"):
+            cls = model(**inputs).last_hidden_state[:, 0, :].numpy()
+        instrumentation.count("embedded", len(batch))
+
+        for j, vector in zip(batch, cls):
+            window = missing[j]
+            vectors[window] = vector
+            if cache is not None:
+                cache.put_vector(model_name, WINDOW_PARAMS, window_key(window), vector)
+
+    return vectors
+
+def pool(windows, vectors):
+    """Token-weighted mean of the window embeddings of one source."""
+    weights = np.array([weight for _, weight in windows], dtype=np.float32)
+    matrix = np.stack([vectors[window] for window, _ in windows])
+    return (matrix * weights[:, None]).sum(axis=0) / weights.sum()
+
+def pooled_embeddings(codes, tokenizer, model, model_name, cache=None, batch_size=16):
+    """
+    Long-file embedding of every distinct usable source: each source is
+    split into overlapping windows, the windows are embedded in batches
+    and pooled. Windows shared between sources (typically the before and
+    after versions of a file) are embedded only once.
+
+    Returns (matrix, index, stats) where index maps a source to its row of
+    the matrix, and stats counts all windows and the distinct ones that
+    actually needed an embedding.
+    """
+    splitter = WindowSplitter(tokenizer)
+    per_source = {}
+    for code in codes:
+        if isinstance(code, str) and code.strip() and code not in per_source:
+            per_source[code] = splitter.windows(code)
+
+    all_windows = [window for windows in per_source.values() for window, _ in windows]
+    vectors = embed_windows(all_windows, tokenizer, model, model_name, cache, batch_size)
+    pooled = {code: pool(windows, vectors) for code, windows in per_source.items() if windows}
+
+    matrix = np.zeros((len(pooled), model.config.hidden_size), dtype=np.float32)
+    for i, vector in enumerate(pooled.values()):
+        matrix[i] = vector
+    index = {code: i for i, code in enumerate(pooled)}
+    stats = {"windows": len(all_windows), "unique": len(vectors)}
+    return matrix, index, stats
+
+def pooled_cosines(codes1, codes2, matrix, index):
+    """Cosine similarity of every (code1, code2) pair of pooled embeddings (0.0 if a side has none)."""
+    sims = []
+    for code1, code2 in zip(codes1, codes2):
+        if code1 not in index or code2 not in index:
+            sims.append(0.0)
+            continue
+        emb1, emb2 = matrix[index[code1]], matrix[index[code2]]
+        denom = np.linalg.norm(emb1) * np.linalg.norm(emb2)
+        sims.append(float(np.dot(emb1, emb2) / denom) if denom > 0 else 0.0)
+    return sims
@@ -0,0 +1,462 @@
+from scipy import sparse
+import numpy as np
+import pandas as pd
+import argparse
+import json
+import sys
+import os
+import re
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation
+
+# --- Configuration ---
+K = 10                    # Similar fixes returned per query
+NPROBE = 16               # Clusters searched per query (when the index has clusters)
+BLOCK_ROWS = 16384        # Rows scored at once by an exact search (caps memory)
+CLUSTER_MIN_ROWS = 20000  # Indexes smaller than this are always searched exactly
+CLUSTER_SAMPLE = 50000    # Rows the cluster centroids are trained on
+CLUSTER_ITERATIONS = 10
+
+# Files of an index directory
+MANIFEST = "manifest.json"
+VECTORS = "vectors.f32"
+IDS = "ids.parquet"
+CENTROIDS = "centroids.npy"
+CLUSTER_ROWS = "cluster_rows.npy"        # Row numbers grouped by cluster
+CLUSTER_OFFSETS = "cluster_offsets.npy"  # Where each cluster starts in CLUSTER_ROWS
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@")
+LINE = re.compile(r"[^\n]*\n|[^\n]+$")  # A line with its newline (the last one may have none)
+
+def change_vectors(codes_before, codes_after, matrix, index):
+    """
+    The after-minus-before embedding of every row whose two sides were
+    embedded, from an embedding matrix and its source -> row index.
+    Returns (row numbers, vectors).
+    """
+    rows = [i for i, (before, after) in enumerate(zip(codes_before, codes_after))
+            if before in index and after in index]
+    before = np.array([index[codes_before[i]] for i in rows], dtype=np.int64)
+    after = np.array([index[codes_after[i]] for i in rows], dtype=np.int64)
+    return np.array(rows, dtype=np.int64), matrix[after] - matrix[before]
+
+def normalize(vectors):
+    """Unit-length copies of the rows (zero rows stay zero) and their original lengths."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0), norms[:, 0]
+
+def top_k(scores, positions, k):
+    """The k best (positions, scores) of every column of a score matrix, best first."""
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1, axis=0)[:k]
+    top = np.take_along_axis(scores, best, axis=0)
+    order = np.argsort(-top, axis=0, kind="stable")
+    best = np.take_along_axis(best, order, axis=0)
+    return np.take_along_axis(positions, best, axis=0), np.take_along_axis(top, order, axis=0)
+
+class EmbeddingIndexWriter:
+    """
+    Builds an index of change embeddings one chunk of rows at a time: the
+    vectors are appended to the matrix file as they come, only the ids are
+    kept in memory. The manifest is written last, so a half-written index
+    is never opened.
+    """
+
+    def __init__(self, path, dim, info):
+        self.path = path
+        self.dim = dim
+        self.info = info  # How the vectors were computed (model, pooling...), checked by queries
+        os.makedirs(path, exist_ok=True)
+        for name in (MANIFEST, CENTROIDS, CLUSTER_ROWS, CLUSTER_OFFSETS):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        self.vectors = open(os.path.join(path, VECTORS), "wb")
+        self.ids = {"Row": [], "Hash": [], "Filename": [], "Message": [], "Norm": []}
+
+    def add(self, rows, hashes, filenames, messages, vectors):
+        """
+        Appends change vectors, with the dataset row, commit, file and
+        message of each. Zero vectors (both sides embed the same, e.g. when
+        the change is past the truncation point) are left out.
+        """
+        unit, norms = normalize(vectors)
+        keep = norms > 0
+        self.vectors.write(unit[keep].tobytes())
+        for column, values in (("Row", rows), ("Hash", hashes), ("Filename", filenames),
+                               ("Message", messages), ("Norm", norms)):
+            self.ids[column].extend(value for value, kept in zip(values, keep) if kept)
+
+    def discard(self):
+        """Drops a half-written index (its matrix file; there is no manifest yet)."""
+        self.vectors.close()
+        os.remove(os.path.join(self.path, VECTORS))
+        if not os.listdir(self.path):
+            os.rmdir(self.path)
+
+    def close(self, clusters=None):
+        """
+        Finishes the index and returns it opened for queries. Coarse
+        clusters are trained when `clusters` is given (None = automatic,
+        only for indexes of CLUSTER_MIN_ROWS rows or more; 0 = never).
+        """
+        self.vectors.close()
+        ids = pd.DataFrame(self.ids)
+        ids["Hash"] = ids["Hash"].astype(str)
+        ids["Filename"] = ids["Filename"].astype(str)
+        ids["Message"] = ids["Message"].fillna("").astype(str)
+        ids.to_parquet(os.path.join(self.path, IDS), index=False)
+        with open(os.path.join(self.path, MANIFEST), "w") as f:
+            json.dump({**self.info, "rows": len(ids), "dim": self.dim, "dtype": "float32"}, f, indent=2)
+
+        index = EmbeddingIndex(self.path)
+        if clusters is None and len(index) >= CLUSTER_MIN_ROWS:
+            clusters = int(np.sqrt(len(index)))
+        if clusters:
+            index.build_clusters(clusters)
+        return index
+
+class EmbeddingIndex:
+    """
+    Unit-length after-minus-before embeddings of historical fixes, in a
+    float32 matrix memory-mapped from disk, with an id table (dataset row,
+    commit hash, file, message, length of the change vector).
+
+    search() returns the nearest rows by cosine similarity. Without
+    clusters it scores the whole matrix, BLOCK_ROWS rows at a time; with
+    them (build_clusters) it only scores the rows of the `nprobe` clusters
+    whose centroids are closest to the query.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.info = json.load(f)
+        self.ids = pd.read_parquet(os.path.join(path, IDS))
+        rows, dim = self.info["rows"], self.info["dim"]
+        self.vectors = np.memmap(os.path.join(path, VECTORS), dtype=np.float32, mode="r",
+                                 shape=(rows, dim)) if rows else np.zeros((0, dim), dtype=np.float32)
+        self.centroids = self.cluster_rows = self.cluster_offsets = None
+        if os.path.exists(os.path.join(path, CENTROIDS)):
+            self.centroids = np.load(os.path.join(path, CENTROIDS))
+            self.cluster_rows = np.load(os.path.join(path, CLUSTER_ROWS), mmap_mode="r")
+            self.cluster_offsets = np.load(os.path.join(path, CLUSTER_OFFSETS))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def assign(self, vectors):
+        """The nearest centroid of every vector."""
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def build_clusters(self, clusters, sample=CLUSTER_SAMPLE, iterations=CLUSTER_ITERATIONS, seed=0):
+        """
+        Spherical k-means: centroids are trained on a sample of rows, then
+        every row is assigned to its nearest centroid, BLOCK_ROWS at a time.
+        """
+        clusters = max(1, min(clusters, len(self)))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(self), min(sample, len(self)), replace=False))
+        training = np.asarray(self.vectors[sample])
+        with instrumentation.timer("clustering"):
+            self.centroids = training[rng.choice(len(training), clusters, replace=False)].copy()
+            for _ in range(iterations):
+                labels = self.assign(training)
+                # Sum of the rows of each cluster, as one sparse (cluster x row) product
+                members = sparse.csr_matrix((np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))),
+                                            shape=(clusters, len(labels)))
+                sums = np.asarray(members @ training)
+                # Empty clusters restart from a random training row
+                empty = np.bincount(labels, minlength=clusters) == 0
+                sums[empty] = training[rng.choice(len(training), int(empty.sum()))]
+                self.centroids, _ = normalize(sums)
+
+            labels = np.concatenate([self.assign(np.asarray(self.vectors[start:start + BLOCK_ROWS]))
+                                     for start in range(0, len(self), BLOCK_ROWS)])
+        self.cluster_rows = np.argsort(labels, kind="stable")
+        self.cluster_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=clusters))])
+        np.save(os.path.join(self.path, CENTROIDS), self.centroids)
+        np.save(os.path.join(self.path, CLUSTER_ROWS), self.cluster_rows)
+        np.save(os.path.join(self.path, CLUSTER_OFFSETS), self.cluster_offsets)
+
+    def search(self, queries, k=K, nprobe=NPROBE, exact=False, exclude=()):
+        """
+        The k most similar rows of every query vector, skipping the rows in
+        `exclude`. Returns [(row positions, cosine similarities)] per query,
+        best first.
+        """
+        queries, _ = normalize(np.atleast_2d(queries))
+        exclude = np.fromiter(exclude, dtype=np.int64)
+        if exact or self.centroids is None:
+            return self._search_exact(queries, k, exclude)
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        results = []
+        for query, clusters in zip(queries, probes):
+            rows = np.sort(np.concatenate([self.cluster_rows[self.cluster_offsets[c]:self.cluster_offsets[c + 1]]
+                                           for c in clusters]))
+            rows = rows[~np.isin(rows, exclude)]
+            if not len(rows):
+                results.append((rows, np.zeros(0, dtype=np.float32)))
+                continue
+            scores = np.asarray(self.vectors[rows]) @ query
+            best, top = top_k(scores[:, None], rows[:, None], k)
+            results.append((best[:, 0], top[:, 0]))
+        instrumentation.count("probed_queries", len(queries))
+        return results
+
+    def _search_exact(self, queries, k, exclude):
+        best = np.zeros((0, len(queries)), dtype=np.int64)
+        top = np.zeros((0, len(queries)), dtype=np.float32)
+        for start in range(0, len(self), BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + BLOCK_ROWS])
+            positions = np.arange(start, start + len(block))
+            scores = block @ queries.T
+            scores[np.isin(positions, exclude)] = -np.inf
+            positions = np.broadcast_to(positions[:, None], scores.shape)
+            best, top = top_k(np.concatenate([top, scores]), np.concatenate([best, positions]), k)
+        instrumentation.count("exact_queries", len(queries))
+        return [(best[:, i][np.isfinite(top[:, i])], top[:, i][np.isfinite(top[:, i])])
+                for i in range(len(queries))]
+
+    def commit_rows(self, commit):
+        """Positions of the rows of a commit (a hash prefix of at least 4 characters works too)."""
+        if len(commit) < 4:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.ids["Hash"].str.startswith(commit).to_numpy())
+
+    def similar_to_commit(self, commit, k=K, nprobe=NPROBE, exact=False):
+        """
+        The k fixes most similar to an indexed commit: its rows' vectors are
+        averaged into one query, and its own rows are left out. Returns the
+        id table of the matches with a Similarity column, or None when the
+        commit is not in the index.
+        """
+        rows = self.commit_rows(commit)
+        if not len(rows):
+            return None
+        query = np.asarray(self.vectors[rows]).mean(axis=0)
+        (best, top), = self.search(query, k, nprobe, exact, exclude=rows)
+        return self.matches(best, top)
+
+    def matches(self, positions, scores):
+        """Id table rows of search results, with their Similarity."""
+        return self.ids.iloc[positions].assign(Similarity=scores).reset_index(drop=True)
+
+def diff_sides(diff):
+    """
+    The before and after fragments of a unified diff (context lines go to
+    both). Only an approximation of the indexed vectors, which are taken
+    from whole files: see diff_pairs.
+    """
+    before, after = [], []
+    for line in diff.splitlines(keepends=True):
+        if line.startswith(("diff --git", "index ", "--- ", "+++ ", "@@", "\\")):
+            continue
+        if line.startswith("-"):
+            before.append(line[1:])
+        elif line.startswith("+"):
+            after.append(line[1:])
+        else:
+            context = line[1:] if line.startswith(" ") else line
+            before.append(context)
+            after.append(context)
+    return "".join(before), "".join(after)
+
+def split_files(diff):
+    """
+    [(old path, new path, old blob, patch lines)] of every file of a
+    unified diff. A path is None on the /dev/null side of an added or
+    deleted file; the old blob (from git's "index" line) may be None.
+    """
+    lines = LINE.findall(diff)
+    git = any(line.startswith("diff --git") for line in lines)
+    files = []
+    for line in lines:
+        # git starts every file with "diff --git"; a plain diff with the "---" after a file's hunks
+        if git:
+            starts = line.startswith("diff --git")
+        else:
+            starts = line.startswith("--- ") and bool(files) and bool(files[-1][3])
+        if starts or not files:
+            files.append([None, None, None, []])
+        entry = files[-1]
+        if entry[3] or line.startswith("@@"):
+            entry[3].append(line)
+        elif line.startswith("index "):
+            entry[2] = line.split()[1].split("..")[0]
+        elif line.startswith(("--- ", "+++ ")):
+            path = line[4:].rstrip("\n").split("\t")[0]
+            path = None if path == "/dev/null" else path[2:] if path.startswith(("a/", "b/")) else path
+            entry[0 if line.startswith("-") else 1] = path
+    return [tuple(entry) for entry in files if entry[3]]
+
+def patch_source(source, lines):
+    """
+    Applies one file's hunks to its source. Raises ValueError when the
+    diff's context or removed lines are not in the source.
+    """
+    old = LINE.findall(source)
+    new = []
+    position = 0
+    last = None
+    for line in lines:
+        match = HUNK_HEADER.match(line)
+        if match:
+            # "-l,0" inserts after line l, any other range starts at line l
+            start = int(match.group(1)) - (match.group(2) != "0")
+            if start < position or start > len(old):
+                raise ValueError(f"hunk at line {match.group(1)} does not fit the source")
+            new.extend(old[position:start])
+            position = start
+        elif line.startswith("\\"):
+            # "\ No newline at end of file", for the line before it
+            if last in (" ", "+"):
+                new[-1] = new[-1].rstrip("\n")
+        elif line[:1] in (" ", "-"):
+            if position >= len(old) or old[position].rstrip("\n") != line[1:].rstrip("\n"):
+                raise ValueError(f"line {position + 1} does not match the diff")
+            if line[:1] == " ":
+                new.append(old[position])
+            position += 1
+        elif line[:1] == "+":
+            new.append(line[1:])
+        last = line[:1]
+    return "".join(new + old[position:])
+
+def diff_pairs(repo_path, diff, rev="HEAD"):
+    """
+    Whole (before, after) sources of the files a diff modifies, like the
+    indexed vectors: the before version is read from the repository (the
+    blob on the diff's "index" line, else the file at `rev`) and the
+    after version is that source with the diff applied.
+    """
+    from common.git_repo import GitRepository
+
+    pairs = []
+    with GitRepository(repo_path) as repo:
+        for old_path, new_path, old_blob, lines in split_files(diff):
+            if old_path is None or new_path is None:
+                continue  # Added and deleted files have no change vector
+            before = (repo.text(old_blob) if old_blob else None) or repo.text(f"{rev}:{old_path}")
+            if before is None:
+                raise ValueError(f"{old_path} is not in {repo_path} at {rev}")
+            pairs.append((before, patch_source(before, lines)))
+    return pairs
+
+def embed_changes(pairs, info, model_path=None, batch_size=16):
+    """
+    After-minus-before embeddings of (before, after) source pairs, computed
+    exactly like the index's own vectors (same model, precision and
+    pooling, from its manifest). Pairs with a blank side are dropped.
+    """
+    from transformers import AutoTokenizer, AutoModel
+    from common import inference
+    from calculate_similarity import embed_sources
+    from chunked_embeddings import pooled_embeddings
+
+    model_path = model_path or info["model"]
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model, _ = inference.load_models(AutoModel, model_path, info["quantize"])
+    codes = [code for pair in pairs for code in pair]
+    if info["long_files"]:
+        matrix, index, _ = pooled_embeddings(codes, tokenizer, model, info["cache_name"], None, batch_size)
+    else:
+        matrix, index = embed_sources(codes, tokenizer, model, None, batch_size, info["cache_name"])
+    _, vectors = change_vectors([before for before, _ in pairs], [after for _, after in pairs], matrix, index)
+    return vectors
+
+def commit_pairs(repo_path, commit):
+    """(before, after) sources of the files a commit modified, read from its repository."""
+    from common.git_repo import GitRepository
+
+    with GitRepository(repo_path) as repo:
+        commit = repo.commit(commit)
+        return [(mod.source_code_before, mod.source_code) for mod in repo.modified_files(commit)
+                if mod.source_code_before is not None and mod.source_code is not None]
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return number
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Historical fixes most similar to a diff or a commit.")
+    parser.add_argument("--index", required=True,
+                        help="Index directory written by calculate_similarity.py --index")
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("--commit", help="Hash (or prefix) of a commit, from the index or from --repo")
+    query.add_argument("--diff", help="Unified diff file ('-' = stdin). With --repo, the whole before and "
+                                      "after files are rebuilt from it, as indexed; without, only the diff's "
+                                      "lines are embedded, an approximation whose scores are lower than and not "
+                                      "comparable with those of whole-file matches")
+    query.add_argument("--build-clusters", type=int, metavar="N",
+                       help="(Re)train N coarse clusters for the index and exit")
+    parser.add_argument("--repo", help="Repository to read a --commit from when it is not in the index, "
+                                       "or to rebuild the whole files a --diff changes from")
+    parser.add_argument("-k", type=positive_int, default=K, help="Number of similar fixes to list")
+    parser.add_argument("--nprobe", type=int, default=NPROBE, help="Clusters searched per query")
+    parser.add_argument("--exact", action="store_true", help="Score every row, even with clusters")
+    parser.add_argument("--model", help="Model directory to embed a --diff or --repo commit with "
+                                        "(default: the model the index was built with)")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with instrumentation.Run("embedding_index", args):
+        query(args)
+
+def query(args):
+    if not os.path.exists(os.path.join(args.index, MANIFEST)):
+        print(f"Error: no index in {args.index}. Run calculate_similarity.py --index first.")
+        return
+    index = EmbeddingIndex(args.index)
+    if args.build_clusters is not None:
+        with instrumentation.stage("cluster") as stage:
+            index.build_clusters(args.build_clusters)
+            stage.items = len(index)
+        print(f"Trained {len(index.centroids)} clusters over {len(index)} rows.")
+        return
+
+    with instrumentation.stage("search", "queries") as stage:
+        matches = index.similar_to_commit(args.commit, args.k, args.nprobe, args.exact) if args.commit else None
+        if matches is None:
+            if args.commit and not args.repo:
+                print(f"Error: commit {args.commit} is not in the index (pass --repo to read it from git).")
+                return
+            if args.commit:
+                pairs = commit_pairs(args.repo, args.commit)
+            else:
+                with sys.stdin if args.diff == "-" else open(args.diff) as f:
+                    diff = f.read()
+                if args.repo:
+                    try:
+                        pairs = diff_pairs(args.repo, diff)
+                    except ValueError as e:
+                        print(f"Error: the diff does not apply to {args.repo}: {e}")
+                        return
+                else:
+                    print("Note: without --repo only the diff's lines are embedded, not whole files; "
+                          "similarities are approximate.")
+                    pairs = [diff_sides(diff)]
+            vectors = embed_changes(pairs, index.info, args.model)
+            if not len(vectors):
+                print("Error: nothing to compare (no file with both a before and an after version).")
+                return
+            (best, top), = index.search(vectors.mean(axis=0), args.k, args.nprobe, args.exact)
+            matches = index.matches(best, top)
+        stage.items = 1
+
+    if args.exact or index.centroids is None:
+        mode = "exact"
+    else:
+        mode = f"{min(args.nprobe, len(index.centroids))} of {len(index.centroids)} clusters"
+    print(f"{len(matches)} most similar fixes among {len(index)} ({mode}):")
+    for rank, match in enumerate(matches.itertuples(), 1):
+        message = match.Message.splitlines()[0] if match.Message else ""
+        print(f"{rank:3}. {match.Similarity:.3f}  {match.Hash[:10]}  {match.Filename}  {message}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+from radon.metrics import mi_compute, halstead_visitor_report
+from radon.visitors import ComplexityVisitor, HalsteadVisitor
+from radon.raw import analyze
+import hashlib
+import json
+import ast
+import sys
+import os
+import re
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation
+
+# Matches the header of one unified diff hunk: @@ -start,len +start,len @@
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
+
+class Segment:
+    """
+    Metrics of one top-level statement (or of the blank/comment lines
+    between two statements). All the metrics used by get_metrics add up
+    over top-level statements, so a file can be described as a list of
+    segments and re-assembled from them.
+    """
+
+    def __init__(self, start, end, raw, complexity, blocks, halstead):
+        self.start = start            # First line (1-based, inclusive)
+        self.end = end                # Last line
+        self.raw = raw                # radon raw counts, as a tuple
+        self.complexity = complexity  # Decision points (total complexity - 1)
+        self.blocks = blocks          # [(block name, complexity)]
+        self.halstead = halstead      # (N1, N2, operators seen, operands seen, anonymous operands)
+
+    def shifted(self, offset):
+        return Segment(self.start + offset, self.end + offset, self.raw,
+                       self.complexity, self.blocks, self.halstead)
+
+def halstead_summary(tree):
+    """
+    Halstead counts of a tree, in a form that can be merged with other
+    statements: operand AST nodes are only ever equal to themselves, so
+    they are kept as a count instead of as objects.
+    """
+    visitor = HalsteadVisitor.from_ast(tree)
+    operands = set()
+    anonymous = 0
+    for context, value in visitor.operands_seen:
+        if isinstance(value, ast.AST):
+            anonymous += 1
+        else:
+            operands.add((context, value))
+    return (visitor.operators, visitor.operands, frozenset(visitor.operators_seen),
+            frozenset(operands), anonymous)
+
+def analyze_segment(lines, start, end, nodes, memo=None):
+    """
+    Computes the metrics of lines[start-1:end], which hold the given
+    statements. The metrics only depend on the text, so identical
+    statements found anywhere (another file version, another row) are
+    looked up in the memo instead of being analyzed again.
+    """
+    # The trailing newline keeps blank last lines from being dropped by splitlines()
+    text = "\n".join(lines[start - 1:end]) + "\n"
+    key = hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest()
+    if memo is not None and key in memo:
+        return memo[key].shifted(start - memo[key].start)
+
+    with instrumentation.timer("radon"):
+        raw = tuple(analyze(text))
+        module = ast.Module(body=nodes, type_ignores=[])
+        visitor = ComplexityVisitor.from_ast(module)
+        blocks = [(block.fullname, block.complexity) for block in visitor.blocks]
+        segment = Segment(start, end, raw, visitor.total_complexity - 1, blocks, halstead_summary(module))
+    if memo is not None:
+        memo[key] = segment
+    return segment
+
+def segment_source(lines, first_line=1, last_line=None, memo=None):
+    """
+    Splits lines[first_line-1:last_line] into segments: one per top-level
+    statement (statements sharing a line are kept together) plus one per
+    run of lines between statements. Raises SyntaxError if the lines are
+    not a sequence of complete statements.
+    """
+    if last_line is None:
+        last_line = len(lines)
+    text = "\n".join(lines[first_line - 1:last_line])
+    tree = ast.parse(text)
+    offset = first_line - 1
+
+    # Group statements into non-overlapping line spans
+    spans = []
+    for node in tree.body:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        end = node.end_lineno
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+            spans[-1][2].append(node)
+        else:
+            spans.append([start, end, [node]])
+
+    local_lines = lines[first_line - 1:last_line]
+    segments = []
+    position = 1
+    for start, end, nodes in spans:
+        if start > position:
+            segments.append(analyze_segment(local_lines, position, start - 1, [], memo))
+        segments.append(analyze_segment(local_lines, start, end, nodes, memo))
+        position = end + 1
+    if position <= len(local_lines):
+        segments.append(analyze_segment(local_lines, position, len(local_lines), [], memo))
+
+    return [segment.shifted(offset) for segment in segments]
+
+def combine(segments):
+    """Re-assembles (MI, CC, LOC) of a whole file from its segments."""
+    loc, lloc, sloc, comments, multi, blank, single_comments = (
+        sum(values) for values in zip(*[segment.raw for segment in segments])
+    ) if segments else (0,) * 7
+
+    cc = sum(complexity for segment in segments for _, complexity in segment.blocks) + 1
+    total_complexity = 1 + sum(segment.complexity for segment in segments)
+
+    visitor = HalsteadVisitor()
+    anonymous = 0
+    for segment in segments:
+        operators, operands, operators_seen, operands_seen, anon = segment.halstead
+        visitor.operators += operators
+        visitor.operands += operands
+        visitor.operators_seen.update(operators_seen)
+        visitor.operands_seen.update(operands_seen)
+        anonymous += anon
+    # Stand-ins for the operand nodes, which never compare equal to anything else
+    visitor.operands_seen.update(("<node>", i) for i in range(anonymous))
+    volume = halstead_visitor_report(visitor).volume
+
+    comment_lines = comments + multi
+    comment_percent = comment_lines / float(sloc) * 100 if sloc != 0 else 0
+    mi = mi_compute(volume, total_complexity, lloc, comment_percent)
+    return round(mi, 2), cc, loc
+
+def split_lines(code):
+    """Splits a source on "\n" only, the way git counts lines in a diff."""
+    lines = code.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    return lines
+
+def has_lone_cr(code):
+    """Python (but not git) treats a lone "\r" as a line break; such files are not segmented."""
+    return "\r" in code.replace("\r\n", "")
+
+def parse_hunks(diff_text):
+    """Returns [(old start, old length, new start, new length)] for a unified diff."""
+    hunks = []
+    for match in HUNK_HEADER.finditer(diff_text or ""):
+        old_start, old_len, new_start, new_len = match.groups()
+        hunks.append((int(old_start), int(old_len or 1), int(new_start), int(new_len or 1)))
+    return hunks
+
+class IncrementalMetrics:
+    """
+    Diff-scoped metrics engine.
+
+    Every file version is kept as a list of segments, memoized by blob
+    hash. For a change, only the top-level statements touched by the
+    diff hunks are parsed and analyzed again in the new version; every
+    other segment is reused from the old version, shifted to its new
+    line numbers. Because the previous commit's "after" is usually the
+    next commit's "before", walking a history only ever analyzes the
+    statements that changed.
+    """
+
+    def __init__(self, fallback, memo=dict):
+        self.fallback = fallback  # Full-file metrics for sources that cannot be segmented
+        # `memo` makes both memos; a size-bounded mapping keeps long streams in bounded memory
+        self.segments = memo()  # blob hash -> segments, or None if it does not parse
+        self.statements = memo()  # statement text hash -> segment
+        self.full = 0
+        self.incremental = 0
+
+    @staticmethod
+    def key(code):
+        return hashlib.sha1(code.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def file_segments(self, code):
+        """Segments of a whole file (memoized), or None if it does not parse."""
+        key = self.key(code)
+        if key in self.segments:
+            return self.segments[key]
+        self.full += 1
+        try:
+            segments = segment_source(split_lines(code), memo=self.statements)
+        except Exception:
+            segments = None
+        self.segments[key] = segments
+        return segments
+
+    def changed_segments(self, before, after, diff_text):
+        """
+        Segments of the after version built from the before version and
+        the diff. Returns (segments, old touched, new touched), or None when
+        the diff cannot be applied incrementally.
+        """
+        old_segments = self.file_segments(before)
+        hunks = parse_hunks(diff_text)
+        if old_segments is None or not hunks:
+            return None
+
+        old_lines = split_lines(before)
+        new_lines = split_lines(after)
+        if len(old_lines) + sum(nl - ol for _, ol, _, nl in hunks) != len(new_lines):
+            return None  # The diff does not describe these two versions
+
+        # Old-side regions to redo: each hunk, grown to whole segments,
+        # merged when they overlap or touch
+        regions = []
+        for old_start, old_len, _, _ in hunks:
+            low, high = (old_start, old_start + old_len - 1) if old_len else (old_start, old_start + 1)
+            for segment in old_segments:
+                if segment.start <= high and segment.end >= low:
+                    low, high = min(low, segment.start), max(high, segment.end)
+            if regions and low <= regions[-1][1] + 1:
+                regions[-1][1] = max(regions[-1][1], high)
+            else:
+                regions.append([low, high])
+
+        def new_line(old_line):
+            """Maps an unchanged old line (or 0 / len+1) to its new number."""
+            if old_line > len(old_lines):
+                return len(new_lines) + 1
+            shift = 0
+            for old_start, old_len, new_start, new_len in hunks:
+                if old_start + old_len - 1 < old_line:
+                    shift += new_len - old_len
+            return old_line + shift
+
+        result = []
+        old_touched = []
+        new_touched = []
+        position = 1
+        for low, high in regions:
+            for segment in old_segments:
+                if position <= segment.start and segment.end < low:
+                    result.append(segment.shifted(new_line(segment.start) - segment.start))
+            old_touched.extend(s for s in old_segments if s.start >= low and s.end <= high)
+
+            new_low = new_line(low - 1) + 1
+            new_high = new_line(high + 1) - 1
+            if new_high >= new_low:
+                try:
+                    fresh = segment_source(new_lines, new_low, new_high, self.statements)
+                except Exception:
+                    return None
+                result.extend(fresh)
+                new_touched.extend(fresh)
+            position = high + 1
+
+        for segment in old_segments:
+            if segment.start >= position:
+                result.append(segment.shifted(new_line(segment.start) - segment.start))
+
+        return result, old_touched, new_touched
+
+    def file_metrics(self, code):
+        """(MI, CC, LOC) of a whole file, as get_metrics computes them."""
+        if not isinstance(code, str) or not code.strip():
+            return 0, 0, 0
+        if has_lone_cr(code):
+            return self.fallback(code)
+        segments = self.file_segments(code)
+        return combine(segments) if segments is not None else (0, 0, 0)
+
+    def change(self, before, after, diff_text):
+        """
+        Returns (MI change, CC change, LOC change, per-function CC changes)
+        for one row, matching get_metrics on the full files.
+        """
+        usable = all(isinstance(code, str) and code.strip() and not has_lone_cr(code)
+                     for code in (before, after))
+        changed = self.changed_segments(before, after, diff_text) if usable else None
+
+        if changed is None:
+            mi_b, cc_b, loc_b = self.file_metrics(before)
+            mi_a, cc_a, loc_a = self.file_metrics(after)
+            old_touched = self.file_segments(before) if usable else None
+            new_touched = self.file_segments(after) if usable else None
+            old_touched, new_touched = old_touched or [], new_touched or []
+        else:
+            new_segments, old_touched, new_touched = changed
+            self.segments.setdefault(self.key(after), new_segments)
+            self.incremental += 1
+            mi_b, cc_b, loc_b = combine(self.file_segments(before))
+            mi_a, cc_a, loc_a = combine(new_segments)
+
+        # Per-function deltas, only for the blocks the change touched
+        deltas = {}
+        for segment in old_touched:
+            for name, complexity in segment.blocks:
+                deltas[name] = deltas.get(name, 0) - complexity
+        for segment in new_touched:
+            for name, complexity in segment.blocks:
+                deltas[name] = deltas.get(name, 0) + complexity
+        function_changes = {name: delta for name, delta in deltas.items() if delta != 0}
+
+        return (round(mi_a - mi_b, 2), cc_a - cc_b, loc_a - loc_b,
+                json.dumps(function_changes, sort_keys=True))
@@ -0,0 +1,133 @@
+from collections import Counter, OrderedDict
+from multiprocessing import Pool
+import hashlib
+import sys
+import os
+
+from sacrebleu.metrics import BLEU
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation
+
+# --- Configuration ---
+MAX_NGRAM_ORDER = 4
+TABLE_CACHE_SIZE = 256  # n-gram tables kept per process (whole files can be large)
+CHUNK_PAIRS = 64        # (hypothesis, reference) pairs handed to a worker at once
+
+# Same settings as sacrebleu.corpus_bleu's defaults: 13a tokenizer, exp smoothing
+_bleu = BLEU()
+_tables = OrderedDict()  # blob hash -> (n-gram counts, token count), per process
+
+def blob_hash(code):
+    return hashlib.sha1(code.encode("utf-8", "surrogatepass")).hexdigest()
+
+def is_usable(code):
+    return isinstance(code, str) and bool(code.strip())
+
+def ngram_table(code):
+    """
+    Tokenizes a source like sacrebleu and counts its 1- to 4-grams.
+    Tables are cached by blob hash, so a file that is the "after" of one
+    row and the "before" of the next is only tokenized once.
+    """
+    key = blob_hash(code)
+    table = _tables.get(key)
+    if table is not None:
+        _tables.move_to_end(key)
+        return table
+
+    # The same counts as sacrebleu's extract_all_word_ngrams, counted in C
+    tokens = _bleu.tokenizer(code.rstrip()).split()
+    counts = Counter()
+    for n in range(1, MAX_NGRAM_ORDER + 1):
+        counts.update(zip(*[tokens[i:] for i in range(n)]))
+    table = (counts, len(tokens))
+    _tables[key] = table
+    if len(_tables) > TABLE_CACHE_SIZE:
+        _tables.popitem(last=False)
+    return table
+
+def pair_bleu(hypothesis, reference):
+    """
+    BLEU of one hypothesis against one reference on a 0-1 scale: the
+    same statistics and formula as sacrebleu.corpus_bleu([hypothesis],
+    [[reference]]).score / 100, from the cached n-gram tables.
+    """
+    hyp_ngrams, hyp_len = ngram_table(hypothesis)
+    ref_ngrams, ref_len = ngram_table(reference)
+
+    # Every hypothesis n-gram counts towards the total of its order
+    total = [max(hyp_len - n, 0) for n in range(MAX_NGRAM_ORDER)]
+    if hypothesis == reference:
+        correct = total[:]
+    else:
+        correct = [0] * MAX_NGRAM_ORDER
+        for ngram in hyp_ngrams.keys() & ref_ngrams.keys():
+            correct[len(ngram) - 1] += min(hyp_ngrams[ngram], ref_ngrams[ngram])
+
+    score = BLEU.compute_bleu(correct, total, hyp_len, ref_len, smooth_method=_bleu.smooth_method,
+                              max_ngram_order=MAX_NGRAM_ORDER)
+    return score.score / 100.0
+
+def score_pairs(pairs):
+    with instrumentation.timer("bleu"):
+        return [pair_bleu(hypothesis, reference) for hypothesis, reference in pairs]
+
+def blob_groups(keys):
+    """
+    Numbers the groups of (hypothesis hash, reference hash) pairs connected
+    through shared blobs (union-find over the hashes). Returns the group of
+    every pair, numbered in order of first appearance.
+    """
+    parent = {}
+
+    def find(key):
+        while parent.setdefault(key, key) != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for hyp_key, ref_key in keys:
+        parent[find(hyp_key)] = find(ref_key)
+
+    numbers = {}
+    return [numbers.setdefault(find(hyp_key), len(numbers)) for hyp_key, _ in keys]
+
+def batch_token_similarity(hypotheses, references, workers=1):
+    """
+    BLEU of every (hypothesis, reference) row. Each distinct pair is
+    scored once; pairs are sent to a pool of workers in chunks, grouped so
+    that consecutive versions of a file meet the same worker cache.
+    Rows with a missing or blank side score 0.0, as in get_token_similarity.
+    """
+    rows = []
+    unique = {}  # (hypothesis hash, reference hash) -> index into pairs
+    pairs = []
+    keys = []
+    for hypothesis, reference in zip(hypotheses, references):
+        if not is_usable(hypothesis) or not is_usable(reference):
+            rows.append(None)
+            continue
+        key = (blob_hash(hypothesis), blob_hash(reference))
+        if key not in unique:
+            unique[key] = len(pairs)
+            pairs.append((hypothesis, reference))
+            keys.append(key)
+        rows.append(unique[key])
+
+    # Pairs that share a blob (usually successive versions of one file) are
+    # scored next to each other, so their tables are still cached
+    order = sorted(range(len(pairs)), key=blob_groups(keys).__getitem__)
+    ordered = [pairs[i] for i in order]
+    chunks = [ordered[i:i + CHUNK_PAIRS] for i in range(0, len(ordered), CHUNK_PAIRS)]
+    if workers > 1 and len(chunks) > 1:
+        with Pool(workers) as pool:
+            results = pool.map(instrumentation.measured(score_pairs), chunks, chunksize=1)
+        results = [instrumentation.merged(result) for result in results]
+    else:
+        results = [score_pairs(chunk) for chunk in chunks]
+    scores = [0.0] * len(pairs)
+    for i, score in zip(order, (score for chunk in results for score in chunk)):
+        scores[i] = score
+
+    return [0.0 if i is None else scores[i] for i in rows]
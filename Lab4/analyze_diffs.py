@@ -1,12 +1,27 @@
 import pandas as pd
-from pydriller import Repository
+from multiprocessing import Pool
 import subprocess
+import argparse
+import time
+import sys
+import re
 import os
 
+import diff_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.git_repo import GitRepository
+from common import instrumentation
+
 # --- Configuration ---
 REPOS = ["repositories/httpie", "repositories/rich", "repositories/tqdm"]
 OUTPUT_CSV = "diff_discrepancy_analysis.csv"
 COMMIT_LIMIT = 100  # Limit per repo to save time
+ENGINE = "git"      # "git": one git diff per commit and algorithm, "python": in-process (no "index" lines)
+WORKERS = 1         # Number of processes analyzing commits
+UNIT_SIZE = 20      # Commits per work unit handed to a worker
+OUTPUT_COLUMNS = ["Repository", "File_Path", "File_Type", "Commit_SHA", "Parent_SHA",
+                  "Message", "Diff_Myers", "Diff_Hist", "Discrepancy", "Fast_Path", "Commit_Date"]
 
 def clean_diff(diff_text):
     """
@@ -20,24 +35,113 @@ def clean_diff(diff_text):
     cleaned = [line.strip() for line in lines if line.strip()]
     return "\n".join(cleaned)
 
-def get_raw_diff(repo_path, algorithm, parent_hash, commit_hash, file_path):
+# Each file's section of a multi-file diff starts with this header
+FILE_HEADER = re.compile(r"^diff --git ", re.MULTILINE)
+C_ESCAPES = {"a": "\a", "b": "\b", "t": "\t", "n": "\n", "v": "\v", "f": "\f", "r": "\r",
+             '"': '"', "\\": "\\"}
+
+def unquote_path(path):
+    """Undoes git's C-style quoting of unusual file names ("a/t\\303\\251st.py")."""
+    if not path.startswith('"'):
+        return path
+    raw = bytearray()
+    i = 1
+    while i < len(path) - 1:
+        char = path[i]
+        if char == "\\":
+            following = path[i + 1]
+            if following in "01234567":
+                raw.append(int(path[i + 1:i + 4], 8))
+                i += 4
+                continue
+            raw.extend(C_ESCAPES.get(following, following).encode())
+            i += 2
+        else:
+            raw.extend(char.encode())
+            i += 1
+    return raw.decode("utf-8", "replace")
+
+def diff_section_paths(section):
+    """Returns (old path, new path) of one file's section of a git diff."""
+    old_path = new_path = None
+    for line in section.split("\n"):
+        # Names containing spaces get a trailing tab on these lines
+        if line.startswith("--- "):
+            old_path = unquote_path(line[4:].rstrip("\t"))
+        elif line.startswith("+++ "):
+            new_path = unquote_path(line[4:].rstrip("\t"))
+            break
+        elif line.startswith("@@"):
+            break
+
+    if old_path is None or new_path is None:
+        # No content lines (e.g. a mode change): fall back to the header,
+        # which holds "a/<path> b/<path>" with the same path twice
+        header = section.split("\n", 1)[0][len("diff --git "):]
+        if header.startswith('"'):
+            parts = re.findall(r'"(?:[^"\\]|\\.)*"|\S+', header)
+            old_path, new_path = unquote_path(parts[0]), unquote_path(parts[-1])
+        else:
+            middle = len(header) // 2
+            old_path, new_path = header[:middle], header[middle + 1:]
+
+    strip = lambda path: None if path == "/dev/null" else path.split("/", 1)[1]
+    return strip(old_path), strip(new_path)
+
+def split_diff(diff_text):
+    """Splits the output of one git diff into {path: that file's section}."""
+    sections = {}
+    starts = [match.start() for match in FILE_HEADER.finditer(diff_text)] + [len(diff_text)]
+    for start, end in zip(starts, starts[1:]):
+        section = diff_text[start:end]
+        old_path, new_path = diff_section_paths(section)
+        for path in (new_path, old_path):
+            if path is not None:
+                sections.setdefault(path, section)
+    return sections
+
+def get_commit_diffs(repo_path, algorithm, parent_hash, commit_hash):
     """
-    Runs git diff with a specific algorithm (myers or histogram).
+    Runs git diff with a specific algorithm (myers or histogram) once for
+    the whole commit, and returns the per-file sections keyed by path.
     """
     cmd = [
         "git", "diff",
         f"--diff-algorithm={algorithm}",
+        "--no-renames",  # Same pairing of old/new files as a per-file diff
         parent_hash,
         commit_hash,
-        "--", file_path
     ]
     try:
-        result = subprocess.run(
-            cmd, cwd=repo_path, capture_output=True, text=True, errors="replace"
-        )
-        return result.stdout
+        with instrumentation.timer("subprocess"):
+            result = subprocess.run(
+                cmd, cwd=repo_path, capture_output=True, text=True, errors="replace"
+            )
+        return split_diff(result.stdout)
     except Exception as e:
-        return ""
+        return {}
+
+def file_diff(sections, mod):
+    """Finds a modified file's section, by its new path first and then its old path."""
+    for path in (mod.new_path, mod.old_path):
+        if path is not None:
+            section = sections.get(path.replace(os.sep, "/"))
+            if section is not None:
+                return section
+    return ""
+
+def engine_diff(mod, algorithm):
+    """Diffs a modified file in-process, from the two blob versions."""
+    old_path = mod.old_path.replace(os.sep, "/") if mod.old_path else None
+    new_path = mod.new_path.replace(os.sep, "/") if mod.new_path else None
+    before, after = mod.source_code_before, mod.source_code
+    with instrumentation.timer("diff"):
+        return diff_engine.file_diff(old_path, new_path, before, after, algorithm)
+
+def section_hunks(section):
+    """The hunks of a diff section, without the file header lines."""
+    start = section.find("\n@@")
+    return section[start + 1:] if start >= 0 else ""
 
 def categorize_file(filepath):
     """Categorizes files for the final report stats."""
@@ -53,66 +157,219 @@ def categorize_file(filepath):
     else:
         return "Other"
 
+def select_commits(repo_path, limit=COMMIT_LIMIT):
+    """
+    The commits to analyze: the first `limit` commits that have a parent,
+    oldest first (the first commit has no parent to diff against).
+    """
+    with GitRepository(repo_path) as repo:
+        return repo.rev_list(options=["--min-parents=1"])[:limit]
+
+def make_units(repo_commits, unit_size=UNIT_SIZE):
+    """
+    Splits every repository's commits into (repository, range) work units.
+    A big repository becomes many units, so it is spread over all workers
+    instead of keeping one busy while the others wait.
+    """
+    units = []
+    for repo_path, hashes in repo_commits.items():
+        for i in range(0, len(hashes), unit_size):
+            units.append((repo_path, hashes[i:i + unit_size]))
+    return units
+
+# Per worker process: settings and one open GitRepository per repository
+_settings = {}
+_repos = {}
+
+def init_worker(engine, verify):
+    _settings.update(engine=engine, verify=verify)
+
+def analyze_commit(repo, repo_path, commit_hash):
+    """Compares Myers and histogram for every modified file of one commit."""
+    engine, verify = _settings["engine"], _settings["verify"]
+    commit = repo.commit(commit_hash)
+    parent_hash = commit.parents[0]
+    rows = []
+    checked = mismatched = 0
+
+    # With git: one git diff per algorithm for the whole commit, split by
+    # file, only run once a file needs it
+    sections = {}
+
+    def commit_sections(algorithm):
+        if algorithm not in sections:
+            sections[algorithm] = get_commit_diffs(repo_path, algorithm, parent_hash, commit.hash)
+        return sections[algorithm]
+
+    for mod in repo.modified_files(commit):
+        # We only care about Modified files (not new/deleted) for diff comparison
+        if mod.change_type != 'MODIFY':
+            continue
+
+        # Changes where both algorithms provably agree only need one diff
+        fast = diff_engine.fast_path(mod.source_code_before, mod.source_code)
+
+        if engine == "python":
+            # 1. Get Diff using Myers (Default)
+            diff_myers = engine_diff(mod, "myers")
+
+            # 2. Get Diff using Histogram
+            diff_hist = diff_myers if fast else engine_diff(mod, "histogram")
+        else:
+            diff_myers = file_diff(commit_sections("myers"), mod)
+            diff_hist = diff_myers if fast else file_diff(commit_sections("histogram"), mod)
+
+        if verify:
+            for algorithm, ours in (("myers", diff_myers), ("histogram", diff_hist)):
+                if engine == "git":
+                    ours = engine_diff(mod, algorithm)
+                checked += 1
+                if section_hunks(ours) != section_hunks(file_diff(commit_sections(algorithm), mod)):
+                    mismatched += 1
+                    print(f"  Engine/git mismatch ({algorithm}): {commit.hash[:10]} {mod.new_path}")
+
+        # 3. Compare (Ignoring whitespace/blanks)
+        clean_myers = clean_diff(diff_myers)
+        clean_hist = clean_diff(diff_hist)
+
+        is_discrepancy = "No" if clean_myers == clean_hist else "Yes"
+
+        # Store data
+        rows.append({
+            "Repository": repo_path,
+            "File_Path": mod.new_path,
+            "File_Type": categorize_file(mod.new_path or mod.old_path),
+            "Commit_SHA": commit.hash,
+            "Parent_SHA": parent_hash,
+            "Message": commit.msg.split('\n')[0], # Just the title
+            "Diff_Myers": diff_myers[:500], # Store snippet to save space
+            "Diff_Hist": diff_hist[:500],
+            "Discrepancy": is_discrepancy,
+            "Fast_Path": "Yes" if fast else "No",
+            "Commit_Date": commit.committer_date.isoformat() if commit.committer_date else "",  # Time windows of generate_stats.py
+        })
+
+    return rows, checked, mismatched
+
+def analyze_unit(unit):
+    """Analyzes one work unit. Returns (rows, checked, mismatched, seconds)."""
+    repo_path, hashes = unit
+    start = time.perf_counter()
+    repo = _repos.get(repo_path)
+    if repo is None:
+        repo = _repos[repo_path] = GitRepository(repo_path)
+
+    rows = []
+    checked = mismatched = 0
+    for commit_hash in hashes:
+        commit_rows, commit_checked, commit_mismatched = analyze_commit(repo, repo_path, commit_hash)
+        rows.extend(commit_rows)
+        checked += commit_checked
+        mismatched += commit_mismatched
+    instrumentation.count("commits", len(hashes))
+    instrumentation.count("files", len(rows))
+    return rows, checked, mismatched, time.perf_counter() - start
+
+def run_units(units, workers, engine, verify):
+    """
+    Runs the work units, on a process pool when workers > 1. Yields each
+    unit's result in unit order (the order of a sequential scan), as soon
+    as it and every unit before it are done.
+    """
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(engine, verify)) as pool:
+            # Small units, handed out one at a time: a slow unit only
+            # delays the output, while the other workers keep going
+            for result in pool.imap(instrumentation.measured(analyze_unit), units, chunksize=1):
+                yield instrumentation.merged(result)
+    else:
+        init_worker(engine, verify)
+        try:
+            for unit in units:
+                yield analyze_unit(unit)
+        finally:
+            for repo in _repos.values():
+                repo.close()
+            _repos.clear()
+
+def append_rows(output_file, rows, header):
+    """Appends rows to the output CSV (with the header for the first ones)."""
+    pd.DataFrame(rows, columns=OUTPUT_COLUMNS).to_csv(output_file, mode="a", header=header, index=False)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Myers vs histogram diff discrepancies.")
+    parser.add_argument("--engine", choices=["python", "git"], default=ENGINE,
+                        help="Compute the diffs with git diff or in-process (faster; identical hunks, but "
+                             "Diff_Myers/Diff_Hist have no \"index\" line)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Also run git diff and check that the in-process hunks are identical")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Number of worker processes (1 = analyze in this process)")
+    parser.add_argument("--unit-size", type=int, default=UNIT_SIZE,
+                        help="Commits per work unit")
+    parser.add_argument("--repos", nargs="+", default=REPOS, help="Repositories to analyze")
+    parser.add_argument("--limit", type=int, default=COMMIT_LIMIT, help="Commits analyzed per repository")
+    parser.add_argument("--output", default=OUTPUT_CSV, help="CSV file to write")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
 def main():
-    data = []
-    
-    for repo_path in REPOS:
-        print(f"Scanning {repo_path}...")
-        
-        # Traverse commits (reversed to get recent ones first if we wanted, 
-        # but pydriller goes chronological by default. We limit to first 100 found).
-        count = 0
-        for commit in Repository(repo_path).traverse_commits():
-            if count >= COMMIT_LIMIT:
-                break
-            
-            # Skip the first commit as it has no parent
-            if not commit.parents:
-                continue
-                
-            parent_hash = commit.parents[0]
-            
-            for mod in commit.modified_files:
-                # We only care about Modified files (not new/deleted) for diff comparison
-                if mod.change_type.name != 'MODIFY':
-                    continue
-                
-                # 1. Get Diff using Myers (Default)
-                diff_myers = get_raw_diff(repo_path, "myers", parent_hash, commit.hash, mod.filename)
-                
-                # 2. Get Diff using Histogram
-                diff_hist = get_raw_diff(repo_path, "histogram", parent_hash, commit.hash, mod.filename)
-                
-                # 3. Compare (Ignoring whitespace/blanks)
-                clean_myers = clean_diff(diff_myers)
-                clean_hist = clean_diff(diff_hist)
-                
-                is_discrepancy = "No" if clean_myers == clean_hist else "Yes"
-                
-                # Store data
-                data.append({
-                    "Repository": repo_path,
-                    "File_Path": mod.new_path,
-                    "File_Type": categorize_file(mod.new_path or mod.old_path),
-                    "Commit_SHA": commit.hash,
-                    "Parent_SHA": parent_hash,
-                    "Message": commit.msg.split('\n')[0], # Just the title
-                    "Diff_Myers": diff_myers[:500], # Store snippet to save space
-                    "Diff_Hist": diff_hist[:500],
-                    "Discrepancy": is_discrepancy
-                })
-            
-            count += 1
-            if count % 10 == 0:
-                print(f"  Processed {count} commits...")
+    args = parse_args()
+    with instrumentation.Run("diff_discrepancies", args):
+        analyze(args)
+
+def analyze(args):
+    start_time = time.perf_counter()
+
+    # Traverse commits chronologically, like pydriller. We limit to first 100 found.
+    repo_commits = {}
+    with instrumentation.stage("select", "commits") as stage:
+        for repo_path in args.repos:
+            repo_commits[repo_path] = select_commits(repo_path, args.limit)
+            print(f"Scanning {repo_path}: {len(repo_commits[repo_path])} commits")
+        stage.items = sum(len(hashes) for hashes in repo_commits.values())
+    units = make_units(repo_commits, args.unit_size)
+    print(f"Analyzing {len(units)} work units with {args.workers} worker(s)...")
+
+    # Results are appended as they arrive, in a deterministic order
+    open(args.output, "w").close()
+    total = checked = mismatched = fast = 0
+    stats = {repo_path: {"commits": 0, "files": 0, "busy": 0.0, "done": None}
+             for repo_path in args.repos}
+
+    with instrumentation.stage("analyze", "commits") as stage:
+        for (repo_path, hashes), (rows, unit_checked, unit_mismatched, seconds) in \
+                zip(units, run_units(units, args.workers, args.engine, args.verify)):
+            append_rows(args.output, rows, header=total == 0)
+            total += len(rows)
+            fast += sum(row["Fast_Path"] == "Yes" for row in rows)
+            checked += unit_checked
+            mismatched += unit_mismatched
+
+            repo_stats = stats[repo_path]
+            repo_stats["commits"] += len(hashes)
+            repo_stats["files"] += len(rows)
+            repo_stats["busy"] += seconds
+            repo_stats["done"] = time.perf_counter() - start_time
+            if repo_stats["commits"] == len(repo_commits[repo_path]):
+                rate = repo_stats["commits"] / max(repo_stats["busy"], 1e-9)
+                print(f"  {repo_path}: {repo_stats['commits']} commits, {repo_stats['files']} files in "
+                      f"{repo_stats['busy']:.1f}s of worker time ({rate:.1f} commits/sec), "
+                      f"finished at {repo_stats['done']:.1f}s")
+        stage.items = sum(repo_stats["commits"] for repo_stats in stats.values())
+
+    if total == 0:
+        append_rows(args.output, [], header=True)
 
     # Save Results
-    df = pd.DataFrame(data)
-    df.to_csv(OUTPUT_CSV, index=False)
     print("-" * 30)
     print("SUCCESS!")
-    print(f"Analysis complete. Found {len(data)} file modifications.")
-    print(f"Results saved to {OUTPUT_CSV}")
+    print(f"Analysis complete. Found {total} file modifications "
+          f"in {time.perf_counter() - start_time:.1f}s ({args.engine} engine).")
+    print(f"Fast path: {fast} of {total} files needed only one diff.")
+    if args.verify:
+        print(f"Verified {checked} diffs against git: {checked - mismatched} identical, {mismatched} different.")
+    print(f"Results saved to {args.output}")
     print("-" * 30)
 
 if __name__ == "__main__":
@@ -0,0 +1,829 @@
+"""
+In-process Myers and histogram diff, following git's xdiff.
+
+Lines are interned to small integers up front, so every core loop
+compares ints instead of strings. The algorithms mirror xdiff closely
+enough to reproduce `git diff --diff-algorithm=myers|histogram`:
+
+    * Myers: trimming of the common prefix/suffix, discarding of lines
+      that cannot match (xdl_cleanup_records), then the bidirectional
+      divide-and-conquer search with xdiff's cost heuristics.
+    * Histogram: xhistogram's lowest-occurrence LCS recursion, falling
+      back to Myers on regions where every common line is too frequent.
+    * Both: git's post-processing (xdl_change_compact, with the indent
+      heuristic that git enables by default) and its hunk output
+      (3 lines of context, merged hunks, function-name hunk headers).
+"""
+from collections import Counter
+
+# --- xdiff constants ---
+XDL_MAX_COST_MIN = 256
+XDL_HEUR_MIN_COST = 256
+XDL_SNAKE_CNT = 20
+XDL_K_HEUR = 4
+XDL_MAX_EQLIMIT = 1024
+XDL_SIMSCAN_WINDOW = 100
+XDL_KPDIS_RUN = 4
+XDL_LINE_MAX = (1 << 63) - 1
+HISTOGRAM_MAX_CHAIN = 64
+
+# Indent heuristic (xdiffi.c)
+MAX_INDENT = 200
+MAX_BLANKS = 20
+START_OF_FILE_PENALTY = 1
+END_OF_FILE_PENALTY = 21
+TOTAL_BLANK_WEIGHT = -30
+POST_BLANK_WEIGHT = 6
+RELATIVE_INDENT_PENALTY = -4
+RELATIVE_INDENT_WITH_BLANK_PENALTY = 10
+RELATIVE_OUTDENT_PENALTY = 24
+RELATIVE_OUTDENT_WITH_BLANK_PENALTY = 17
+RELATIVE_DEDENT_PENALTY = 23
+RELATIVE_DEDENT_WITH_BLANK_PENALTY = 17
+INDENT_WEIGHT = 60
+INDENT_HEURISTIC_MAX_SLIDING = 100
+
+CONTEXT_LINES = 3
+FUNC_LINE_SIZE = 80     # git keeps at most 80 bytes of the function line
+HUNK_HEADER_SIZE = 128  # ... and at most 128 bytes of hunk header
+BINARY_CHECK_SIZE = 8000
+
+def split_records(text):
+    """Splits a file into lines, keeping each line's "\\n" like git's records."""
+    if not text:
+        return []
+    lines = text.split("\n")
+    records = [line + "\n" for line in lines[:-1]]
+    if lines[-1]:
+        records.append(lines[-1])  # Last line without a newline
+    return records
+
+def intern_records(records1, records2):
+    """Maps every distinct line to a small integer shared by both files."""
+    ids = {}
+    hashes1 = [ids.setdefault(record, len(ids)) for record in records1]
+    hashes2 = [ids.setdefault(record, len(ids)) for record in records2]
+    return hashes1, hashes2
+
+def bogosqrt(n):
+    """xdiff's cheap integer approximation of a square root."""
+    i = 1
+    while n > 0:
+        i <<= 1
+        n >>= 2
+    return i
+
+# --- Myers ---
+
+def clean_mmatch(dis, i, s, e):
+    """Decides whether a line with many matches sits in a run of unmatched lines."""
+    if i - s > XDL_SIMSCAN_WINDOW:
+        s = i - XDL_SIMSCAN_WINDOW
+    if e - i > XDL_SIMSCAN_WINDOW:
+        e = i + XDL_SIMSCAN_WINDOW
+
+    rdis0, rpdis0 = 0, 1
+    r = 1
+    while i - r >= s:
+        if not dis[i - r]:
+            rdis0 += 1
+        elif dis[i - r] == 2:
+            rpdis0 += 1
+        else:
+            break
+        r += 1
+    if rdis0 == 0:
+        return False
+
+    rdis1, rpdis1 = 0, 1
+    r = 1
+    while i + r <= e:
+        if not dis[i + r]:
+            rdis1 += 1
+        elif dis[i + r] == 2:
+            rpdis1 += 1
+        else:
+            break
+        r += 1
+    if rdis1 == 0:
+        return False
+
+    rdis1 += rdis0
+    rpdis1 += rpdis0
+    return rpdis1 * XDL_KPDIS_RUN < rpdis1 + rdis1
+
+def split_box(ha1, off1, lim1, ha2, off2, lim2, kvdf, kvdb, need_min, mxcost):
+    """
+    xdl_split: finds the middle snake of the box with a forward and a
+    backward search. Returns (i1, i2, min_lo, min_hi). kvdf/kvdb are dicts
+    indexed by diagonal.
+    """
+    dmin, dmax = off1 - lim2, lim1 - off2
+    fmid, bmid = off1 - off2, lim1 - lim2
+    odd = (fmid - bmid) & 1
+    fmin = fmax = fmid
+    bmin = bmax = bmid
+
+    kvdf[fmid] = off1
+    kvdb[bmid] = lim1
+
+    ec = 1
+    while True:
+        got_snake = False
+
+        if fmin > dmin:
+            fmin -= 1
+            kvdf[fmin - 1] = -1
+        else:
+            fmin += 1
+        if fmax < dmax:
+            fmax += 1
+            kvdf[fmax + 1] = -1
+        else:
+            fmax -= 1
+
+        for d in range(fmax, fmin - 1, -2):
+            if kvdf[d - 1] >= kvdf[d + 1]:
+                i1 = kvdf[d - 1] + 1
+            else:
+                i1 = kvdf[d + 1]
+            prev1 = i1
+            i2 = i1 - d
+            while i1 < lim1 and i2 < lim2 and ha1[i1] == ha2[i2]:
+                i1 += 1
+                i2 += 1
+            if i1 - prev1 > XDL_SNAKE_CNT:
+                got_snake = True
+            kvdf[d] = i1
+            if odd and bmin <= d <= bmax and kvdb[d] <= i1:
+                return i1, i2, True, True
+
+        if bmin > dmin:
+            bmin -= 1
+            kvdb[bmin - 1] = XDL_LINE_MAX
+        else:
+            bmin += 1
+        if bmax < dmax:
+            bmax += 1
+            kvdb[bmax + 1] = XDL_LINE_MAX
+        else:
+            bmax -= 1
+
+        for d in range(bmax, bmin - 1, -2):
+            if kvdb[d - 1] < kvdb[d + 1]:
+                i1 = kvdb[d - 1]
+            else:
+                i1 = kvdb[d + 1] - 1
+            prev1 = i1
+            i2 = i1 - d
+            while i1 > off1 and i2 > off2 and ha1[i1 - 1] == ha2[i2 - 1]:
+                i1 -= 1
+                i2 -= 1
+            if prev1 - i1 > XDL_SNAKE_CNT:
+                got_snake = True
+            kvdb[d] = i1
+            if not odd and fmin <= d <= fmax and i1 <= kvdf[d]:
+                return i1, i2, True, True
+
+        if need_min:
+            ec += 1
+            continue
+
+        # Expensive box with a good snake: settle for an "interesting" diagonal
+        if got_snake and ec > XDL_HEUR_MIN_COST:
+            best = 0
+            for d in range(fmax, fmin - 1, -2):
+                dd = d - fmid if d > fmid else fmid - d
+                i1 = kvdf[d]
+                i2 = i1 - d
+                v = (i1 - off1) + (i2 - off2) - dd
+                if v > XDL_K_HEUR * ec and v > best and \
+                        off1 + XDL_SNAKE_CNT <= i1 < lim1 and off2 + XDL_SNAKE_CNT <= i2 < lim2:
+                    k = 1
+                    while ha1[i1 - k] == ha2[i2 - k]:
+                        if k == XDL_SNAKE_CNT:
+                            best = v
+                            split = (i1, i2)
+                            break
+                        k += 1
+            if best > 0:
+                return split[0], split[1], True, False
+
+            best = 0
+            for d in range(bmax, bmin - 1, -2):
+                dd = d - bmid if d > bmid else bmid - d
+                i1 = kvdb[d]
+                i2 = i1 - d
+                v = (lim1 - i1) + (lim2 - i2) - dd
+                if v > XDL_K_HEUR * ec and v > best and \
+                        off1 < i1 <= lim1 - XDL_SNAKE_CNT and off2 < i2 <= lim2 - XDL_SNAKE_CNT:
+                    k = 0
+                    while ha1[i1 + k] == ha2[i2 + k]:
+                        if k == XDL_SNAKE_CNT - 1:
+                            best = v
+                            split = (i1, i2)
+                            break
+                        k += 1
+            if best > 0:
+                return split[0], split[1], False, True
+
+        # Enough is enough: take the furthest reaching path
+        if ec >= mxcost:
+            fbest = fbest1 = -1
+            for d in range(fmax, fmin - 1, -2):
+                i1 = min(kvdf[d], lim1)
+                i2 = i1 - d
+                if lim2 < i2:
+                    i1 = lim2 + d
+                    i2 = lim2
+                if fbest < i1 + i2:
+                    fbest = i1 + i2
+                    fbest1 = i1
+
+            bbest = bbest1 = XDL_LINE_MAX
+            for d in range(bmax, bmin - 1, -2):
+                i1 = max(off1, kvdb[d])
+                i2 = i1 - d
+                if i2 < off2:
+                    i1 = off2 + d
+                    i2 = off2
+                if i1 + i2 < bbest:
+                    bbest = i1 + i2
+                    bbest1 = i1
+
+            if (lim1 + lim2) - bbest < fbest - (off1 + off2):
+                return fbest1, fbest - fbest1, True, False
+            return bbest1, bbest - bbest1, False, True
+
+        ec += 1
+
+def myers_marks(ha1, ha2, rchg1, rchg2, base1=0, base2=0):
+    """
+    Runs xdiff's Myers on two int sequences and sets rchg1[base1 + i] /
+    rchg2[base2 + j] for every changed line.
+    """
+    n1, n2 = len(ha1), len(ha2)
+
+    # xdl_trim_ends
+    start = 0
+    limit = min(n1, n2)
+    while start < limit and ha1[start] == ha2[start]:
+        start += 1
+    end = 0
+    while end < limit - start and ha1[n1 - 1 - end] == ha2[n2 - 1 - end]:
+        end += 1
+    dend1, dend2 = n1 - end - 1, n2 - end - 1
+
+    # xdl_cleanup_records: lines with no match on the other side are
+    # changed for sure; lines with very many matches may be set aside too
+    count1, count2 = {}, {}
+    for h in ha1:
+        count1[h] = count1.get(h, 0) + 1
+    for h in ha2:
+        count2[h] = count2.get(h, 0) + 1
+
+    def classify(ha, dstart, dend, other_count, nrec):
+        mlim = min(bogosqrt(nrec), XDL_MAX_EQLIMIT)
+        dis = [0] * (nrec + 1)
+        for i in range(dstart, dend + 1):
+            nm = other_count.get(ha[i], 0)
+            dis[i] = 0 if nm == 0 else (2 if nm >= mlim else 1)
+        return dis
+
+    dis1 = classify(ha1, start, dend1, count2, n1)
+    dis2 = classify(ha2, start, dend2, count1, n2)
+
+    def reduce(ha, dis, dstart, dend, rchg, base):
+        kept, index = [], []
+        for i in range(dstart, dend + 1):
+            if dis[i] == 1 or (dis[i] == 2 and not clean_mmatch(dis, i, dstart, dend)):
+                kept.append(ha[i])
+                index.append(i)
+            else:
+                rchg[base + i] = 1
+        return kept, index
+
+    eff1, index1 = reduce(ha1, dis1, start, dend1, rchg1, base1)
+    eff2, index2 = reduce(ha2, dis2, start, dend2, rchg2, base2)
+
+    mxcost = max(bogosqrt(len(eff1) + len(eff2) + 3), XDL_MAX_COST_MIN)
+    kvdf, kvdb = {}, {}
+
+    # xdl_recs_cmp, with an explicit stack instead of recursion
+    stack = [(0, len(eff1), 0, len(eff2), False)]
+    while stack:
+        off1, lim1, off2, lim2, need_min = stack.pop()
+        while off1 < lim1 and off2 < lim2 and eff1[off1] == eff2[off2]:
+            off1 += 1
+            off2 += 1
+        while off1 < lim1 and off2 < lim2 and eff1[lim1 - 1] == eff2[lim2 - 1]:
+            lim1 -= 1
+            lim2 -= 1
+
+        if off1 == lim1:
+            for i in range(off2, lim2):
+                rchg2[base2 + index2[i]] = 1
+        elif off2 == lim2:
+            for i in range(off1, lim1):
+                rchg1[base1 + index1[i]] = 1
+        else:
+            i1, i2, min_lo, min_hi = split_box(eff1, off1, lim1, eff2, off2, lim2,
+                                               kvdf, kvdb, need_min, mxcost)
+            stack.append((i1, lim1, i2, lim2, min_hi))
+            stack.append((off1, i1, off2, i2, min_lo))
+
+# --- Histogram ---
+
+def find_lcs(ha1, line1, count1, ha2, line2, count2):
+    """
+    xhistogram's find_lcs on 1-based regions. Returns None when Myers must
+    take over, else (begin1, end1, begin2, end2) with begin1 == 0 when
+    the regions share no line.
+    """
+    end_line1 = line1 + count1 - 1
+    end_line2 = line2 + count2 - 1
+
+    # scanA: occurrences of each line of region 1, first occurrence first
+    first = {}    # line id -> first occurrence
+    counts = {}   # line id -> occurrences
+    next_ptr = {}
+    for ptr in range(end_line1, line1 - 1, -1):
+        h = ha1[ptr - 1]
+        if h in first:
+            next_ptr[ptr] = first[h]
+            counts[h] += 1
+        else:
+            counts[h] = 1
+        first[h] = ptr
+
+    best_cnt = HISTOGRAM_MAX_CHAIN + 1
+    has_common = False
+    lcs = [0, 0, 0, 0]
+
+    b_ptr = line2
+    while b_ptr <= end_line2:
+        b_next = b_ptr + 1
+        h = ha2[b_ptr - 1]
+        if h in first:
+            if counts[h] > best_cnt:
+                has_common = True
+            else:
+                has_common = True
+                a_ptr = first[h]
+                while True:
+                    np = next_ptr.get(a_ptr, 0)
+                    as_, bs, ae, be = a_ptr, b_ptr, a_ptr, b_ptr
+                    rc = counts[h]
+
+                    while line1 < as_ and line2 < bs and ha1[as_ - 2] == ha2[bs - 2]:
+                        as_ -= 1
+                        bs -= 1
+                        if 1 < rc:
+                            rc = min(rc, counts[ha1[as_ - 1]])
+                    while ae < end_line1 and be < end_line2 and ha1[ae] == ha2[be]:
+                        ae += 1
+                        be += 1
+                        if 1 < rc:
+                            rc = min(rc, counts[ha1[ae - 1]])
+
+                    if b_next <= be:
+                        b_next = be + 1
+                    if lcs[1] - lcs[0] < ae - as_ or rc < best_cnt:
+                        lcs = [as_, ae, bs, be]
+                        best_cnt = rc
+
+                    if np == 0:
+                        break
+                    while np <= ae:
+                        np = next_ptr.get(np, 0)
+                        if np == 0:
+                            break
+                    if np == 0:
+                        break
+                    a_ptr = np
+        b_ptr = b_next
+
+    if has_common and HISTOGRAM_MAX_CHAIN < best_cnt:
+        return None
+    return tuple(lcs)
+
+def histogram_marks(ha1, ha2, rchg1, rchg2):
+    """Runs xdiff's histogram diff on two int sequences, marking changed lines."""
+    stack = [(1, len(ha1), 1, len(ha2))]
+    while stack:
+        line1, count1, line2, count2 = stack.pop()
+        while True:
+            if count1 <= 0 and count2 <= 0:
+                break
+            if not count1:
+                for i in range(line2, line2 + count2):
+                    rchg2[i - 1] = 1
+                break
+            if not count2:
+                for i in range(line1, line1 + count1):
+                    rchg1[i - 1] = 1
+                break
+
+            lcs = find_lcs(ha1, line1, count1, ha2, line2, count2)
+            if lcs is None:
+                # Every common line is too frequent: classic diff on this region
+                myers_marks(ha1[line1 - 1:line1 - 1 + count1], ha2[line2 - 1:line2 - 1 + count2],
+                            rchg1, rchg2, line1 - 1, line2 - 1)
+                break
+
+            begin1, end1, begin2, end2 = lcs
+            if begin1 == 0 and begin2 == 0:
+                for i in range(line1, line1 + count1):
+                    rchg1[i - 1] = 1
+                for i in range(line2, line2 + count2):
+                    rchg2[i - 1] = 1
+                break
+
+            # Region before the LCS later, region after it right away
+            stack.append((line1, begin1 - line1, line2, begin2 - line2))
+            new_count1 = line1 + count1 - 1 - end1
+            new_count2 = line2 + count2 - 1 - end2
+            line1, count1 = end1 + 1, new_count1
+            line2, count2 = end2 + 1, new_count2
+
+# --- Post-processing (xdl_change_compact) ---
+
+def get_indent(record):
+    indent = 0
+    for char in record:
+        if char not in " \t\n\r\v\f":
+            return indent
+        if char == " ":
+            indent += 1
+        elif char == "\t":
+            indent += 8 - indent % 8
+        if indent >= MAX_INDENT:
+            return MAX_INDENT
+    return -1  # Only whitespace
+
+def measure_split(records, indents, split):
+    nrec = len(records)
+    if split >= nrec:
+        end_of_file, indent = True, -1
+    else:
+        end_of_file, indent = False, indents[split]
+
+    pre_blank, pre_indent = 0, -1
+    for i in range(split - 1, -1, -1):
+        pre_indent = indents[i]
+        if pre_indent != -1:
+            break
+        pre_blank += 1
+        if pre_blank == MAX_BLANKS:
+            pre_indent = 0
+            break
+
+    post_blank, post_indent = 0, -1
+    for i in range(split + 1, nrec):
+        post_indent = indents[i]
+        if post_indent != -1:
+            break
+        post_blank += 1
+        if post_blank == MAX_BLANKS:
+            post_indent = 0
+            break
+
+    return end_of_file, indent, pre_blank, pre_indent, post_blank, post_indent
+
+def score_add_split(measurement, score):
+    end_of_file, m_indent, pre_blank, pre_indent, m_post_blank, post_indent = measurement
+
+    if pre_indent == -1 and pre_blank == 0:
+        score[1] += START_OF_FILE_PENALTY
+    if end_of_file:
+        score[1] += END_OF_FILE_PENALTY
+
+    post_blank = 1 + m_post_blank if m_indent == -1 else 0
+    total_blank = pre_blank + post_blank
+    score[1] += TOTAL_BLANK_WEIGHT * total_blank
+    score[1] += POST_BLANK_WEIGHT * post_blank
+
+    indent = m_indent if m_indent != -1 else post_indent
+    any_blanks = total_blank != 0
+    score[0] += indent
+
+    if indent == -1 or pre_indent == -1:
+        pass
+    elif indent > pre_indent:
+        score[1] += RELATIVE_INDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_INDENT_PENALTY
+    elif indent == pre_indent:
+        pass
+    elif post_indent != -1 and post_indent > indent:
+        score[1] += RELATIVE_OUTDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_OUTDENT_PENALTY
+    else:
+        score[1] += RELATIVE_DEDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_DEDENT_PENALTY
+
+def score_cmp(s1, s2):
+    cmp_indents = (s1[0] > s2[0]) - (s1[0] < s2[0])
+    return INDENT_WEIGHT * cmp_indents + (s1[1] - s2[1])
+
+class Groups:
+    """A cursor over the runs of changed lines of one file (xdlgroup)."""
+
+    def __init__(self, ha, rchg):
+        self.ha = ha
+        self.rchg = rchg  # len(ha) + 1 entries, the last one always 0
+        self.n = len(ha)
+        self.start = self.end = 0
+        while rchg[self.end]:
+            self.end += 1
+
+    def next(self):
+        if self.end == self.n:
+            return False
+        self.start = self.end + 1
+        self.end = self.start
+        while self.rchg[self.end]:
+            self.end += 1
+        return True
+
+    def previous(self):
+        if self.start == 0:
+            return False
+        self.end = self.start - 1
+        self.start = self.end
+        while self.start > 0 and self.rchg[self.start - 1]:
+            self.start -= 1
+        return True
+
+    def slide_down(self):
+        if self.end < self.n and self.ha[self.start] == self.ha[self.end]:
+            self.rchg[self.start] = 0
+            self.start += 1
+            self.rchg[self.end] = 1
+            self.end += 1
+            while self.rchg[self.end]:
+                self.end += 1
+            return True
+        return False
+
+    def slide_up(self):
+        if self.start > 0 and self.ha[self.start - 1] == self.ha[self.end - 1]:
+            self.start -= 1
+            self.rchg[self.start] = 1
+            self.end -= 1
+            self.rchg[self.end] = 0
+            while self.start > 0 and self.rchg[self.start - 1]:
+                self.start -= 1
+            return True
+        return False
+
+def change_compact(ha, rchg, records, ha_other, rchg_other):
+    """
+    xdl_change_compact: slides each group of changed lines to its most
+    readable position (aligned with the other file's changes if possible,
+    otherwise where the indent heuristic scores best).
+    """
+    g = Groups(ha, rchg)
+    go = Groups(ha_other, rchg_other)
+    indents = None
+
+    while True:
+        if g.end != g.start:
+            while True:
+                groupsize = g.end - g.start
+                end_matching_other = -1
+
+                while g.slide_up():
+                    go.previous()
+                earliest_end = g.end
+                if go.end > go.start:
+                    end_matching_other = g.end
+
+                while g.slide_down():
+                    go.next()
+                    if go.end > go.start:
+                        end_matching_other = g.end
+
+                if groupsize == g.end - g.start:
+                    break
+
+            if g.end == earliest_end:
+                pass
+            elif end_matching_other != -1:
+                while go.end == go.start:
+                    g.slide_up()
+                    go.previous()
+            else:
+                if indents is None:
+                    indents = [get_indent(record) for record in records]
+                shift = earliest_end
+                if g.end - groupsize - 1 > shift:
+                    shift = g.end - groupsize - 1
+                if g.end - INDENT_HEURISTIC_MAX_SLIDING > shift:
+                    shift = g.end - INDENT_HEURISTIC_MAX_SLIDING
+                best_shift, best_score = -1, None
+                while shift <= g.end:
+                    score = [0, 0]
+                    score_add_split(measure_split(records, indents, shift), score)
+                    score_add_split(measure_split(records, indents, shift - groupsize), score)
+                    if best_shift == -1 or score_cmp(score, best_score) <= 0:
+                        best_score = score
+                        best_shift = shift
+                    shift += 1
+                while g.end > best_shift:
+                    g.slide_up()
+                    go.previous()
+
+        if not g.next():
+            break
+        go.next()
+
+# --- Output ---
+
+def build_script(rchg1, n1, rchg2, n2):
+    """Turns the change marks into [(i1, i2, chg1, chg2)] (xdl_build_script)."""
+    changes = []
+    i1 = i2 = 0
+    while i1 < n1 or i2 < n2:
+        if rchg1[i1] or rchg2[i2]:
+            s1, s2 = i1, i2
+            while rchg1[i1]:
+                i1 += 1
+            while rchg2[i2]:
+                i2 += 1
+            changes.append((s1, s2, i1 - s1, i2 - s2))
+        else:
+            i1 += 1
+            i2 += 1
+    return changes
+
+def func_line(record):
+    """git's default hunk header: a line starting like an identifier (def_ff)."""
+    data = record.encode("utf-8", "surrogateescape")
+    if data and (data[:1].isalpha() or data[:1] in (b"_", b"$")):
+        data = data[:FUNC_LINE_SIZE]
+        return data.rstrip(b" \t\n\v\f\r")
+    return None
+
+def emit_record(out, prefix, record):
+    out.append(prefix + record)
+    if not record.endswith("\n"):
+        out.append("\n\\ No newline at end of file\n")
+
+def emit_hunks(records1, records2, changes, context=CONTEXT_LINES):
+    """Formats the changes as git's unified diff hunks (xdl_emit_diff)."""
+    out = []
+    n1, n2 = len(records1), len(records2)
+    func = b""
+    func_prev = -1
+
+    k = 0
+    while k < len(changes):
+        # xdl_get_hunk: merge changes separated by at most 2 * context lines
+        last = k
+        while last + 1 < len(changes) and \
+                changes[last + 1][0] - (changes[last][0] + changes[last][2]) <= 2 * context:
+            last += 1
+
+        i1, i2 = changes[k][0], changes[k][1]
+        e_i1, e_i2, e_chg1, e_chg2 = changes[last]
+        s1 = max(i1 - context, 0)
+        s2 = max(i2 - context, 0)
+        lctx = min(context, n1 - (e_i1 + e_chg1), n2 - (e_i2 + e_chg2))
+        e1 = e_i1 + e_chg1 + lctx
+        e2 = e_i2 + e_chg2 + lctx
+
+        # Function line: the closest one above the hunk, not further up
+        # than the previous hunk's start (otherwise the previous one stays)
+        line = s1 - 1
+        while line != func_prev and 0 <= line < n1:
+            found = func_line(records1[line])
+            if found is not None:
+                func = found
+                break
+            line -= 1
+        func_prev = s1 - 1
+
+        c1, c2 = e1 - s1, e2 - s2
+        header = "@@ -" + str(s1 + 1 if c1 else s1) + ("," + str(c1) if c1 != 1 else "")
+        header += " +" + str(s2 + 1 if c2 else s2) + ("," + str(c2) if c2 != 1 else "") + " @@"
+        header = header.encode()
+        if func:
+            room = HUNK_HEADER_SIZE - (len(header) + 1) - 1
+            header += b" " + func[:room]
+        out.append(header.decode("utf-8", "replace") + "\n")
+
+        pos2 = s2
+        while pos2 < i2:
+            emit_record(out, " ", records2[pos2])
+            pos2 += 1
+        p1, p2 = i1, i2
+        for c in range(k, last + 1):
+            ci1, ci2, chg1, chg2 = changes[c]
+            while p1 < ci1 and p2 < ci2:
+                emit_record(out, " ", records2[p2])
+                p1 += 1
+                p2 += 1
+            for j in range(ci1, ci1 + chg1):
+                emit_record(out, "-", records1[j])
+            for j in range(ci2, ci2 + chg2):
+                emit_record(out, "+", records2[j])
+            p1, p2 = ci1 + chg1, ci2 + chg2
+        for j in range(e_i2 + e_chg2, e2):
+            emit_record(out, " ", records2[j])
+
+        k = last + 1
+
+    return "".join(out)
+
+def is_binary(text):
+    """git's check: a NUL byte in the first 8000 bytes."""
+    return text is not None and "\0" in text[:BINARY_CHECK_SIZE]
+
+def fast_path(before, after):
+    """
+    Cheap pre-classification of a change. Returns its kind ("same",
+    "binary", "add", "delete" or "edit") when Myers and histogram are
+    guaranteed to mark exactly the same lines, or None when both have to
+    be run.
+
+    Let P and S be the common prefix and suffix (as xdl_trim_ends finds
+    them) and A, B what remains of the old and new file. The fast path
+    requires:
+
+        * every line of A is absent from the new file and every line of B
+          from the old file (every changed line is unique to its side);
+        * P and S are each empty or contain an anchor, a line that occurs
+          once in the old file (and so, given the above, once in the new).
+
+    Myers then discards all of A and B as unmatched (xdl_cleanup_records)
+    and marks exactly them. Histogram can only match lines of P and S;
+    any run through an anchor lies on the P or S diagonal, and its
+    rarest-first choice always ends on such a run, so it splits off P and
+    S whole and marks exactly A and B too. Identical marks give identical
+    post-processing and output.
+    """
+    if is_binary(before) or is_binary(after):
+        return "binary"
+    records1 = split_records(before or "")
+    records2 = split_records(after or "")
+    n1, n2 = len(records1), len(records2)
+
+    limit = min(n1, n2)
+    prefix = 0
+    while prefix < limit and records1[prefix] == records2[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and records1[n1 - 1 - suffix] == records2[n2 - 1 - suffix]:
+        suffix += 1
+
+    removed = records1[prefix:n1 - suffix]
+    added = records2[prefix:n2 - suffix]
+    if not removed and not added:
+        return "same"
+    if not set(removed).isdisjoint(records2) or not set(added).isdisjoint(records1):
+        return None
+
+    counts = Counter(records1)
+    for part in (records1[:prefix], records1[n1 - suffix:]):
+        if part and not any(counts[record] == 1 for record in part):
+            return None
+
+    if not removed:
+        return "add"
+    if not added:
+        return "delete"
+    return "edit"
+
+def diff_hunks(before, after, algorithm="myers", context=CONTEXT_LINES):
+    """
+    Returns the hunks git would print for before -> after (everything from
+    the first "@@" on), using the given algorithm ("myers" or "histogram").
+    """
+    records1 = split_records(before or "")
+    records2 = split_records(after or "")
+    ha1, ha2 = intern_records(records1, records2)
+    rchg1 = [0] * (len(ha1) + 1)
+    rchg2 = [0] * (len(ha2) + 1)
+
+    if algorithm == "histogram":
+        histogram_marks(ha1, ha2, rchg1, rchg2)
+    elif algorithm == "myers":
+        myers_marks(ha1, ha2, rchg1, rchg2)
+    else:
+        raise ValueError(f"Unknown diff algorithm: {algorithm}")
+
+    change_compact(ha1, rchg1, records1, ha2, rchg2)
+    change_compact(ha2, rchg2, records2, ha1, rchg1)
+    return emit_hunks(records1, records2, build_script(rchg1, len(ha1), rchg2, len(ha2)), context)
+
+def file_diff(old_path, new_path, before, after, algorithm="myers"):
+    """
+    A git-style diff section for one file. It has the same shape as git's
+    output, except for the "index" line (blob ids are not known here).
+    """
+    old_name = f"a/{old_path}" if old_path else "/dev/null"
+    new_name = f"b/{new_path}" if new_path else "/dev/null"
+    header = f"diff --git a/{old_path or new_path} b/{new_path or old_path}\n"
+    if is_binary(before) or is_binary(after):
+        return header + f"Binary files {old_name} and {new_name} differ\n"
+    hunks = diff_hunks(before, after, algorithm)
+    if not hunks:
+        return ""
+    return header + f"--- {old_name}\n+++ {new_name}\n" + hunks
@@ -1,55 +1,202 @@
 import pandas as pd
 import matplotlib.pyplot as plt
+import argparse
+import hashlib
+import json
+import sys
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation
+
+# --- Configuration ---
 INPUT_CSV = "diff_discrepancy_analysis.csv"
 OUTPUT_IMAGE = "discrepancy_stats.png"
+AGGREGATES_DIR = "discrepancy_aggregates"  # Counts of every scan folded in so far
+CHUNK_SIZE = 100000  # Scan rows read at once (only the key columns are kept)
+WINDOW = "month"     # Time window of the breakdown over time: month, quarter or year
+TOP = 15             # Repositories / extensions listed and plotted
 
-def main():
-    if not os.path.exists(INPUT_CSV):
-        print("Error: Input CSV not found!")
-        return
+# These are always reported, even with no mismatches, followed by any other type found
+CATEGORIES = ["Source Code", "Test Code", "README", "LICENSE"]
+COLORS = ['blue', 'orange', 'green', 'red']
+
+# Columns of a scan read by the aggregation (the diffs themselves are never kept)
+SCAN_COLUMNS = ["Repository", "File_Path", "File_Type", "Discrepancy", "Commit_Date"]
+KEYS = ["Repository", "File_Type", "Extension", "Month"]
+NO_EXTENSION = "(none)"
+UNKNOWN = "unknown"  # Month of rows from scans written before Commit_Date existed
+
+MANIFEST = "manifest.json"
+CUBE = "cube.parquet"
+HASH_BLOCK = 1024 * 1024
+
+def file_digests(path, prefix_length=None):
+    """sha1 of a whole file and of its first prefix_length bytes, in one read."""
+    digest = hashlib.sha1()
+    prefix = None
+    with open(path, "rb") as f:
+        if prefix_length is not None:
+            remaining = prefix_length
+            while remaining > 0:
+                block = f.read(min(HASH_BLOCK, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+            prefix = digest.hexdigest()
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest(), prefix
+
+def read_scan(path, offset=0, chunk_size=CHUNK_SIZE):
+    """
+    Yields a scan CSV as DataFrames of its key columns (as strings), from
+    a byte offset that must fall on a row boundary (0 = the whole file).
+    """
+    header = list(pd.read_csv(path, nrows=0).columns)
+    columns = [column for column in SCAN_COLUMNS if column in header]
+    with open(path, "rb") as f:
+        f.seek(offset)
+        if offset and not f.peek(1):
+            return
+        with pd.read_csv(f, chunksize=chunk_size, usecols=columns, dtype=str, keep_default_na=False,
+                         header=None if offset else 0, names=header if offset else None) as reader:
+            yield from reader
+
+def aggregate_chunk(chunk):
+    """Files and discrepancies of one chunk of scan rows, per (repository, file type, extension, month)."""
+    paths = chunk["File_Path"] if "File_Path" in chunk else pd.Series("", index=chunk.index)
+    names = paths.str.rsplit("/", n=1).str[-1]
+    # "setup.py" -> ".py", ".gitignore" and "Makefile" -> no extension
+    extensions = names.str.extract(r"^.+(\.[^.]+)$", expand=False).str.lower().fillna(NO_EXTENSION)
+    if "Commit_Date" in chunk:
+        months = chunk["Commit_Date"].str[:7].where(chunk["Commit_Date"] != "", UNKNOWN)
+    else:
+        months = UNKNOWN
+    keys = pd.DataFrame({"Repository": chunk["Repository"], "File_Type": chunk["File_Type"],
+                         "Extension": extensions, "Month": months,
+                         "Discrepancies": (chunk["Discrepancy"] == "Yes").astype("int64")})
+    return keys.groupby(KEYS, sort=False).agg(Files=("Discrepancies", "size"),
+                                              Discrepancies=("Discrepancies", "sum"))
+
+def aggregate_scan(path, offset=0, chunk_size=CHUNK_SIZE):
+    """Folds every chunk of a scan into one table of counts. Returns (counts, rows read)."""
+    counts = None
+    rows = 0
+    for chunk in read_scan(path, offset, chunk_size):
+        part = aggregate_chunk(chunk)
+        counts = part if counts is None else counts.add(part, fill_value=0).astype("int64")
+        rows += len(chunk)
+    return counts, rows
+
+class AggregateStore:
+    """
+    Discrepancy counts of every scan CSV folded in so far, kept in a
+    directory so that a later run only reads what changed:
+
+        cube.parquet    files and discrepancies per (source CSV, repository,
+                        file type, extension, month)
+        manifest.json   size, sha1 and row count of each source CSV
 
-    # 1. Load Data
-    df = pd.read_csv(INPUT_CSV)
-    
-    # 2. Filter for only Mismatches (Discrepancy == Yes)
-    mismatches = df[df["Discrepancy"] == "Yes"]
-    
-    # 3. Calculate Counts for specific categories
-    # We ensure these keys exist even if count is 0
-    categories = ["Source Code", "Test Code", "README", "LICENSE"]
-    stats = {cat: 0 for cat in categories}
-    
-    # Count them up
-    for file_type in mismatches["File_Type"]:
-        if file_type in stats:
-            stats[file_type] += 1
+    A source seen before is skipped when unchanged, only has its new rows
+    read when it grew by appending (its old contents are a prefix of the
+    new ones, as when a scan is re-run with a higher limit), and is
+    counted again from scratch otherwise.
+    """
+
+    def __init__(self, path, rebuild=False):
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path) and not rebuild:
+            with open(manifest_path) as f:
+                self.sources = json.load(f)["sources"]
+            self.cube = pd.read_parquet(os.path.join(path, CUBE))
         else:
-            # Handle "Other" or unexpected types if necessary
-            pass
+            self.sources = {}
+            self.cube = pd.DataFrame({column: pd.Series(dtype="str") for column in ["Source", *KEYS]} |
+                                     {"Files": pd.Series(dtype="int64"), "Discrepancies": pd.Series(dtype="int64")})
 
-    # Print Text Stats for your Report
-    print("-" * 30)
-    print("FINAL DATASET STATISTICS")
-    print("-" * 30)
-    print(f"Total Files Analyzed: {len(df)}")
-    print(f"Total Discrepancies Found: {len(mismatches)}")
-    print("-" * 30)
-    print("Mismatches by File Type:")
-    for cat, count in stats.items():
-        print(f"  - {cat}: {count}")
+    def fold(self, source, chunk_size=CHUNK_SIZE):
+        """Brings one scan CSV's counts up to date. Returns (what happened, rows read)."""
+        key = os.path.abspath(source)
+        size = os.path.getsize(source)
+        known = self.sources.get(key)
+        offset = 0
+        if known is None:
+            status = "new"
+            digest, _ = file_digests(source)
+        else:
+            digest, prefix = file_digests(source, known["size"])
+            if digest == known["sha1"]:
+                return "unchanged", 0
+            if size > known["size"] and prefix == known["sha1"]:
+                status, offset = "appended", known["size"]
+            else:
+                status = "rewritten"
+                self.cube = self.cube[self.cube["Source"] != key]
+
+        counts, rows = aggregate_scan(source, offset, chunk_size)
+        if counts is not None:
+            counts = counts.reset_index()
+            counts.insert(0, "Source", key)
+            self.cube = pd.concat([self.cube, counts], ignore_index=True) \
+                .groupby(["Source", *KEYS], as_index=False, sort=False)[["Files", "Discrepancies"]].sum()
+        self.sources[key] = {"size": size, "sha1": digest,
+                             "rows": rows + (known["rows"] if status == "appended" else 0)}
+        return status, rows
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        cube_path = os.path.join(self.path, CUBE)
+        self.cube.to_parquet(cube_path + ".tmp", index=False)
+        os.replace(cube_path + ".tmp", cube_path)
+        # The manifest goes last: it only ever describes a cube already on disk
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({"sources": self.sources}, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+def window_labels(months, window):
+    """The month/quarter/year label of every "YYYY-MM" month ("unknown" stays as it is)."""
+    def label(month):
+        if month == UNKNOWN or window == "month":
+            return month
+        if window == "year":
+            return month[:4]
+        return f"{month[:4]}-Q{(int(month[5:7]) - 1) // 3 + 1}"
+    # Only the distinct months are converted
+    return months.map({month: label(month) for month in months.unique()})
+
+def breakdown(cube, column):
+    """Files, discrepancies and discrepancy rate per value of one column, most files first."""
+    table = cube.groupby(column)[["Files", "Discrepancies"]].sum()
+    table["Rate"] = table["Discrepancies"] / table["Files"]
+    return table.sort_values(["Files", "Discrepancies"], ascending=False)
+
+def print_breakdown(title, table, limit=None):
+    shown = table if limit is None else table.head(limit)
+    print(f"{title}:")
+    for key, row in shown.iterrows():
+        print(f"  - {key}: {int(row['Discrepancies'])} of {int(row['Files'])} ({row['Rate'] * 100:.1f}%)")
+    if len(shown) < len(table):
+        print(f"  ... and {len(table) - len(shown)} more")
     print("-" * 30)
 
-    # 4. Generate Plot
+def plot_file_types(by_type, path):
+    """Bar chart of the mismatches of each file type."""
+    types = CATEGORIES + [file_type for file_type in by_type.index if file_type not in CATEGORIES]
+    stats = {file_type: int(by_type["Discrepancies"].get(file_type, 0)) for file_type in types}
+
     plt.figure(figsize=(10, 6))
-    bars = plt.bar(stats.keys(), stats.values(), color=['blue', 'orange', 'green', 'red'])
-    
+    colors = COLORS + ['gray'] * (len(stats) - len(COLORS))
+    bars = plt.bar(stats.keys(), stats.values(), color=colors)
+
     plt.title("Diff Algorithm Discrepancies (Myers vs Histogram)", fontsize=14)
     plt.xlabel("File Artifact Type", fontsize=12)
     plt.ylabel("Number of Mismatches", fontsize=12)
     plt.grid(axis='y', linestyle='--', alpha=0.7)
-    
+
     # Add numbers on top of bars
     for bar in bars:
         height = bar.get_height()
@@ -57,9 +204,119 @@ def main():
                  f'{int(height)}',
                  ha='center', va='bottom')
 
-    # Save
-    plt.savefig(OUTPUT_IMAGE)
-    print(f"Plot saved to {OUTPUT_IMAGE}")
+    plt.savefig(path)
+    plt.close()
+
+def plot_rates(table, title, xlabel, path, limit=TOP):
+    """Horizontal bar chart of the discrepancy rate of the keys with the most files."""
+    shown = table.head(limit).iloc[::-1]  # Largest at the top
+    plt.figure(figsize=(10, max(4, 0.4 * len(shown) + 2)))
+    bars = plt.barh([str(key) for key in shown.index], shown["Rate"] * 100, color='steelblue')
+    plt.title(title, fontsize=14)
+    plt.xlabel("Discrepancy Rate (%)", fontsize=12)
+    plt.ylabel(xlabel, fontsize=12)
+    plt.grid(axis='x', linestyle='--', alpha=0.7)
+    for bar, (_, row) in zip(bars, shown.iterrows()):
+        plt.text(bar.get_width(), bar.get_y() + bar.get_height() / 2,
+                 f" {int(row['Discrepancies'])}/{int(row['Files'])}", va='center')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def plot_timeline(table, window, path):
+    """Mismatches (bars) and discrepancy rate (line) per time window."""
+    table = table.sort_index(key=lambda index: index.map(lambda label: (label == UNKNOWN, label)))
+    labels = [str(label) for label in table.index]
+    fig, counts_axis = plt.subplots(figsize=(max(10, 0.3 * len(labels)), 6))
+    counts_axis.bar(labels, table["Discrepancies"], color='orange', alpha=0.7)
+    counts_axis.set_xlabel(window.capitalize(), fontsize=12)
+    counts_axis.set_ylabel("Number of Mismatches", fontsize=12)
+    counts_axis.tick_params(axis='x', rotation=90)
+    rate_axis = counts_axis.twinx()
+    rate_axis.plot(labels, table["Rate"] * 100, color='blue', marker='o')
+    rate_axis.set_ylabel("Discrepancy Rate (%)", fontsize=12)
+    counts_axis.set_title(f"Diff Algorithm Discrepancies per {window.capitalize()}", fontsize=14)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Discrepancy statistics and plots of Lab 4 scans.")
+    parser.add_argument("--input", nargs="+", default=[INPUT_CSV],
+                        help="Scan CSVs written by analyze_diffs.py (folded into the aggregates)")
+    parser.add_argument("--output", default=OUTPUT_IMAGE,
+                        help="File type plot; the other plots are saved next to it")
+    parser.add_argument("--aggregates", default=AGGREGATES_DIR, help="Directory of the persisted aggregates")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Forget the persisted aggregates and count every input again")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Scan rows read at once")
+    parser.add_argument("--window", choices=["month", "quarter", "year"], default=WINDOW,
+                        help="Time window of the breakdown over time")
+    parser.add_argument("--top", type=int, default=TOP, help="Repositories and extensions listed and plotted")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with instrumentation.Run("generate_stats", args):
+        generate_stats(args)
+
+def generate_stats(args):
+    missing = [path for path in args.input if not os.path.exists(path)]
+    if missing:
+        print(f"Error: Input CSV not found: {', '.join(missing)}")
+        return
+
+    # 1. Fold the scans into the aggregates, one chunk of rows at a time
+    store = AggregateStore(args.aggregates, args.rebuild)
+    with instrumentation.stage("fold") as stage:
+        stage.items = 0
+        for path in args.input:
+            status, rows = store.fold(path, args.chunk_size)
+            stage.items += rows
+            print(f"{path}: {status}" + (f", {rows} rows folded in" if rows else ""))
+        store.save()
+
+    # 2. Everything else comes from the aggregates
+    cube = store.cube
+    cube = cube.assign(Window=window_labels(cube["Month"], args.window))
+    by_type = breakdown(cube, "File_Type")
+    files = int(cube["Files"].sum())
+    mismatches = int(cube["Discrepancies"].sum())
+
+    # Print Text Stats for your Report
+    print("-" * 30)
+    print("FINAL DATASET STATISTICS")
+    print("-" * 30)
+    print(f"Total Files Analyzed: {files} (from {len(store.sources)} scan(s))")
+    print(f"Total Discrepancies Found: {mismatches}")
+    print("-" * 30)
+    types = CATEGORIES + [file_type for file_type in by_type.index if file_type not in CATEGORIES]
+    print_breakdown("Mismatches by File Type",
+                    by_type.reindex(types, fill_value=0).assign(Rate=lambda t: t["Rate"].fillna(0.0)))
+    print_breakdown("Mismatches by Repository", breakdown(cube, "Repository"), args.top)
+    print_breakdown("Mismatches by Extension", breakdown(cube, "Extension"), args.top)
+    print_breakdown(f"Mismatches by {args.window.capitalize()}",
+                    breakdown(cube, "Window").sort_index(), None)
+
+    # 3. Generate Plots
+    with instrumentation.stage("plot", "plots") as stage:
+        base, extension = os.path.splitext(args.output)
+        plot_file_types(by_type, args.output)
+        plots = [args.output]
+        if files:
+            plots.append(f"{base}_by_repository{extension}")
+            plot_rates(breakdown(cube, "Repository"), "Discrepancy Rate by Repository", "Repository",
+                       plots[-1], args.top)
+            plots.append(f"{base}_by_extension{extension}")
+            plot_rates(breakdown(cube, "Extension"), "Discrepancy Rate by File Extension", "Extension",
+                       plots[-1], args.top)
+            plots.append(f"{base}_by_{args.window}{extension}")
+            plot_timeline(breakdown(cube, "Window"), args.window, plots[-1])
+        stage.items = len(plots)
+    print(f"Plot saved to {args.output}")
+    for path in plots[1:]:
+        print(f"Plot saved to {path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,290 @@
+"""
+Times every stage of the lab pipeline on a synthetic repository and
+compares the throughput with a saved baseline.
+
+    python benchmarks/run_benchmarks.py [--commits N] [--files-per-commit M] [--stages ...]
+
+Each stage runs the script's own main() in a fresh process, so caches
+never carry over from one run to the next, and only main() is timed
+(imports and interpreter start-up are not). The Hugging Face models are
+replaced by the tiny local models of common/tiny_models.py, so no
+download is needed.
+
+Results go to --results as JSON, along with the timers and peak RSS that
+each script reports in its --metrics file (common/instrumentation.py).
+The first run (or --update-baseline) also saves them as the baseline;
+later runs fail with exit code 1 when a stage's throughput drops more
+than --threshold below the baseline.
+"""
+from contextlib import redirect_stderr, redirect_stdout
+from importlib import metadata
+import importlib.util
+import multiprocessing
+import subprocess
+import argparse
+import datetime
+import platform
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import synthetic_repo
+
+# --- Configuration ---
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+WORK_DIR = os.path.join(REPO_ROOT, ".cache", "benchmarks")
+BASELINE_FILE = os.path.join(WORK_DIR, "baseline.json")
+RESULTS_FILE = os.path.join(WORK_DIR, "results.json")
+MODELS_DIR = os.path.join(REPO_ROOT, ".cache", "tiny_models")
+REPEAT = 3         # Runs per stage; the fastest one counts
+THRESHOLD = 0.20   # Largest accepted throughput drop against the baseline
+WORKERS = 1        # Passed to the scripts that take --workers
+
+# name -> (script, unit of work, stages whose output it reads)
+STAGES = {
+    "identify_bugs": ("Lab2/identify_bugs.py", "commits", []),
+    "generate_messages": ("Lab2/analyze_diffs.py", "diffs", ["identify_bugs"]),
+    "evaluate_rectifier": ("Lab2/evaluate_rectifier.py", "rows", ["generate_messages"]),
+    "calculate_metrics": ("Lab3/calculate_metrics.py", "rows", ["generate_messages"]),
+    "calculate_similarity": ("Lab3/calculate_similarity.py", "rows", ["calculate_metrics"]),
+    "diff_discrepancies": ("Lab4/analyze_diffs.py", "files", []),
+}
+
+def stage_files(work_dir):
+    """Where every stage reads and writes, inside the work directory."""
+    return {
+        "repo": os.path.join(work_dir, "repo"),
+        "bugs": os.path.join(work_dir, "bug_fixing_commits.csv"),
+        "state": os.path.join(work_dir, "identify_bugs_state.json"),
+        "diffs": os.path.join(work_dir, "diff_analysis.csv"),
+        "evaluation": os.path.join(work_dir, "final_evaluation.csv"),
+        "metrics": os.path.join(work_dir, "lab3_structural_metrics.csv"),
+        "similarity": os.path.join(work_dir, "lab3_final_dataset.csv"),
+        "discrepancies": os.path.join(work_dir, "diff_discrepancy_analysis.csv"),
+    }
+
+def stage_command(name, files, models, workload):
+    """(command line arguments, output file) of a stage."""
+    workers = ["--workers", str(workload["workers"])]
+    if name == "identify_bugs":
+        return ["--repo", files["repo"], "--output", files["bugs"], "--state", files["state"],
+                *workers], files["bugs"]
+    if name == "generate_messages":
+        return ["--repo", files["repo"], "--input", files["bugs"], "--output", files["diffs"],
+                "--model", os.path.join(models, "t5"), "--no-cache"], files["diffs"]
+    if name == "evaluate_rectifier":
+        return ["--input", files["diffs"], "--output", files["evaluation"]], files["evaluation"]
+    if name == "calculate_metrics":
+        return ["--input", files["diffs"], "--output", files["metrics"], *workers], files["metrics"]
+    if name == "calculate_similarity":
+        return ["--input", files["metrics"], "--output", files["similarity"],
+                "--model", os.path.join(models, "roberta"), "--no-cache", *workers], files["similarity"]
+    if name == "diff_discrepancies":
+        return ["--repos", files["repo"], "--limit", str(workload["commits"]), "--output", files["discrepancies"],
+                *workers], files["discrepancies"]
+    raise ValueError(f"Unknown stage {name}")
+
+def _timed_main(script, argv, log_path, results):
+    """Runs in a fresh process: imports a script, then times its main() alone."""
+    # The scripts import their lab's helper modules directly
+    sys.path.insert(0, os.path.dirname(script))
+    with open(log_path, "w") as log, redirect_stdout(log), redirect_stderr(log):
+        spec = importlib.util.spec_from_file_location("benchmarked_script", script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.argv = [script, *argv]
+        start = time.perf_counter()
+        module.main()
+        results.put(time.perf_counter() - start)
+
+def time_stage(script, argv, log_path):
+    """Seconds spent in the script's main() with these arguments."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_timed_main, args=(script, argv, log_path, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"{os.path.relpath(script, REPO_ROOT)} failed, see {log_path}")
+    return results.get()
+
+def count_rows(csv_path):
+    import pandas as pd
+    return len(pd.read_csv(csv_path, usecols=[0]))
+
+def count_items(name, output, files):
+    if name == "identify_bugs":
+        result = subprocess.run(["git", "rev-list", "--count", "HEAD"], cwd=files["repo"],
+                                capture_output=True, text=True, check=True)
+        return int(result.stdout)
+    return count_rows(output)
+
+def ensure_models(models):
+    """Builds the tiny models once; they are reused by later runs."""
+    if all(os.path.exists(os.path.join(models, name, "config.json")) for name in ("t5", "roberta")):
+        return
+    print(f"Building tiny models in {models}...")
+    from common.tiny_models import save_tiny_models
+    save_tiny_models(models)
+
+def needed_stages(selected):
+    """The selected stages plus every stage they read from, in pipeline order."""
+    needed = set()
+
+    def add(name):
+        if name not in needed:
+            needed.add(name)
+            for requirement in STAGES[name][2]:
+                add(requirement)
+
+    for name in selected:
+        add(name)
+    return [name for name in STAGES if name in needed]
+
+def run_benchmarks(workload, stages, repeat=REPEAT, work_dir=WORK_DIR, models=MODELS_DIR):
+    """Generates the repository and times the stages. Returns the results dictionary."""
+    files = stage_files(work_dir)
+    os.makedirs(os.path.join(work_dir, "logs"), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, "metrics"), exist_ok=True)
+
+    start = time.perf_counter()
+    synthetic_repo.build_repository(files["repo"], workload["commits"], workload["files_per_commit"],
+                                    workload["modules"], workload["functions"], workload["bug_fix_ratio"],
+                                    workload["seed"])
+    print(f"Generated a repository of {workload['commits']} commits in {time.perf_counter() - start:.1f}s.")
+    if any(name in needed_stages(stages) for name in ("generate_messages", "calculate_similarity")):
+        ensure_models(models)
+
+    results = {}
+    for name in needed_stages(stages):
+        script, unit, _ = STAGES[name]
+        argv, output = stage_command(name, files, models, workload)
+        log_path = os.path.join(work_dir, "logs", f"{name}.log")
+        metrics_path = os.path.join(work_dir, "metrics", f"{name}.json")
+        argv += ["--metrics", metrics_path]
+        runs = []
+        for _ in range(repeat if name in stages else 1):
+            runs.append(time_stage(os.path.join(REPO_ROOT, script), argv, log_path))
+        if not os.path.exists(output):
+            raise RuntimeError(f"{script} wrote no output, see {log_path}")
+        if name not in stages:
+            continue  # Only run for the stages after it
+
+        items = count_items(name, output, files)
+        seconds = min(runs)
+        with open(metrics_path) as f:
+            metrics = json.load(f)  # Of the last run
+        results[name] = {"unit": unit, "items": items, "seconds": round(seconds, 4),
+                         "runs": [round(run, 4) for run in runs],
+                         "throughput": round(items / max(seconds, 1e-9), 3),
+                         "timers": {timer: values["seconds"] for timer, values in metrics["timers"].items()},
+                         "peak_rss_bytes": metrics["peak_rss_bytes"]}
+        print(f"   {name:<22} {items:>6} {unit:<8} {seconds:8.2f}s  {results[name]['throughput']:10.1f} {unit}/s")
+
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "workload": workload,
+        "stages": results,
+    }
+
+def machine_info():
+    info = {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+    for package in ("torch", "transformers", "pandas"):
+        try:
+            info[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            info[package] = None
+    return info
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Prints each stage's throughput against the baseline. Returns the names
+    of the stages that are more than `threshold` slower.
+    """
+    regressions = []
+    print(f"{'stage':<22} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, stage in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            print(f"{name:<22} {'-':>12} {stage['throughput']:>12.1f}   (new stage)")
+            continue
+        change = stage["throughput"] / max(before["throughput"], 1e-9) - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<22} {before['throughput']:>12.1f} {stage['throughput']:>12.1f} {change * 100:>7.1f}%{flag}")
+    return regressions
+
+def save_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_file, path)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the lab scripts on a synthetic repository.")
+    parser.add_argument("--commits", type=int, default=synthetic_repo.COMMITS, help="Commits in the repository")
+    parser.add_argument("--files-per-commit", type=int, default=synthetic_repo.FILES_PER_COMMIT,
+                        help="Files changed by each commit")
+    parser.add_argument("--modules", type=int, default=synthetic_repo.INITIAL_MODULES,
+                        help="Python modules at the start")
+    parser.add_argument("--functions", type=int, default=synthetic_repo.FUNCTIONS_PER_MODULE,
+                        help="Functions and classes per new module")
+    parser.add_argument("--bug-fix-ratio", type=float, default=synthetic_repo.BUG_FIX_RATIO,
+                        help="Share of commits with a bug-fix message")
+    parser.add_argument("--seed", type=int, default=synthetic_repo.SEED, help="Random seed of the repository")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="--workers of the scripts that take it")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES),
+                        help="Stages to time (the stages they read from run once, untimed)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Runs per stage; the fastest one counts")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Fail when a stage's throughput drops more than this fraction below the baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline JSON file")
+    parser.add_argument("--update-baseline", action="store_true", help="Save this run as the new baseline")
+    parser.add_argument("--results", default=RESULTS_FILE, help="JSON file to write this run's results to")
+    parser.add_argument("--work-dir", default=WORK_DIR, help="Directory for the repository and stage outputs")
+    parser.add_argument("--models", default=MODELS_DIR, help="Directory of the tiny models (built if missing)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    # The tiny models are local; nothing may be fetched from the Hub
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    workload = {"commits": args.commits, "files_per_commit": args.files_per_commit, "modules": args.modules,
+                "functions": args.functions, "bug_fix_ratio": args.bug_fix_ratio, "seed": args.seed,
+                "workers": args.workers}
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["workload"] != workload:
+            print(f"Error: {args.baseline} was recorded for another workload: {baseline['workload']}")
+            print("Run with the same options, or pass --update-baseline.")
+            sys.exit(2)
+
+    print(f"Benchmarking {len(args.stages)} stages, best of {args.repeat} runs...")
+    results = run_benchmarks(workload, args.stages, args.repeat, args.work_dir, args.models)
+    save_json(args.results, results)
+    print(f"Results saved to {args.results}")
+
+    if baseline is None:
+        save_json(args.baseline, results)
+        print(f"Saved as the baseline: {args.baseline}")
+        return
+
+    print("-" * 60)
+    regressions = compare(results, baseline, args.threshold)
+    print("-" * 60)
+    if regressions:
+        print(f"FAILED: {', '.join(regressions)} slower than the baseline by more than {args.threshold:.0%}.")
+        sys.exit(1)
+    print(f"OK: no stage is more than {args.threshold:.0%} slower than the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Builds local git repositories of any size for the benchmarks: a Python
+package with tests, a README and a LICENSE, edited over N commits that
+each touch M files, with a mix of bug-fix and other messages.
+
+    python benchmarks/synthetic_repo.py DIR [--commits N] [--files-per-commit M] ...
+
+The history is written with a single `git fast-import`, so even large
+repositories take seconds. The same seed always gives the same commits.
+"""
+import argparse
+import random
+import shutil
+import subprocess
+import os
+
+# --- Configuration ---
+COMMITS = 200
+FILES_PER_COMMIT = 3
+INITIAL_MODULES = 12
+FUNCTIONS_PER_MODULE = 8
+BUG_FIX_RATIO = 0.4  # Share of commits whose message identify_bugs.py counts as a bug fix
+SEED = 0
+START_TIME = 1_600_000_000  # Commit timestamps start here, one hour apart
+
+# How often each kind of change is made to a Python file
+EDIT_SHAPES = {
+    "modify_lines": 4,     # Change constants and conditions inside a function
+    "insert_guard": 3,     # Add an early-return check at the top of a function
+    "add_function": 2,
+    "remove_function": 1,
+    "move_function": 1,    # Move a function elsewhere in the file (Myers and histogram often disagree)
+    "reindent": 1,         # Whitespace-only change
+}
+
+BUG_FIX_MESSAGES = [
+    "Fix off-by-one in {name}",
+    "Fix crash when {name} gets an empty list",
+    "Resolve issue #{number} in {name}",
+    "Patch wrong limit check in {name}",
+    "Fix error handling of {name}",
+    "Bug: {name} returned the wrong total",
+]
+# None of these contain a bug keyword, even as part of a word
+OTHER_MESSAGES = [
+    "Add {name}",
+    "Refactor {name} for readability",
+    "Tidy up {module}",
+    "Speed up {name}",
+    "Document {name}",
+    "Rename helpers in {module}",
+]
+
+FUNCTION_TEMPLATES = [
+    '''def {name}(values, limit={a}):
+    """Sums the values above the limit, weighted."""
+    total = 0
+    for value in values:
+        if value > limit:
+            total += value * {b}
+        elif value < -{c}:
+            total -= {c}
+    return total
+''',
+    '''def {name}(items, key=None):
+    """Counts the items by key."""
+    counts = {{}}
+    for item in items:
+        name = key(item) if key else item
+        counts[name] = counts.get(name, 0) + {a}
+    return sorted(counts.items(), key=lambda pair: (-pair[1], pair[0]))[:{b}]
+''',
+    '''def {name}(text, width={a}):
+    """Wraps the text at the given width."""
+    lines, line = [], []
+    for word in text.split():
+        if sum(len(part) + 1 for part in line) + len(word) > width:
+            lines.append(" ".join(line))
+            line = []
+        line.append(word)
+    if line:
+        lines.append(" ".join(line))
+    return "\\n".join(lines[:{b}])
+''',
+    '''class {title}:
+    """Keeps the last {a} values."""
+
+    def __init__(self):
+        self.values = []
+
+    def push(self, value):
+        self.values.append(value)
+        if len(self.values) > {a}:
+            self.values.pop(0)
+
+    def mean(self):
+        return sum(self.values) / len(self.values) if self.values else {b}
+''',
+]
+
+README = """# {project}
+
+A generated project used to benchmark the lab scripts.
+
+## Modules
+
+{modules}
+
+## Changes
+
+{notes}
+"""
+
+LICENSE = """MIT License
+
+Copyright (c) {year} Benchmark Authors
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software, to deal in the Software without restriction.
+"""
+
+class SyntheticProject:
+    """The files of the project, kept as lists of top-level blocks so edits stay valid Python."""
+
+    def __init__(self, rng, modules=INITIAL_MODULES, functions=FUNCTIONS_PER_MODULE):
+        self.rng = rng
+        self.counter = 0
+        self.modules = {}  # path -> list of blocks
+        self.tests = {}    # path -> list of blocks
+        self.license_year = 2020
+        self.notes = []
+        for _ in range(modules):
+            self.add_module(functions)
+
+    def new_name(self):
+        self.counter += 1
+        return f"{self.rng.choice(['parse', 'merge', 'score', 'render', 'load', 'scan'])}_{self.counter}"
+
+    def new_block(self, name=None):
+        name = name or self.new_name()
+        template = self.rng.choice(FUNCTION_TEMPLATES)
+        return template.format(name=name, title=name.title().replace("_", ""), a=self.rng.randint(2, 50),
+                               b=self.rng.randint(2, 9), c=self.rng.randint(1, 20))
+
+    def add_module(self, functions=FUNCTIONS_PER_MODULE):
+        index = len(self.modules)
+        path = f"src/module_{index}.py"
+        self.modules[path] = [self.new_block() for _ in range(functions)]
+        self.tests[f"tests/test_module_{index}.py"] = [self.test_block(path, block)
+                                                       for block in self.modules[path][:2]]
+        return path
+
+    @staticmethod
+    def block_name(block):
+        return block.split("(", 1)[0].split(":", 1)[0].split()[-1]
+
+    def test_block(self, module_path, block):
+        module = os.path.splitext(os.path.basename(module_path))[0]
+        name = self.block_name(block)
+        return (f"def test_{name.lower()}():\n    from src.{module} import {name}\n"
+                f"    assert {name} is not None\n")
+
+    def render(self, path):
+        if path == "README.md":
+            modules = "\n".join(f"- `{name}`" for name in sorted(self.modules))
+            notes = "\n".join(f"- {note}" for note in self.notes)
+            return README.format(project="benchmark-project", modules=modules, notes=notes)
+        if path == "LICENSE":
+            return LICENSE.format(year=self.license_year)
+        blocks = self.modules.get(path) or self.tests[path]
+        header = f'"""{os.path.basename(path)}: generated for benchmarks."""\nimport os\n\n'
+        return header + "\n\n".join(blocks)
+
+    def files(self):
+        return sorted(self.modules) + sorted(self.tests) + ["README.md", "LICENSE"]
+
+    def edit(self, path):
+        """Applies a random edit shape to a file. Returns a name for the commit message."""
+        if path == "README.md":
+            self.notes.append(f"Release {len(self.notes) + 1}: {self.rng.choice(['faster', 'smaller', 'cleaner'])} "
+                              f"{self.rng.choice(list(self.modules))}")
+            return "README"
+        if path == "LICENSE":
+            self.license_year += 1
+            return "LICENSE"
+        if path in self.tests:
+            module = path.replace("tests/test_module_", "src/module_")
+            block = self.new_block() if module not in self.modules else self.rng.choice(self.modules[module])
+            self.tests[path].append(self.test_block(module, block))
+            return self.block_name(block)
+
+        blocks = self.modules[path]
+        shapes = list(EDIT_SHAPES)
+        shape = self.rng.choices(shapes, weights=[EDIT_SHAPES[shape] for shape in shapes])[0]
+        if shape == "remove_function" and len(blocks) < 3:
+            shape = "add_function"
+        i = self.rng.randrange(len(blocks))
+        name = self.block_name(blocks[i])
+
+        if shape == "modify_lines":
+            # Numbers change, names (on the first line) stay
+            lines = blocks[i].split("\n")
+            for j in range(1, len(lines)):
+                if any(char.isdigit() for char in lines[j]) and self.rng.random() < 0.5:
+                    lines[j] = "".join(str(self.rng.randint(1, 9)) if char.isdigit() else char
+                                       for char in lines[j])
+            changed = "\n".join(lines)
+            blocks[i] = changed if changed != blocks[i] else insert_guard(blocks[i])
+        elif shape == "insert_guard":
+            blocks[i] = insert_guard(blocks[i])
+        elif shape == "add_function":
+            blocks.insert(self.rng.randrange(len(blocks) + 1), self.new_block())
+        elif shape == "remove_function":
+            blocks.pop(i)
+        elif shape == "move_function":
+            block = blocks.pop(i)
+            blocks.insert(self.rng.randrange(len(blocks) + 1), block)
+        elif shape == "reindent":
+            blocks[i] = blocks[i].replace("\n\n", "\n\n\n", 1) if "\n\n" in blocks[i] else blocks[i] + "\n"
+        return name
+
+def insert_guard(block):
+    """Adds an early return for empty input at the top of a function (or of a class's push method)."""
+    lines = block.split("\n")
+    if block.startswith("class"):
+        j = next(j for j, line in enumerate(lines) if line.strip().startswith("def push"))
+        lines[j + 1:j + 1] = ["        if value is None:", "            return"]
+    else:
+        parameter = lines[0].split("(", 1)[1].split(",")[0].rstrip(")")
+        # After the signature and the one-line docstring
+        lines[2:2] = [f"    if not {parameter}:", "        return None"]
+    return "\n".join(lines)
+
+def commit_message(rng, bug_fix, name, path):
+    templates = BUG_FIX_MESSAGES if bug_fix else OTHER_MESSAGES
+    return rng.choice(templates).format(name=name, module=os.path.basename(path), number=rng.randint(1, 999))
+
+def fast_import_stream(commits=COMMITS, files_per_commit=FILES_PER_COMMIT, modules=INITIAL_MODULES,
+                       functions=FUNCTIONS_PER_MODULE, bug_fix_ratio=BUG_FIX_RATIO, seed=SEED):
+    """Yields the `git fast-import` commands (as bytes) of the whole history."""
+    rng = random.Random(seed)
+    project = SyntheticProject(rng, modules, functions)
+
+    def data(text):
+        encoded = text.encode("utf-8")
+        return b"data %d\n%s\n" % (len(encoded), encoded)
+
+    def commit(number, message, paths, deleted=()):
+        timestamp = START_TIME + number * 3600
+        out = [b"commit refs/heads/main\n", b"mark :%d\n" % (number + 1),
+               b"author Bench <bench@example.com> %d +0000\n" % timestamp,
+               b"committer Bench <bench@example.com> %d +0000\n" % timestamp, data(message)]
+        if number:
+            out.append(b"from :%d\n" % number)
+        for path in deleted:
+            out.append(b"D %s\n" % path.encode("utf-8"))
+        for path in paths:
+            out.append(b"M 100644 inline %s\n" % path.encode("utf-8"))
+            out.append(data(project.render(path)))
+        return b"".join(out)
+
+    yield commit(0, "Initial import", project.files())
+    for number in range(1, commits):
+        bug_fix = rng.random() < bug_fix_ratio
+        if rng.random() < 0.03:
+            paths = [project.add_module(functions)]
+            paths.append(paths[0].replace("src/module_", "tests/test_module_"))
+            name = paths[0]
+        else:
+            candidates = sorted(project.modules) * 4 + sorted(project.tests) + ["README.md", "LICENSE"]
+            paths = sorted(set(rng.sample(candidates, min(files_per_commit, len(candidates)))))
+            names = [project.edit(path) for path in paths]
+            name = names[0]
+        if any(path.startswith("src/") for path in paths) and "README.md" not in paths and rng.random() < 0.1:
+            paths.append("README.md")
+        yield commit(number, commit_message(rng, bug_fix, name, paths[0]), paths)
+
+def build_repository(path, commits=COMMITS, files_per_commit=FILES_PER_COMMIT, modules=INITIAL_MODULES,
+                     functions=FUNCTIONS_PER_MODULE, bug_fix_ratio=BUG_FIX_RATIO, seed=SEED):
+    """Creates (or replaces) a git repository at path with the generated history. Returns path."""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    subprocess.run(["git", "init", "-q", path], check=True)
+    subprocess.run(["git", "symbolic-ref", "HEAD", "refs/heads/main"], cwd=path, check=True)
+    importer = subprocess.Popen(["git", "fast-import", "--quiet"], cwd=path, stdin=subprocess.PIPE)
+    try:
+        for command in fast_import_stream(commits, files_per_commit, modules, functions, bug_fix_ratio, seed):
+            importer.stdin.write(command)
+    finally:
+        importer.stdin.close()
+        if importer.wait() != 0:
+            raise RuntimeError(f"git fast-import failed in {path}")
+    subprocess.run(["git", "reset", "-q", "--hard"], cwd=path, check=True)
+    return path
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic git repository for benchmarks.")
+    parser.add_argument("path", help="Directory to create the repository in (replaced if it exists)")
+    parser.add_argument("--commits", type=int, default=COMMITS, help="Number of commits")
+    parser.add_argument("--files-per-commit", type=int, default=FILES_PER_COMMIT,
+                        help="Files changed by each commit")
+    parser.add_argument("--modules", type=int, default=INITIAL_MODULES, help="Python modules at the start")
+    parser.add_argument("--functions", type=int, default=FUNCTIONS_PER_MODULE,
+                        help="Functions and classes per new module")
+    parser.add_argument("--bug-fix-ratio", type=float, default=BUG_FIX_RATIO,
+                        help="Share of commits with a bug-fix message")
+    parser.add_argument("--seed", type=int, default=SEED, help="Random seed")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    build_repository(args.path, args.commits, args.files_per_commit, args.modules, args.functions,
+                     args.bug_fix_ratio, args.seed)
+    print(f"Created {args.path} with {args.commits} commits.")
+
+if __name__ == "__main__":
+    main()
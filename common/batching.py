@@ -0,0 +1,7 @@
+def length_buckets(lengths, batch_size):
+    """
+    Groups item indices into batches of similar length, so that each
+    padded batch wastes as few tokens as possible.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
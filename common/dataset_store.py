@@ -0,0 +1,244 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Columns that hold whole source files or diffs; they are stored once per
+# distinct content instead of once per row
+BLOB_COLUMNS = ["Source_Code_Before", "Source_Code_Current", "Diff"]
+
+MANIFEST = "manifest.json"
+BLOB_DATA = "blobs.bin"
+BLOB_INDEX = "blobs.parquet"
+ROWS = "rows.parquet"
+COLUMNS_DIR = "columns"
+
+def blob_key(text):
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+def _row_chunks(path, columns, chunk_size):
+    """Tables of exactly chunk_size rows (the last one shorter) read from a parquet file batch by batch."""
+    pending, count = [], 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+        pending.append(batch)
+        count += batch.num_rows
+        while count >= chunk_size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, chunk_size)
+            rest = table.slice(chunk_size)
+            pending, count = rest.to_batches(), rest.num_rows
+    if count:
+        yield pa.Table.from_batches(pending)
+
+class DatasetStore:
+    """
+    Columnar, blob-deduplicated storage for the Lab 2 / Lab 3 datasets.
+
+    A store is a directory holding:
+
+        blobs.bin       every distinct source/diff text once, back to back
+                        (read through a memory map)
+        blobs.parquet   blob hash -> (offset, length) in blobs.bin
+        rows.parquet    the per-row table; blob columns hold hashes
+        columns/*.parquet
+                        one file per column added by a later stage
+        manifest.json   row count, blob columns and added columns
+
+    Stages read only the columns they need and append new columns without
+    rewriting the rows or the blobs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self._index = None
+        self._data = None
+        self._file = None
+
+    # --- Creating a store ---
+
+    @classmethod
+    def create(cls, path, df, blob_columns=BLOB_COLUMNS):
+        """Writes a DataFrame as a new store (replacing any store at path)."""
+        os.makedirs(os.path.join(path, COLUMNS_DIR), exist_ok=True)
+        for name in os.listdir(os.path.join(path, COLUMNS_DIR)):
+            os.remove(os.path.join(path, COLUMNS_DIR, name))
+
+        blob_columns = [column for column in blob_columns if column in df.columns]
+        offsets = {}
+        rows = df.copy()
+        with open(os.path.join(path, BLOB_DATA), "wb") as data:
+            for column in blob_columns:
+                keys = []
+                for text in df[column]:
+                    if not isinstance(text, str):
+                        keys.append(None)
+                        continue
+                    key = blob_key(text)
+                    if key not in offsets:
+                        encoded = text.encode("utf-8", "surrogatepass")
+                        offsets[key] = (data.tell(), len(encoded))
+                        data.write(encoded)
+                    keys.append(key)
+                rows[column] = keys
+
+        index = pa.table({
+            "key": list(offsets),
+            "offset": [offset for offset, _ in offsets.values()],
+            "length": [length for _, length in offsets.values()],
+        })
+        pq.write_table(index, os.path.join(path, BLOB_INDEX))
+        pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), os.path.join(path, ROWS))
+
+        manifest = {"rows": len(df), "columns": list(df.columns),
+                    "blob_columns": blob_columns, "added_columns": []}
+        with open(os.path.join(path, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+        return cls(path)
+
+    @classmethod
+    def from_csv(cls, csv_path, path, blob_columns=BLOB_COLUMNS):
+        """Imports one of the existing CSV datasets into a store."""
+        return cls.create(path, pd.read_csv(csv_path), blob_columns)
+
+    # --- Reading ---
+
+    @property
+    def columns(self):
+        return self.manifest["columns"] + self.manifest["added_columns"]
+
+    def __len__(self):
+        return self.manifest["rows"]
+
+    def _blob_index(self):
+        if self._index is None:
+            table = pq.read_table(os.path.join(self.path, BLOB_INDEX))
+            self._index = dict(zip(table["key"].to_pylist(),
+                                   zip(table["offset"].to_pylist(), table["length"].to_pylist())))
+            size = os.path.getsize(os.path.join(self.path, BLOB_DATA))
+            self._file = open(os.path.join(self.path, BLOB_DATA), "rb")
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        return self._index
+
+    def blob(self, key):
+        """Returns the text stored under a blob hash (None for a missing value)."""
+        if not isinstance(key, str):
+            return None
+        offset, length = self._blob_index()[key]
+        return self._data[offset:offset + length].decode("utf-8", "surrogatepass")
+
+    def read(self, columns=None, blobs=True):
+        """
+        Reads the requested columns into a DataFrame. Blob columns are
+        resolved to their text unless blobs=False, in which case they keep
+        their hashes (handy to deduplicate work by content).
+        """
+        columns = self._check_columns(columns)
+        base = [column for column in columns if column in self.manifest["columns"]]
+        df = pq.read_table(os.path.join(self.path, ROWS), columns=base).to_pandas() \
+            if base else pd.DataFrame(index=range(len(self)))
+        for column in columns:
+            if column in self.manifest["added_columns"]:
+                df[column] = pq.read_table(self._column_file(column)).column(column).to_pandas()
+        return self._resolve(df, columns, blobs)
+
+    def iter_chunks(self, columns=None, chunk_size=10000, blobs=True):
+        """
+        Like read, but yields DataFrames of up to chunk_size rows, so that
+        no column (and no blob text) has to be held whole in memory.
+        """
+        columns = self._check_columns(columns)
+        base = [column for column in columns if column in self.manifest["columns"]]
+        readers = [_row_chunks(os.path.join(self.path, ROWS), base, chunk_size)] if base else []
+        added = [column for column in columns if column in self.manifest["added_columns"]]
+        readers += [_row_chunks(self._column_file(column), [column], chunk_size) for column in added]
+
+        for start in range(0, len(self), chunk_size):
+            df = pd.DataFrame(index=range(start, min(start + chunk_size, len(self))))
+            for reader in readers:
+                table = next(reader)
+                for name in table.column_names:
+                    df[name] = table.column(name).to_pandas().set_axis(df.index)
+            yield self._resolve(df, columns, blobs)
+
+    def _check_columns(self, columns):
+        columns = list(columns) if columns is not None else self.columns
+        unknown = [column for column in columns if column not in self.columns]
+        if unknown:
+            raise KeyError(f"Columns not in store {self.path}: {unknown}")
+        return columns
+
+    def _resolve(self, df, columns, blobs):
+        if blobs:
+            for column in columns:
+                if column in self.manifest["blob_columns"]:
+                    df[column] = [self.blob(key) for key in df[column]]
+        return df[columns]
+
+    # --- Appending ---
+
+    def _column_file(self, column):
+        return os.path.join(self.path, COLUMNS_DIR, f"{column}.parquet")
+
+    def add_columns(self, columns):
+        """
+        Adds (or replaces) per-row columns, e.g. the metrics of a stage.
+        `columns` is a DataFrame or a dict of equally long sequences.
+        """
+        df = pd.DataFrame(columns)
+        if len(df) != len(self):
+            raise ValueError(f"Expected {len(self)} rows, got {len(df)}")
+
+        for column in df.columns:
+            if column in self.manifest["columns"]:
+                raise ValueError(f"{column} is a base column of the store and cannot be replaced")
+            table = pa.table({column: df[column].reset_index(drop=True)})
+            pq.write_table(table, self._column_file(column))
+            if column not in self.manifest["added_columns"]:
+                self.manifest["added_columns"].append(column)
+
+        tmp_file = os.path.join(self.path, MANIFEST + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_file, os.path.join(self.path, MANIFEST))
+
+    def to_csv(self, csv_path, columns=None):
+        """Exports the store (or some of its columns) back to a CSV file."""
+        self.read(columns).to_csv(csv_path, index=False)
+
+    def close(self):
+        if self._file is not None:
+            if isinstance(self._data, mmap.mmap):
+                self._data.close()
+            self._file.close()
+            self._file = None
+            self._index = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Import/export dataset stores.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="Convert a dataset CSV into a store")
+    imp.add_argument("csv")
+    imp.add_argument("store")
+    exp = sub.add_parser("export", help="Write a store back to CSV")
+    exp.add_argument("store")
+    exp.add_argument("csv")
+    exp.add_argument("--columns", nargs="*", help="Only export these columns")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        store = DatasetStore.from_csv(args.csv, args.store)
+        size = os.path.getsize(os.path.join(args.store, BLOB_DATA))
+        print(f"Imported {len(store)} rows into {args.store} ({size / 1024:.0f} KB of unique blobs).")
+    else:
+        DatasetStore(args.store).to_csv(args.csv, args.columns)
+        print(f"Exported {args.store} to {args.csv}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import subprocess
+import uuid
+import os
+
+from common.instrumentation import timer
+
+# Recently read blobs kept in memory (a file's "after" is often the next
+# commit's "before")
+BLOB_CACHE_BYTES = 64 * 1024 * 1024
+NULL_SHA = "0" * 40
+
+# Same diff options GitPython passes for pydriller's modified_files
+DIFF_TREE_OPTIONS = ["-r", "-M", "--root", "--raw", "-z", "--full-index", "--no-color"]
+
+def decode_path(raw):
+    return raw.decode("utf-8", "replace")
+
+class Commit:
+    """Metadata of one commit, read from the raw commit object."""
+
+    def __init__(self, hash, parents, msg, author_name, committer_date):
+        self.hash = hash
+        self.parents = parents
+        self.msg = msg
+        self.author_name = author_name
+        self.committer_date = committer_date
+
+    @property
+    def merge(self):
+        return len(self.parents) > 1
+
+class ModifiedFile:
+    """
+    One file changed by a commit, with the same attributes as pydriller's
+    ModifiedFile. The sources are read from the repository on first use.
+    """
+
+    def __init__(self, repo, old_path, new_path, old_blob, new_blob, status, diff=""):
+        self._repo = repo
+        self.old_path = old_path
+        self.new_path = new_path
+        self.old_blob = old_blob
+        self.new_blob = new_blob
+        self.diff = diff
+        if status == "A":
+            self.change_type = "ADD"
+        elif status == "D":
+            self.change_type = "DELETE"
+        elif status == "R":
+            self.change_type = "RENAME"
+        elif old_blob != new_blob:
+            self.change_type = "MODIFY"
+        else:
+            self.change_type = "UNKNOWN"  # e.g. only the file mode changed
+
+    @property
+    def filename(self):
+        return os.path.basename(self.new_path or self.old_path)
+
+    @property
+    def source_code_before(self):
+        return self._repo.text(self.old_blob)
+
+    @property
+    def source_code(self):
+        return self._repo.text(self.new_blob)
+
+class GitRepository:
+    """
+    Read access to a repository through long-lived git processes:
+
+        git cat-file --batch      commit objects and blob contents
+        git diff-tree --stdin     changed paths (and patches) of a commit
+
+    Requests are written to their stdin and answers read back from their
+    stdout, so mining a history costs no process start per commit or per
+    file. diff-tree echoes any input line that is not an object name; such
+    a line is sent after every commit to mark the end of its answer.
+    Blobs are kept in an LRU cache of BLOB_CACHE_BYTES.
+    """
+
+    def __init__(self, path, cache_bytes=BLOB_CACHE_BYTES):
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self._blobs = OrderedDict()
+        self._cached_bytes = 0
+        self._cat_file = None
+        self._diff_tree = {}  # patch (bool) -> process
+        self._sentinel = f"--end-{uuid.uuid4().hex}--".encode()
+        self.blob_reads = 0
+        self.blob_hits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self, *args):
+        env = dict(os.environ, GIT_FLUSH="1")
+        return subprocess.Popen(["git", *args], cwd=self.path, env=env,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def rev_list(self, target="HEAD", base=None, options=()):
+        """
+        Commit hashes oldest first, in the order pydriller traverses them.
+        `options` are extra rev-list options (e.g. "--min-parents=1").
+        """
+        rev = f"{base}..{target}" if base else target
+        with timer("subprocess"):
+            result = subprocess.run(["git", "rev-list", "--reverse", *options, rev], cwd=self.path,
+                                    capture_output=True, text=True, check=True)
+        return result.stdout.split()
+
+    # --- Objects ---
+
+    def _read_object(self, rev):
+        """Returns (type, raw bytes) of an object, or (None, None) if it is missing."""
+        if self._cat_file is None:
+            self._cat_file = self._start("cat-file", "--batch")
+        process = self._cat_file
+        with timer("git"):
+            process.stdin.write(rev.encode() + b"\n")
+            process.stdin.flush()
+            header = process.stdout.readline().split()
+            if len(header) != 3:
+                return None, None  # "<rev> missing"
+            data = process.stdout.read(int(header[2]))
+            process.stdout.read(1)  # Trailing newline
+        return header[1].decode(), data
+
+    def blob(self, sha):
+        """Raw contents of a blob (None for a missing or null blob)."""
+        if not sha or sha == NULL_SHA:
+            return None
+        self.blob_reads += 1
+        data = self._blobs.get(sha)
+        if data is not None:
+            self.blob_hits += 1
+            self._blobs.move_to_end(sha)
+            return data
+
+        _, data = self._read_object(sha)
+        if data is None:
+            return None
+        if len(data) <= self.cache_bytes:
+            self._blobs[sha] = data
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_bytes:
+                _, evicted = self._blobs.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+        return data
+
+    def text(self, sha):
+        """A blob decoded the way pydriller does (None for missing or empty)."""
+        data = self.blob(sha)
+        return data.decode("utf-8", "ignore") if data else None
+
+    def commit(self, rev):
+        """Parses a commit object into a Commit."""
+        kind, data = self._read_object(rev)
+        if kind != "commit":
+            raise ValueError(f"{rev} is not a commit in {self.path}")
+        head, _, message = data.partition(b"\n\n")
+
+        parents = []
+        author_name = ""
+        committer_date = None
+        encoding = "utf-8"
+        for line in head.split(b"\n"):
+            if line.startswith(b" "):
+                continue  # Continuation of a multi-line header (signatures)
+            key, _, value = line.partition(b" ")
+            if key == b"parent":
+                parents.append(value.decode())
+            elif key == b"author":
+                author_name = value.rsplit(b" <", 1)[0].decode("utf-8", "replace")
+            elif key == b"committer":
+                timestamp, offset = value.rsplit(b" ", 2)[1:]
+                sign = -1 if offset.startswith(b"-") else 1
+                tz = timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+                committer_date = datetime.fromtimestamp(int(timestamp), tz)
+            elif key == b"encoding":
+                encoding = value.decode()
+
+        try:
+            msg = message.decode(encoding, "replace")
+        except LookupError:
+            msg = message.decode("utf-8", "replace")
+        commit_hash = rev if len(rev) == 40 else self.rev_parse(rev)
+        return Commit(commit_hash, parents, msg.strip(), author_name, committer_date)
+
+    def rev_parse(self, rev):
+        with timer("subprocess"):
+            result = subprocess.run(["git", "rev-parse", rev], cwd=self.path,
+                                    capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+
+    def traverse_commits(self, only=None):
+        """Yields the commits of HEAD oldest first, optionally only the given hashes."""
+        wanted = set(only) if only is not None else None
+        for commit_hash in self.rev_list():
+            if wanted is None or commit_hash in wanted:
+                yield self.commit(commit_hash)
+
+    # --- Changes ---
+
+    def _diff_tree_output(self, commit_hash, patch):
+        process = self._diff_tree.get(patch)
+        if process is None:
+            options = DIFF_TREE_OPTIONS + (["-p"] if patch else [])
+            process = self._diff_tree[patch] = self._start("diff-tree", "--stdin", *options)
+        marker = self._sentinel + b"\n"
+        chunks = []
+        with timer("git"):
+            process.stdin.write(commit_hash.encode() + b"\n" + marker)
+            process.stdin.flush()
+            while True:
+                line = process.stdout.readline()
+                if not line:
+                    raise RuntimeError(f"git diff-tree exited while reading {commit_hash}")
+                chunks.append(line)
+                if line.endswith(marker):
+                    break
+        return b"".join(chunks)[:-len(marker)]
+
+    def modified_files(self, commit, patch=False):
+        """
+        Files changed by a commit against its first parent, like pydriller's
+        commit.modified_files (renames detected, nothing for merges). With
+        patch=True each file also gets its diff, starting at the first hunk.
+        """
+        if commit.merge:
+            return []
+        data = self._diff_tree_output(commit.hash, patch)
+        if not data:
+            return []
+
+        # "<commit>\0" then ":<modes> <old> <new> <status>\0<path>\0[<new path>\0]" per file
+        position = data.index(b"\0") + 1
+        entries = []
+        while data[position:position + 1] == b":":
+            end = data.index(b"\0", position)
+            _, _, old_blob, new_blob, status = data[position + 1:end].decode().split(" ")
+            position = end + 1
+            end = data.index(b"\0", position)
+            old_path = new_path = decode_path(data[position:end])
+            position = end + 1
+            if status[0] in "RC":
+                end = data.index(b"\0", position)
+                new_path = decode_path(data[position:end])
+                position = end + 1
+            entries.append((old_path, new_path, old_blob, new_blob, status[0]))
+
+        diffs = [""] * len(entries)
+        if patch:
+            sections = data[position + 1:].split(b"\ndiff --git ")
+            if len(sections) == len(entries):
+                for i, section in enumerate(sections):
+                    start = section.find(b"\n@@")
+                    if start < 0:
+                        start = section.find(b"\nBinary files ")
+                    if start >= 0:
+                        end = len(section) if i == len(sections) - 1 else len(section) + 1
+                        diffs[i] = (section + b"\n")[start + 1:end].decode("utf-8", "ignore")
+
+        files = []
+        for (old_path, new_path, old_blob, new_blob, status), diff in zip(entries, diffs):
+            if old_blob == new_blob:
+                old_blob = new_blob = None  # Mode change only: no contents, as in pydriller
+            files.append(ModifiedFile(self, None if status == "A" else old_path,
+                                      None if status == "D" else new_path,
+                                      None if status == "A" else old_blob,
+                                      None if status == "D" else new_blob, status, diff))
+        return files
+
+    def close(self):
+        for process in [self._cat_file, *self._diff_tree.values()]:
+            if process is not None:
+                process.stdin.close()
+                process.wait()
+                process.stdout.close()
+        self._cat_file = None
+        self._diff_tree = {}
+        self._blobs.clear()
+        self._cached_bytes = 0
@@ -0,0 +1,80 @@
+import numpy as np
+import torch
+
+# --- Configuration ---
+QUANTIZATION = "dynamic-int8"  # Tag added to the cache name of quantized models
+DRIFT_SAMPLE = 32              # Inputs re-run in fp32 to measure the quantization drift
+
+def configure_threads(threads=None, interop_threads=None):
+    """
+    Pins torch's intra-op and inter-op thread pools (None keeps torch's
+    default). The inter-op pool can only be sized before its first use,
+    so that call is skipped once torch has started it.
+    Returns the (intra-op, inter-op) thread counts in effect.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+def quantize(model):
+    """
+    Returns a copy of the model whose nn.Linear layers run in int8, with
+    activations quantized on the fly (weights are converted once). The
+    fp32 model is left untouched, so it can still serve as a reference.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def cache_name(model_name, quantized):
+    """Model name used in cache keys, so int8 and fp32 outputs never mix."""
+    return f"{model_name}+{QUANTIZATION}" if quantized else model_name
+
+def load_models(loader, model_name, quantized=False):
+    """
+    Loads a model with a transformers Auto class in eval mode. Returns
+    (model to run, fp32 reference): the reference is None unless the
+    model is quantized.
+    """
+    model = loader.from_pretrained(model_name)
+    model.eval()
+    if not quantized:
+        return model, None
+    return quantize(model), model
+
+def message_drift(reference, candidate):
+    """Exact-match rate of generated messages, fp32 (reference) vs quantized."""
+    matches = sum(a == b for a, b in zip(reference, candidate))
+    total = len(reference)
+    return {"compared": total, "exact_match": matches / total if total else 1.0}
+
+def similarity_drift(reference, candidate, threshold=None):
+    """
+    Absolute deltas between fp32 and quantized similarity scores. With a
+    threshold, also counts the scores that land on the other side of it.
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    deltas = np.abs(reference - candidate)
+    drift = {
+        "compared": len(deltas),
+        "mean_delta": float(deltas.mean()) if len(deltas) else 0.0,
+        "max_delta": float(deltas.max()) if len(deltas) else 0.0,
+    }
+    if threshold is not None:
+        drift["class_flips"] = int(((reference >= threshold) != (candidate >= threshold)).sum())
+    return drift
+
+def format_drift(drift):
+    """One-line summary of a drift report."""
+    parts = [f"{drift['compared']} compared"]
+    if "exact_match" in drift:
+        parts.append(f"{drift['exact_match'] * 100:.1f}% exact matches")
+    if "mean_delta" in drift:
+        parts.append(f"mean delta {drift['mean_delta']:.4g}, max delta {drift['max_delta']:.4g}")
+    if "class_flips" in drift:
+        parts.append(f"{drift['class_flips']} class flips")
+    return f"Quantization drift vs fp32: {', '.join(parts)}"
@@ -0,0 +1,366 @@
+from contextlib import contextmanager
+import functools
+import datetime
+import threading
+import cProfile
+import pstats
+import json
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# --- Configuration ---
+METRIC_PREFIX = "lab"  # Prefix of every Prometheus metric name
+PROFILE_LINES = 40     # Functions listed in the text summary next to each .pstats dump
+
+class Timer:
+    """Adds the time spent in a `with` block to a named timer."""
+
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+
+class Metrics:
+    """
+    Named timers (seconds and number of calls) and counters, safe to
+    update from several threads. Timers add up the time of every thread,
+    so in a pipeline they can add up to more than the wall time.
+    """
+
+    def __init__(self):
+        self.timers = {}    # name -> [seconds, calls]
+        self.counters = {}  # name -> value
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [seconds, calls]
+            else:
+                timer[0] += seconds
+                timer[1] += calls
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {"timers": {name: list(timer) for name, timer in self.timers.items()},
+                    "counters": dict(self.counters)}
+
+    def merge(self, snapshot):
+        """Adds the timers and counters of a snapshot (e.g. from a worker process)."""
+        for name, (seconds, calls) in snapshot["timers"].items():
+            self.add_time(name, seconds, calls)
+        for name, value in snapshot["counters"].items():
+            self.count(name, value)
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+
+# The metrics of this process, and the Run being recorded (None outside of one)
+METRICS = Metrics()
+_run = None
+_profiling = False  # A StageProfiler is running
+
+def timer(name):
+    """`with timer("git"):` adds the block's time to the process-wide timer `name`."""
+    return METRICS.timer(name)
+
+def count(name, value=1):
+    METRICS.count(name, value)
+
+def _call_measured(function, *args):
+    global METRICS
+    outer, METRICS = METRICS, Metrics()
+    try:
+        return function(*args), METRICS.snapshot()
+    finally:
+        METRICS = outer
+
+def measured(function):
+    """
+    Wraps a function handed to a process pool, so that every call returns
+    (result, the metrics recorded during the call). Pass each of those
+    through merged() in the parent to keep the worker's timers.
+    """
+    return functools.partial(_call_measured, function)
+
+def merged(measured_result):
+    """The result of a measured() call, after adding its metrics to this process's."""
+    result, snapshot = measured_result
+    METRICS.merge(snapshot)
+    return result
+
+def _high_water_mark():
+    """Linux's VmHWM in bytes, or None. Unlike ru_maxrss it is not inherited across exec."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def peak_rss():
+    """
+    Peak resident set size in bytes of this process, and of the largest
+    child process waited for so far (pool workers, git). None without
+    the resource module.
+    """
+    if resource is None:
+        return None, None
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, KiB elsewhere
+    rss = _high_water_mark() or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return rss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+def format_bytes(size):
+    return "n/a" if size is None else f"{size / 1024 ** 2:.1f} MB"
+
+class StageRecord:
+    """Wall time, items processed and peak RSS at the end of one stage of a run."""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = None
+        self.seconds = 0.0
+        self.peak_rss = None
+
+    @property
+    def rate(self):
+        return None if self.items is None else self.items / max(self.seconds, 1e-9)
+
+    def to_dict(self):
+        return {"name": self.name, "seconds": round(self.seconds, 4), "items": self.items, "unit": self.unit,
+                "per_second": None if self.rate is None else round(self.rate, 3),
+                "peak_rss_bytes": self.peak_rss}
+
+class StageProfiler:
+    """
+    cProfile of one stage: of the thread that runs it and of every thread
+    started while it runs (pipeline stages, thread pools), merged into one
+    pstats dump. Work done in worker processes is not profiled.
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.thread_profilers = []
+        self._lock = threading.Lock()
+
+    def _profile_thread(self, frame, event, arg):
+        # Installed by threading.setprofile in every new thread, and called
+        # on its first event: from then on the thread has its own profiler
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.thread_profilers.append(profiler)
+        profiler.enable()
+
+    def start(self):
+        global _profiling
+        _profiling = True
+        threading.setprofile(self._profile_thread)
+        self.profiler.enable()
+
+    def stop(self, path):
+        """Writes the merged profile to `path` and a text summary to `path` + ".txt"."""
+        global _profiling
+        self.profiler.disable()
+        threading.setprofile(None)
+        _profiling = False
+        stats = pstats.Stats(self.profiler)
+        for profiler in self.thread_profilers:
+            stats.add(profiler)
+        stats.dump_stats(path)
+        with open(path + ".txt", "w") as f:
+            pstats.Stats(path, stream=f).sort_stats("cumulative").print_stats(PROFILE_LINES)
+
+def _stop_profiling_in_child():
+    # A forked worker would otherwise keep profiling into a copy that is never written
+    if _profiling:
+        sys.setprofile(None)
+        threading.setprofile(None)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_stop_profiling_in_child)
+
+@contextmanager
+def stage(name, unit="rows"):
+    """
+    Times one stage of the current Run (`with stage("scan", "commits") as s:`
+    then set `s.items`), and profiles it when the run has --profile. Stages
+    do not nest. Outside of a Run only the record is filled in.
+    """
+    run = _run
+    record = StageRecord(name, unit)
+    profiler = StageProfiler() if run is not None and run.profile_dir else None
+    if profiler is not None:
+        profiler.start()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start
+        record.peak_rss = peak_rss()[0]
+        if profiler is not None:
+            path = os.path.join(run.profile_dir, f"{run.script}.{name}.pstats")
+            profiler.stop(path)
+            print(f"   Profile of stage {name} written to {path}")
+        if run is not None:
+            run.stages.append(record)
+
+def add_arguments(parser):
+    """Adds the --metrics, --metrics-prom and --profile options to a script's parser."""
+    parser.add_argument("--metrics", help="Write a JSON summary of the run's timers, counters, "
+                                          "throughput and peak RSS to this file")
+    parser.add_argument("--metrics-prom", help="Write the same summary in the Prometheus text format "
+                                               "(e.g. for node_exporter's textfile collector)")
+    parser.add_argument("--profile", help="Directory to write a cProfile dump (.pstats, plus a .txt "
+                                          "summary) of every stage to")
+
+def _write_atomically(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Run:
+    """
+    Instrumentation of one script run, used as `with Run("script", args):`
+    around everything main() does. Metrics recorded while it is open (by
+    timer(), count() and stage()) are printed as a summary at the end, and
+    written to --metrics as JSON and to --metrics-prom in the Prometheus
+    text format. With --profile every stage also gets a cProfile dump.
+    """
+
+    def __init__(self, script, args):
+        self.script = script
+        self.json_path = getattr(args, "metrics", None)
+        self.prom_path = getattr(args, "metrics_prom", None)
+        self.profile_dir = getattr(args, "profile", None)
+        self.stages = []
+        self.status = "ok"
+        self.started = None
+        self.seconds = 0.0
+        self._start = None
+
+    def __enter__(self):
+        global _run
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+        METRICS.reset()
+        _run = self
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _run
+        _run = None
+        self.seconds = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.status = "failed"
+        print(self.report())
+        summary = self.summary()
+        if self.json_path:
+            _write_atomically(self.json_path, json.dumps(summary, indent=2) + "\n")
+            print(f"Run metrics written to {self.json_path}")
+        if self.prom_path:
+            _write_atomically(self.prom_path, prometheus_text(summary))
+            print(f"Prometheus metrics written to {self.prom_path}")
+
+    def summary(self):
+        snapshot = METRICS.snapshot()
+        rss, children_rss = peak_rss()
+        return {
+            "script": self.script,
+            "started": self.started,
+            "status": self.status,
+            "seconds": round(self.seconds, 4),
+            "stages": [record.to_dict() for record in self.stages],
+            "timers": {name: {"seconds": round(seconds, 4), "calls": calls}
+                       for name, (seconds, calls) in sorted(snapshot["timers"].items())},
+            "counters": dict(sorted(snapshot["counters"].items())),
+            "peak_rss_bytes": rss,
+            "peak_children_rss_bytes": children_rss,
+        }
+
+    def report(self):
+        """The summary as text: stages, timers and counters, one per line."""
+        summary = self.summary()
+        lines = [f"Run summary: {self.script} in {self.seconds:.1f}s, peak RSS "
+                 f"{format_bytes(summary['peak_rss_bytes'])} "
+                 f"(largest child {format_bytes(summary['peak_children_rss_bytes'])})"]
+        for record in self.stages:
+            line = f"   stage {record.name:<18} {record.seconds:8.2f}s"
+            if record.items is not None:
+                line += f"  {record.items:>8} {record.unit} ({record.rate:.1f} {record.unit}/sec)"
+            lines.append(line)
+        for name, timer in summary["timers"].items():
+            lines.append(f"   timer {name:<18} {timer['seconds']:8.2f}s  {timer['calls']:>8} calls")
+        for name, value in summary["counters"].items():
+            lines.append(f"   count {name:<18} {value:>8}")
+        return "\n".join(lines)
+
+def prometheus_text(summary):
+    """A run summary in the Prometheus text exposition format."""
+    script = f'script="{_label(summary["script"])}"'
+    metrics = [
+        ("run_seconds", "Wall time of the run.", [(script, summary["seconds"])]),
+        ("run_success", "1 if the run finished without an exception.",
+         [(script, int(summary["status"] == "ok"))]),
+        ("stage_seconds", "Wall time of each stage.",
+         [(f'{script},stage="{_label(s["name"])}"', s["seconds"]) for s in summary["stages"]]),
+        ("stage_items", "Items processed by each stage.",
+         [(f'{script},stage="{_label(s["name"])}",unit="{_label(s["unit"])}"', s["items"])
+          for s in summary["stages"] if s["items"] is not None]),
+        ("stage_items_per_second", "Throughput of each stage.",
+         [(f'{script},stage="{_label(s["name"])}",unit="{_label(s["unit"])}"', s["per_second"])
+          for s in summary["stages"] if s["per_second"] is not None]),
+        ("timer_seconds_total", "Time spent in each timed operation, summed over threads and workers.",
+         [(f'{script},timer="{_label(name)}"', timer["seconds"]) for name, timer in summary["timers"].items()]),
+        ("timer_calls_total", "Number of timed operations.",
+         [(f'{script},timer="{_label(name)}"', timer["calls"]) for name, timer in summary["timers"].items()]),
+        ("counter_total", "Counters recorded during the run.",
+         [(f'{script},counter="{_label(name)}"', value) for name, value in summary["counters"].items()]),
+        ("peak_rss_bytes", "Peak resident set size of the script, and of its largest child process.",
+         [(f'{script},process="{process}"', summary[key])
+          for process, key in (("self", "peak_rss_bytes"), ("children", "peak_children_rss_bytes"))
+          if summary[key] is not None]),
+    ]
+    lines = []
+    for name, help_text, samples in metrics:
+        if not samples:
+            continue
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        lines.extend(f"{METRIC_PREFIX}_{name}{{{labels}}} {value}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+# --- Configuration ---
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "model_outputs.sqlite")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # Evict least recently used entries above 2 GB
+COMMIT_EVERY = 100  # Writes between commits, so a crash loses little work
+
+def text_hash(text):
+    """Content hash of an input text."""
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+class ModelCache:
+    """
+    Persistent cache of model outputs (generated messages, embeddings).
+
+    Entries are keyed by the model name, the generation/embedding
+    parameters and a hash of the input text, so changing any of them
+    never returns a stale result. The cache lives in one SQLite file and
+    evicts the least recently used entries once it grows past max_bytes.
+    One cache can be shared by the threads of a pipeline.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.pending_writes = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+            " size INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)")
+        self.total_bytes, self.clock = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) FROM entries"
+        ).fetchone()
+
+    @staticmethod
+    def make_key(model_name, params, text):
+        """Builds the cache key for one model call."""
+        settings = json.dumps(params, sort_keys=True)
+        return f"{model_name}|{settings}|{text_hash(text)}"
+
+    def _tick(self):
+        self.clock += 1
+        return self.clock
+
+    def get(self, model_name, params, text):
+        """Returns the cached bytes for this call, or None."""
+        key = self.make_key(model_name, params, text)
+        with self._lock:
+            row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (self._tick(), key))
+            return row[0]
+
+    def put(self, model_name, params, text, value):
+        """Stores the bytes produced for this call."""
+        key = self.make_key(model_name, params, text)
+        with self._lock:
+            old = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), self._tick()),
+            )
+            self.total_bytes += len(value)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+            self.pending_writes += 1
+            if self.pending_writes >= COMMIT_EVERY:
+                self.db.commit()
+                self.pending_writes = 0
+
+    def evict(self):
+        """Drops least recently used entries until the cache fits in max_bytes."""
+        target = int(self.max_bytes * 0.9)
+        rows = self.db.execute("SELECT key, size FROM entries ORDER BY last_used")
+        stale = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            stale.append((key,))
+            self.total_bytes -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def get_text(self, model_name, params, text):
+        value = self.get(model_name, params, text)
+        return None if value is None else value.decode("utf-8")
+
+    def put_text(self, model_name, params, text, output):
+        self.put(model_name, params, text, output.encode("utf-8"))
+
+    def get_vector(self, model_name, params, text):
+        value = self.get(model_name, params, text)
+        return None if value is None else np.frombuffer(value, dtype=np.float32)
+
+    def put_vector(self, model_name, params, text, vector):
+        self.put(model_name, params, text, np.asarray(vector, dtype=np.float32).tobytes())
+
+    def report(self):
+        """One-line summary of cache effectiveness for the run."""
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"Cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
+
+    def close(self):
+        with self._lock:
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import queue
+import copy
+import time
+
+# --- Configuration ---
+QUEUE_SIZE = 64  # Items waiting between two stages; caps what is held in memory
+
+_DONE = object()
+
+class PerThread:
+    """
+    Hands every thread its own deep copy of an object, for things that
+    must not be shared between threads (e.g. a fast tokenizer, whose
+    truncation settings are changed by each call).
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        self._local = threading.local()
+
+    def get(self):
+        if not hasattr(self._local, "obj"):
+            self._local.obj = copy.deepcopy(self.obj)
+        return self._local.obj
+
+class Stage:
+    """
+    One step of a Pipeline. `function` takes a list of up to `batch_size`
+    items and returns the list of items to pass on (usually one per
+    input). With workers > 1 the batch is split into slices that run on a
+    thread pool; results keep their order either way.
+    """
+
+    def __init__(self, name, function, batch_size=1, workers=1):
+        self.name = name
+        self.function = function
+        self.batch_size = batch_size
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0     # Seconds spent in the function
+        self.starved = 0.0  # Seconds waiting for input
+        self.blocked = 0.0  # Seconds waiting for room downstream
+
+    def process(self, batch, executor):
+        if executor is None or len(batch) < 2:
+            return self.function(batch)
+        size = -(-len(batch) // self.workers)
+        slices = [batch[i:i + size] for i in range(0, len(batch), size)]
+        return [item for result in executor.map(self.function, slices) for item in result]
+
+class Pipeline:
+    """
+    Runs a source iterator and a chain of stages on their own threads,
+    connected by bounded queues, and yields the last stage's output in
+    the source's order.
+
+    Every stage works on a different part of the stream at the same time
+    (git reads, tokenization and forward passes all release the GIL), and
+    a full queue makes the stages before it wait, so at most QUEUE_SIZE
+    items sit between two stages at any moment. An exception in any stage
+    stops the pipeline and is raised again from the caller's loop.
+    """
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE, source_name="source"):
+        self.source = Stage(source_name, None)
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._error = None
+
+    def _put(self, stage, channel, item):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                channel.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stage.blocked += time.perf_counter() - start
+
+    def _get(self, stage, channel):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                item = channel.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            item = _DONE
+        stage.starved += time.perf_counter() - start
+        return item
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _run_source(self, iterator, output):
+        stage = self.source
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    stage.busy += time.perf_counter() - start
+                stage.items += 1
+                self._put(stage, output, item)
+        except BaseException as error:
+            self._fail(error)
+        finally:
+            # A generator's cleanup (e.g. closing git processes) runs on its own thread
+            if hasattr(iterator, "close"):
+                iterator.close()
+        self._put(stage, output, _DONE)
+
+    def _run_stage(self, stage, inbox, output):
+        executor = ThreadPoolExecutor(stage.workers) if stage.workers > 1 else None
+        try:
+            finished = False
+            while not finished and not self._stop.is_set():
+                batch = []
+                while len(batch) < stage.batch_size:
+                    item = self._get(stage, inbox)
+                    if item is _DONE:
+                        finished = True
+                        break
+                    batch.append(item)
+                if not batch:
+                    continue
+                start = time.perf_counter()
+                results = stage.process(batch, executor)
+                stage.busy += time.perf_counter() - start
+                stage.items += len(batch)
+                for item in results:
+                    self._put(stage, output, item)
+        except BaseException as error:
+            self._fail(error)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self._put(stage, output, _DONE)
+
+    def run(self, source):
+        """Yields the items coming out of the last stage."""
+        channels = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._run_source, args=(iter(source), channels[0]), daemon=True)]
+        for stage, inbox, output in zip(self.stages, channels, channels[1:]):
+            threads.append(threading.Thread(target=self._run_stage, args=(stage, inbox, output), daemon=True))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            sink = Stage("sink", None)
+            while True:
+                item = self._get(sink, channels[-1])
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+
+    def report(self):
+        """Per-stage summary: items, and the share of the run spent working, starved or blocked."""
+        wall = max(self.elapsed, 1e-9)
+        lines = [f"Pipeline: {self.elapsed:.1f}s, queues of {self.queue_size} items"]
+        for stage in [self.source, *self.stages]:
+            lines.append(f"   {stage.name:<10} {stage.items:>7} items, busy {stage.busy / wall * 100:5.1f}%, "
+                         f"starved {stage.starved / wall * 100:5.1f}%, blocked {stage.blocked / wall * 100:5.1f}%")
+        return "\n".join(lines)
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import os
+
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+# --- Configuration ---
+CHUNK_SIZE = 500  # Rows held in memory at once in --stream mode
+
+def chunked(items, size=CHUNK_SIZE):
+    """Groups any iterable into lists of up to `size` items, lazily."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class BoundedDict(OrderedDict):
+    """
+    A memo that forgets its least recently used entries beyond `size`,
+    for caches whose entries can always be computed again.
+    """
+
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.size:
+            self.popitem(last=False)
+
+def _merge_dtypes(first, second):
+    if first == second:
+        return first
+    if is_numeric_dtype(first) and is_numeric_dtype(second) \
+            and not is_bool_dtype(first) and not is_bool_dtype(second):
+        return first if first.kind == "f" else second  # int + float (or missing values) -> float
+    return object
+
+def csv_dtypes(path, chunk_size=CHUNK_SIZE):
+    """
+    The dtype pd.read_csv infers for every column of the whole file, found
+    in one chunked pass. Reading chunks with these dtypes gives the same
+    values as reading the file at once: a column that is a whole number in
+    one chunk and has blanks in another is still read as float everywhere.
+    Non-numeric columns are read as strings.
+    """
+    dtypes = {}
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        for column, dtype in chunk.dtypes.items():
+            dtypes[column] = _merge_dtypes(dtypes[column], dtype) if column in dtypes else dtype
+    return {column: dtype if is_numeric_dtype(dtype) else str for column, dtype in dtypes.items()}
+
+def read_csv_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yields a CSV file as DataFrames of up to chunk_size rows, typed as in a whole-file read."""
+    dtypes = csv_dtypes(path, chunk_size)
+    with pd.read_csv(path, chunksize=chunk_size, dtype=dtypes) as reader:
+        yield from reader
+
+class CsvAppender:
+    """
+    Writes a CSV file one DataFrame chunk at a time: the header comes from
+    the first chunk, and every chunk is flushed to disk once written. The
+    rows go to a temporary file that replaces `path` on close(), so a run
+    that stops half way never leaves a truncated output behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.columns = None
+        self._tmp_path = path + ".tmp"
+        # Same newline handling as DataFrame.to_csv(path)
+        self._file = open(self._tmp_path, "w", newline="", encoding="utf-8")
+
+    def append(self, df):
+        header = self.columns is None
+        if header:
+            self.columns = list(df.columns)
+        df.to_csv(self._file, index=False, header=header, columns=self.columns)
+        self._file.flush()
+        self.rows += len(df)
+
+    def close(self, discard=False):
+        """Moves the file into place (or deletes it with discard=True)."""
+        if self._file.closed:
+            return
+        if self.columns is None and not discard:
+            pd.DataFrame().to_csv(self._file, index=False)  # What writing an empty table gives
+        self._file.close()
+        if discard:
+            os.remove(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(discard=exc_type is not None)
@@ -0,0 +1,148 @@
+"""
+Small, randomly initialized models with the same architectures as the
+ones the labs download (T5 for commit messages, RoBERTa for CodeBERT),
+built entirely offline. Their tokenizers are byte-level BPE trained on
+this repository's own sources.
+
+    python common/tiny_models.py [--output DIR]
+
+saves both models under DIR (loadable with --model DIR/t5 or
+--model DIR/roberta) and checks the int8 inference mode against fp32.
+"""
+import argparse
+import glob
+import time
+import sys
+import os
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, processors, trainers
+from transformers import (AutoModel, AutoModelForSeq2SeqLM, AutoTokenizer, PreTrainedTokenizerFast,
+                          RobertaConfig, RobertaModel, T5Config, T5ForConditionalGeneration)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import inference
+
+# --- Configuration ---
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, ".cache", "tiny_models")
+VOCAB_SIZE = 1000
+HIDDEN_SIZE = 64
+LAYERS = 2
+HEADS = 4
+SEED = 0
+
+def repository_corpus(root=REPO_ROOT):
+    """The Python sources of this repository, used to train the tokenizers."""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(root, "**", "*.py"), recursive=True)):
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            texts.append(f.read())
+    return texts
+
+def train_tokenizer(corpus, special_tokens, template, **named_tokens):
+    """
+    Trains a byte-level BPE tokenizer on the corpus. `template` is the
+    post-processing template (e.g. "<s> $A </s>") and `named_tokens`
+    the special-token roles (pad_token="<pad>", ...).
+    """
+    tokenizer = Tokenizer(models.BPE(unk_token=named_tokens.get("unk_token")))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=VOCAB_SIZE, special_tokens=special_tokens,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(corpus, trainer)
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single=template, special_tokens=[(token, tokenizer.token_to_id(token))
+                                         for token in special_tokens if token in template])
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, model_max_length=512, **named_tokens)
+
+def tiny_t5(corpus):
+    """A T5ForConditionalGeneration like mamiksik/CommitPredictorT5, scaled down."""
+    tokenizer = train_tokenizer(corpus, ["<pad>", "</s>", "<unk>"], "$A </s>",
+                                pad_token="<pad>", eos_token="</s>", unk_token="<unk>")
+    config = T5Config(vocab_size=len(tokenizer), d_model=HIDDEN_SIZE, d_kv=HIDDEN_SIZE // HEADS,
+                      d_ff=HIDDEN_SIZE * 2, num_layers=LAYERS, num_heads=HEADS,
+                      pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id,
+                      decoder_start_token_id=tokenizer.pad_token_id)
+    torch.manual_seed(SEED)
+    return tokenizer, T5ForConditionalGeneration(config)
+
+def tiny_roberta(corpus):
+    """A RobertaModel like microsoft/codebert-base, scaled down."""
+    tokenizer = train_tokenizer(corpus, ["<s>", "<pad>", "</s>", "<unk>", "<mask>"], "<s> $A </s>",
+                                bos_token="<s>", cls_token="<s>", pad_token="<pad>", eos_token="</s>",
+                                sep_token="</s>", unk_token="<unk>", mask_token="<mask>")
+    config = RobertaConfig(vocab_size=len(tokenizer), hidden_size=HIDDEN_SIZE, num_hidden_layers=LAYERS,
+                           num_attention_heads=HEADS, intermediate_size=HIDDEN_SIZE * 4,
+                           max_position_embeddings=514, pad_token_id=tokenizer.pad_token_id,
+                           bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id)
+    torch.manual_seed(SEED)
+    return tokenizer, RobertaModel(config)
+
+def save_tiny_models(output=DEFAULT_OUTPUT, corpus=None):
+    """Builds both tiny models and saves them. Returns {"t5": path, "roberta": path}."""
+    corpus = corpus if corpus is not None else repository_corpus()
+    paths = {}
+    for name, build in (("t5", tiny_t5), ("roberta", tiny_roberta)):
+        tokenizer, model = build(corpus)
+        paths[name] = os.path.join(output, name)
+        tokenizer.save_pretrained(paths[name])
+        model.save_pretrained(paths[name])
+    return paths
+
+def self_check(paths, corpus, sample=inference.DRIFT_SAMPLE):
+    """
+    Runs both saved models in fp32 and in the int8 inference mode on
+    `sample` snippets of the corpus and prints the drift and timings.
+    """
+    snippets = [text[i:i + 2000] for text in corpus for i in range(0, len(text), 2000)][:sample]
+
+    tokenizer = AutoTokenizer.from_pretrained(paths["t5"])
+    model, reference = inference.load_models(AutoModelForSeq2SeqLM, paths["t5"], quantized=True)
+    inputs = tokenizer(snippets, max_length=512, truncation=True, padding=True, return_tensors="pt")
+    messages = {}
+    for label, runner in (("fp32", reference), ("int8", model)):
+        start = time.perf_counter()
+        with torch.inference_mode():
+            outputs = runner.generate(**inputs, max_length=20)
+        messages[label] = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        print(f"T5 {label}: {len(snippets)} messages in {time.perf_counter() - start:.2f}s")
+    print(f"T5 {inference.format_drift(inference.message_drift(messages['fp32'], messages['int8']))}")
+
+    tokenizer = AutoTokenizer.from_pretrained(paths["roberta"])
+    model, reference = inference.load_models(AutoModel, paths["roberta"], quantized=True)
+    inputs = tokenizer(snippets, max_length=512, truncation=True, padding=True, return_tensors="pt")
+    sims = {}
+    for label, runner in (("fp32", reference), ("int8", model)):
+        start = time.perf_counter()
+        with torch.inference_mode():
+            cls = runner(**inputs).last_hidden_state[:, 0, :]
+        cls = torch.nn.functional.normalize(cls, dim=1)
+        # Similarity of each snippet with the next one, as for before/after pairs
+        sims[label] = (cls[:-1] * cls[1:]).sum(dim=1).tolist()
+        print(f"RoBERTa {label}: {len(snippets)} embeddings in {time.perf_counter() - start:.2f}s")
+    print(f"RoBERTa {inference.format_drift(inference.similarity_drift(sims['fp32'], sims['int8'], 0.8))}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build tiny offline models and check the int8 inference mode.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Directory to save the models in")
+    parser.add_argument("--sample", type=int, default=inference.DRIFT_SAMPLE,
+                        help="Number of inputs compared between fp32 and int8")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--interop-threads", type=int, help="torch inter-op threads")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    threads = inference.configure_threads(args.threads, args.interop_threads)
+    print(f"Using {threads[0]} intra-op / {threads[1]} inter-op threads.")
+
+    corpus = repository_corpus()
+    paths = save_tiny_models(args.output, corpus)
+    for name, path in paths.items():
+        print(f"Saved tiny {name} model to {path}")
+    self_check(paths, corpus, args.sample)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import subprocess
+import random
+import sys
+import os
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "Lab4"))
+import diff_engine
+
+ALGORITHMS = ["myers", "histogram"]
+CORPUS_SIZE = 120
+SEED = 11
+
+# A small vocabulary, so that lines repeat (blank lines, braces, returns...)
+# and the algorithms have ambiguous matches to choose between
+LINES = [
+    "", "", "}", "    return x", "    pass", "    x += 1", "    if x:", "        y = x",
+    "def f(x):", "def g(y):", "class A:", "    def run(self):", "        self.x = 0",
+    "# comment", "import os", "for i in range(10):", "    print(i)", "else:",
+]
+
+def random_text(rng):
+    lines = [rng.choice(LINES) for _ in range(rng.randint(0, 40))]
+    text = "".join(line + "\n" for line in lines)
+    if text and rng.random() < 0.1:
+        text = text[:-1]  # no newline at end of file
+    return text
+
+def mutate(text, rng):
+    """Random insertions, deletions, replacements and moves of lines."""
+    lines = text.splitlines()
+    for _ in range(rng.randint(1, 6)):
+        i = rng.randint(0, len(lines))
+        kind = rng.choice(["insert", "delete", "replace", "move"])
+        if kind == "insert" or not lines:
+            lines[i:i] = [rng.choice(LINES) for _ in range(rng.randint(1, 4))]
+        elif kind == "delete":
+            del lines[i:i + rng.randint(1, 4)]
+        elif kind == "replace":
+            lines[i:i + 1] = [rng.choice(LINES)]
+        else:
+            block = lines[i:i + rng.randint(1, 5)]
+            del lines[i:i + len(block)]
+            j = rng.randint(0, len(lines))
+            lines[j:j] = block
+    mutated = "".join(line + "\n" for line in lines)
+    if mutated and rng.random() < 0.1:
+        mutated = mutated[:-1]
+    return mutated
+
+def corpus():
+    rng = random.Random(SEED)
+    pairs = []
+    for _ in range(CORPUS_SIZE):
+        before = random_text(rng)
+        pairs.append((before, mutate(before, rng)))
+    return pairs
+
+def git_hunks(old_file, new_file, algorithm):
+    """The hunks of `git diff --no-index` (everything from the first "@@" on)."""
+    result = subprocess.run(
+        ["git", "-c", "diff.indentHeuristic=true", "diff", "--no-index", "--no-color", "--no-ext-diff",
+         f"--diff-algorithm={algorithm}", old_file, new_file],
+        capture_output=True, text=True)
+    assert result.returncode in (0, 1), result.stderr
+    start = result.stdout.find("@@")
+    return "" if start < 0 else result.stdout[start:]
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+def test_hunks_match_git_diff(tmp_path, algorithm):
+    old_file, new_file = str(tmp_path / "before.py"), str(tmp_path / "after.py")
+    for n, (before, after) in enumerate(corpus()):
+        with open(old_file, "w", newline="") as f:
+            f.write(before)
+        with open(new_file, "w", newline="") as f:
+            f.write(after)
+        assert diff_engine.diff_hunks(before, after, algorithm) == git_hunks(old_file, new_file, algorithm), \
+            f"pair {n} differs from git diff"
+
+def test_file_diff_section():
+    before, after = "a\nb\nc\n", "a\nB\nc\n"
+    assert diff_engine.file_diff("x.py", "x.py", before, after) == (
+        "diff --git a/x.py b/x.py\n--- a/x.py\n+++ b/x.py\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n")
+    assert diff_engine.file_diff("x.py", "x.py", before, before) == ""
+    assert diff_engine.file_diff("x.bin", "x.bin", "a\0b", "a\0c").endswith("Binary files a/x.bin and b/x.bin differ\n")
+
+def unique_line_corpus():
+    """Edits that add, remove or replace lines found nowhere else, around some repeated lines."""
+    rng = random.Random(SEED)
+    pairs = []
+    for n in range(CORPUS_SIZE):
+        lines = [rng.choice(["", "}"]) if rng.random() < 0.2 else f"line {n}.{i}" for i in range(rng.randint(0, 30))]
+        mutated = lines[:]
+        for m in range(rng.randint(1, 3)):
+            i = rng.randint(0, len(mutated))
+            kind = rng.choice(["insert", "delete", "replace"])
+            if kind == "insert" or not mutated:
+                mutated[i:i] = [f"new {n}.{m}.{j}" for j in range(rng.randint(1, 3))]
+            elif kind == "delete":
+                del mutated[i:i + rng.randint(1, 3)]
+            else:
+                mutated[i:i + 1] = [f"changed {n}.{m}"]
+        pairs.append(("".join(line + "\n" for line in lines), "".join(line + "\n" for line in mutated)))
+    return pairs
+
+FAST_PATH_CASES = [
+    ("a\nb\n", "a\nb\n", "same"),
+    ("", "", "same"),
+    ("a\nb\n", "a\nb\nc\nd\n", "add"),           # pure append
+    ("a\nb\nc\nd\n", "a\nb\n", "delete"),        # pure delete at the end
+    ("a\nb\nc\n", "a\nc\n", "delete"),           # pure delete in the middle
+    (None, "x\ny\n", "add"),                     # added file
+    ("", "x\ny\n", "add"),
+    ("x\ny\n", None, "delete"),                  # deleted file
+    ("a\nb\nc\n", "a\nB\nc\n", "edit"),          # unique-line edit
+    ("a\nb\nc\n", "A\nb\nC\n", None),            # "b" is on both sides of the change
+    ("a\nb\nc\n", "b\na\nc\n", None),            # moved line: changed lines occur on both sides
+    ("{\n}\n{\n}\n", "{\n}\nx\n{\n}\n", None),  # no line of the prefix occurs once
+    ("a\0b", "a\0c", "binary"),
+    ("text\n", "te\0xt\n", "binary"),
+]
+
+@pytest.mark.parametrize("before,after,kind", FAST_PATH_CASES)
+def test_fast_path_kind(before, after, kind):
+    assert diff_engine.fast_path(before, after) == kind
+    if kind not in (None, "binary"):
+        assert diff_engine.diff_hunks(before, after, "myers") == diff_engine.diff_hunks(before, after, "histogram")
+
+def test_fast_path_agrees_with_both_algorithms():
+    taken = 0
+    for n, (before, after) in enumerate(corpus() + unique_line_corpus()):
+        kind = diff_engine.fast_path(before, after)
+        if kind is None:
+            continue
+        taken += 1
+        myers = diff_engine.diff_hunks(before, after, "myers")
+        assert myers == diff_engine.diff_hunks(before, after, "histogram"), f"pair {n} ({kind})"
+        changed = [line[:1] for line in myers.splitlines() if line[:1] in ("+", "-")]
+        expected = {"same": set(), "add": {"+"}, "delete": {"-"}, "edit": {"+", "-"}}[kind]
+        assert set(changed) == expected, f"pair {n} ({kind})"
+    assert taken >= CORPUS_SIZE // 2  # The corpus has to exercise the fast path
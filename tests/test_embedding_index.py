@@ -0,0 +1,63 @@
+import subprocess
+import sys
+import os
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "Lab3"))
+import embedding_index
+
+BEFORE = {
+    "a.py": "def f(x):\n    return x\n\nprint(f(1))",  # No newline at end of file
+    "b.py": "".join(f"line {i}\n" for i in range(20)),
+    "gone.py": "x = 1\n",
+}
+AFTER = {
+    "a.py": "def f(x):\n    return x + 1\n\nprint(f(1))\nprint(f(2))\n",
+    "b.py": "".join(f"line {i}\n" for i in range(20) if i not in (3, 4)).replace("line 15", "line fifteen")
+            + "line 20\n",
+    "new.py": "y = 2\n",
+}
+
+def git(repo, *args):
+    return subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], cwd=repo,
+                          capture_output=True, text=True, check=True).stdout
+
+@pytest.fixture
+def repo(tmp_path):
+    git(tmp_path, "init", "-q")
+    for name, text in BEFORE.items():
+        (tmp_path / name).write_text(text)
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-qm", "before")
+    for name in BEFORE:
+        os.remove(tmp_path / name)
+    for name, text in AFTER.items():
+        (tmp_path / name).write_text(text)
+    git(tmp_path, "add", "-A")
+    return tmp_path
+
+@pytest.mark.parametrize("context", [0, 3])
+def test_diff_pairs_rebuilds_whole_files(repo, context):
+    diff = git(repo, "diff", "--cached", f"-U{context}")
+    pairs = embedding_index.diff_pairs(str(repo), diff)
+    # Only modified files have a change vector
+    assert pairs == [(BEFORE["a.py"], AFTER["a.py"]), (BEFORE["b.py"], AFTER["b.py"])]
+
+def test_diff_pairs_plain_diff(repo):
+    # No "diff --git" or "index" lines: the before version comes from HEAD
+    diff = git(repo, "diff", "--cached", "--no-prefix", "--", "b.py")
+    diff = "".join(line for line in diff.splitlines(keepends=True)
+                   if not line.startswith(("diff --git", "index ")))
+    assert embedding_index.diff_pairs(str(repo), diff) == [(BEFORE["b.py"], AFTER["b.py"])]
+
+def test_diff_pairs_rejects_a_diff_that_does_not_apply(repo):
+    diff = git(repo, "diff", "--cached", "--", "b.py").replace(" line 2\n", " line two\n")
+    with pytest.raises(ValueError):
+        embedding_index.diff_pairs(str(repo), diff)
+
+def test_k_must_be_positive(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["embedding_index.py", "--index", "idx", "--diff", "-", "-k", "0"])
+    with pytest.raises(SystemExit):
+        embedding_index.parse_args()
@@ -0,0 +1,68 @@
+import sys
+import os
+
+import pytest
+import torch
+from transformers import AutoModel, AutoModelForSeq2SeqLM, AutoTokenizer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from common import inference, tiny_models
+
+# How far the int8 mode may drift from fp32 on the tiny models
+MIN_EXACT_MATCH = 0.9        # Share of generated messages identical to fp32
+MAX_SIMILARITY_DELTA = 1e-3  # Largest change of a cosine similarity
+SIMILARITY_THRESHOLD = 0.8
+
+@pytest.fixture(scope="module")
+def corpus():
+    return tiny_models.repository_corpus()
+
+@pytest.fixture(scope="module")
+def paths(tmp_path_factory, corpus):
+    return tiny_models.save_tiny_models(str(tmp_path_factory.mktemp("tiny_models")), corpus)
+
+@pytest.fixture(scope="module")
+def snippets(corpus):
+    return [text[i:i + 2000] for text in corpus for i in range(0, len(text), 2000)][:inference.DRIFT_SAMPLE]
+
+def test_quantized_messages_stay_close(paths, snippets):
+    tokenizer = AutoTokenizer.from_pretrained(paths["t5"])
+    model, reference = inference.load_models(AutoModelForSeq2SeqLM, paths["t5"], quantized=True)
+    assert reference is not None and model is not reference
+    inputs = tokenizer(snippets, max_length=512, truncation=True, padding=True, return_tensors="pt")
+    messages = {}
+    for label, runner in (("fp32", reference), ("int8", model)):
+        with torch.inference_mode():
+            outputs = runner.generate(**inputs, max_length=20)
+        messages[label] = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    drift = inference.message_drift(messages["fp32"], messages["int8"])
+    assert drift["compared"] == len(snippets)
+    assert drift["exact_match"] >= MIN_EXACT_MATCH
+
+def test_quantized_similarities_stay_close(paths, snippets):
+    tokenizer = AutoTokenizer.from_pretrained(paths["roberta"])
+    model, reference = inference.load_models(AutoModel, paths["roberta"], quantized=True)
+    inputs = tokenizer(snippets, max_length=512, truncation=True, padding=True, return_tensors="pt")
+    sims = {}
+    for label, runner in (("fp32", reference), ("int8", model)):
+        with torch.inference_mode():
+            cls = torch.nn.functional.normalize(runner(**inputs).last_hidden_state[:, 0, :], dim=1)
+        sims[label] = (cls[:-1] * cls[1:]).sum(dim=1).tolist()
+
+    drift = inference.similarity_drift(sims["fp32"], sims["int8"], SIMILARITY_THRESHOLD)
+    assert drift["compared"] == len(snippets) - 1
+    assert drift["max_delta"] <= MAX_SIMILARITY_DELTA
+    assert drift["class_flips"] == 0
+
+def test_unquantized_has_no_reference(paths):
+    model, reference = inference.load_models(AutoModel, paths["roberta"])
+    assert reference is None and not model.training
+
+def test_cache_name_separates_int8_from_fp32(paths):
+    for path in paths.values():
+        assert inference.cache_name(path, False) == path
+        assert inference.cache_name(path, True) != inference.cache_name(path, False)
+        assert inference.QUANTIZATION in inference.cache_name(path, True)
+    assert inference.cache_name(paths["t5"], True) != inference.cache_name(paths["roberta"], True)
@@ -0,0 +1,58 @@
+import sys
+import os
+
+import pandas as pd
+import pytest
+import sacrebleu
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "Lab3"))
+from token_bleu import batch_token_similarity
+
+DATASET = os.path.join(ROOT, "Lab3", "lab3_final_dataset.csv")
+TOLERANCE = 1e-9  # Same as calculate_similarity.VERIFY_TOLERANCE
+
+def sacrebleu_similarity(hypothesis, reference):
+    """Per-row BLEU exactly as calculate_similarity.get_token_similarity computes it."""
+    if not isinstance(hypothesis, str) or not isinstance(reference, str):
+        return 0.0
+    if not hypothesis.strip() or not reference.strip():
+        return 0.0
+    return sacrebleu.corpus_bleu([hypothesis], [[reference]]).score / 100.0
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_matches_committed_token_similarity(workers):
+    df = pd.read_csv(DATASET)
+    # BLEU compares the 'hypothesis' (after) against the 'reference' (before)
+    scores = batch_token_similarity(df["Source_Code_Current"].tolist(), df["Source_Code_Before"].tolist(), workers)
+    assert len(scores) == len(df)
+    assert max(abs(new - old) for new, old in zip(scores, df["Token_Similarity"])) <= TOLERANCE
+
+EDGE_CASES = [
+    ("", "x = 1"),
+    ("x = 1", ""),
+    ("   \n", "x = 1"),
+    (None, "x = 1"),
+    (float("nan"), "x = 1"),
+    ("x", "x"),
+    ("x", "y"),
+    ("x", "x = 1\nprint(x)\n"),
+    ("def f(a):\n    return a + 1\n", "def f(a):\n    return a + 1\n"),
+    ("def f(a):\n    return a + 2\n", "def f(a):\n    return a + 1\n"),
+    ("a b c d e f", "f e d c b a"),
+]
+
+def test_matches_sacrebleu_on_edge_cases():
+    hypotheses = [hypothesis for hypothesis, _ in EDGE_CASES]
+    references = [reference for _, reference in EDGE_CASES]
+    scores = batch_token_similarity(hypotheses, references)
+    for (hypothesis, reference), score in zip(EDGE_CASES, scores):
+        assert score == pytest.approx(sacrebleu_similarity(hypothesis, reference), abs=TOLERANCE), \
+            (hypothesis, reference)
+
+def test_repeated_pairs_score_alike():
+    pair = ("x = compute(a, b)\n", "x = compute(a)\n")
+    scores = batch_token_similarity([pair[0]] * 3 + [""], [pair[1]] * 3 + ["y"])
+    assert scores[:3] == [scores[0]] * 3
+    assert scores[0] == pytest.approx(sacrebleu_similarity(*pair), abs=TOLERANCE)
+    assert scores[3] == 0.0